@@ -0,0 +1 @@
+"""Benchmarks of the ingest and rendering hot paths, run with asv (see asv.conf.json)."""
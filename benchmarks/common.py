@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmarks."""
+
+import os
+import shutil
+import tempfile
+
+# Sizes of the synthetic cruises, in pings (ingest) or hours (rendering)
+SCALES = [1_000, 10_000, 100_000]
+
+
+class InTemporaryDirectory:
+    """
+    Base class of the benchmarks writing files.
+
+    The synthetic cruises are written once by `setup_cache`, which asv runs in a
+    separate process so that their generation does not count in the peak memory.
+    `transform_netCDF` writes to ./transformed_netCDF/, so each benchmark then runs
+    in its own temporary directory, removed at teardown.
+    """
+
+    def enter(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp(prefix="xsadcp-bench-")
+        os.chdir(self.tmp)
+        os.makedirs("transformed_netCDF", exist_ok=True)
+
+    def teardown(self, *params):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
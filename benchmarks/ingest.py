@@ -0,0 +1,57 @@
+"""Ingest: from the SeaDataNet files to the transformed netCDF and the catalog."""
+
+import os
+
+import xsadcp
+from xsadcp.synthetic import write_synthetic_sdn
+
+from .common import SCALES, InTemporaryDirectory
+
+QC_PATTERNS = ["random", "deep"]
+
+
+class Ingest(InTemporaryDirectory):
+    """Time and peak memory of the transformation of one cruise, by number of pings and QC pattern."""
+
+    params = (SCALES, QC_PATTERNS)
+    param_names = ["maxt", "qc_pattern"]
+    timeout = 600
+
+    def setup_cache(self):
+        for maxt in SCALES:
+            for qc_pattern in QC_PATTERNS:
+                write_synthetic_sdn(f"cruise_{maxt}_{qc_pattern}.nc", maxt=maxt, maxz=50, gaps=5,
+                                    qc_pattern=qc_pattern)
+        return os.getcwd() + "/"
+
+    def setup(self, cache, maxt, qc_pattern):
+        self.enter()
+        self.file_name = f"cruise_{maxt}_{qc_pattern}.nc"
+        self.ds = xsadcp.open_ds(self.file_name, base_path=cache)
+
+    def time_fix_time(self, cache, maxt, qc_pattern):
+        xsadcp.fix_time(self.ds.squeeze()).TIME.values
+
+    def peakmem_fix_time(self, cache, maxt, qc_pattern):
+        xsadcp.fix_time(self.ds.squeeze()).TIME.values
+
+    def time_transform_netCDF(self, cache, maxt, qc_pattern):
+        xsadcp.transform_netCDF(self.ds, self.file_name)
+
+    def peakmem_transform_netCDF(self, cache, maxt, qc_pattern):
+        xsadcp.transform_netCDF(self.ds, self.file_name)
+
+    def time_transform_netCDF_chunked(self, cache, maxt, qc_pattern):
+        xsadcp.transform_netCDF_chunked(self.file_name, base_path=cache, max_memory="64MB")
+
+    def peakmem_transform_netCDF_chunked(self, cache, maxt, qc_pattern):
+        xsadcp.transform_netCDF_chunked(self.file_name, base_path=cache, max_memory="64MB")
+
+    def time_get_info(self, cache, maxt, qc_pattern):
+        xsadcp.get_info(self.file_name, base_path=cache)
+
+    def time_get_info_metadata(self, cache, maxt, qc_pattern):
+        xsadcp.get_info(self.file_name, base_path=cache, transform=False)
+
+    def peakmem_get_info_metadata(self, cache, maxt, qc_pattern):
+        xsadcp.get_info(self.file_name, base_path=cache, transform=False)
@@ -0,0 +1,97 @@
+"""Rendering: the steps run by the viewer each time a widget changes."""
+
+import os
+
+import xsadcp
+from xsadcp.synthetic import write_synthetic_sdn
+
+from .common import SCALES, InTemporaryDirectory
+
+
+def first_half_box(ds, hours):
+    """Longitude and latitude ranges of the box around the first half of the track."""
+    lon, lat = ds.LONGITUDE.values, ds.LATITUDE.values
+    half = slice(0, hours // 2)
+    return (float(min(lon[half])), float(max(lon[half]))), (float(min(lat[half])), float(max(lat[half])))
+
+
+class Render(InTemporaryDirectory):
+    """Time and peak memory of the viewer's hot path on an hourly cruise, by number of hours."""
+
+    params = SCALES
+    param_names = ["hours"]
+    timeout = 600
+
+    def setup_cache(self):
+        import cartopy.crs as ccrs
+
+        # Hourly pings, stored as the groups of the zarr store read by the viewer
+        os.makedirs("transformed_netCDF", exist_ok=True)
+        for hours in SCALES:
+            file_name = f"cruise_{hours}.nc"
+            write_synthetic_sdn(file_name, maxt=hours, maxz=50, gaps=5, time_step=3600)
+            ds = xsadcp.transform_netCDF(xsadcp.open_ds(file_name, base_path="./"), file_name)
+            ds = xsadcp.resample_1h(ds)
+            ds.to_netcdf(f"hourly_{hours}.nc")
+            # Cartopy downloads the Natural Earth features of the box on first use: fetch them here,
+            # so that the timed runs only read the local copies
+            xsadcp.util.base_map_layers(*first_half_box(ds, hours), ccrs.Mercator())
+        return os.getcwd() + "/"
+
+    def setup(self, cache, hours):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import cartopy.crs as ccrs
+        import xarray as xr
+
+        self.enter()
+        self.ds = xr.load_dataset(cache + f"hourly_{hours}.nc")
+        self.lon, self.lat = first_half_box(self.ds, hours)
+        self.filtered = xsadcp.filter_data(self.ds, self.lon, self.lat)
+        self.coarsened = xsadcp.corsen_data(self.filtered, 100)
+        self.depths = [(-200, -100), (-300, -200), (-400, -300)]
+        self.fig, self.ax = plt.subplots(subplot_kw={"projection": ccrs.Mercator()})
+        # The base map layers are cached after the first drawing, as in the viewer
+        self.vectors_plot()
+
+    def vectors_plot(self):
+        return xsadcp.vectors_plot(self.filtered, None, self.lon, self.lat, *self.depths,
+                                   scale_factor=0.5, sample=100,
+                                   depth_2_checkbox=True, depth_3_checkbox=True)
+
+    def time_filter_data(self, cache, hours):
+        xsadcp.filter_data(self.ds, self.lon, self.lat)
+
+    def peakmem_filter_data(self, cache, hours):
+        xsadcp.filter_data(self.ds, self.lon, self.lat)
+
+    def time_corsen_data(self, cache, hours):
+        xsadcp.corsen_data(self.filtered, 100).load()
+
+    def time_quiver_depth_filtered(self, cache, hours):
+        xsadcp.quiver_depth_filtered(self.ax, self.coarsened, self.depths[0], 0.5).remove()
+
+    def time_depth_band_means(self, cache, hours):
+        xsadcp.depth_band_means(self.filtered, self.depths)
+
+    def time_vectors_plot(self, cache, hours):
+        self.vectors_plot()
+
+    def peakmem_vectors_plot(self, cache, hours):
+        self.vectors_plot()
+
+    def time_vectors_plot_png(self, cache, hours):
+        xsadcp.figure_to_png(self.vectors_plot())
+
+    def time_bathy_uship_vship_bottom_depth(self, cache, hours):
+        xsadcp.bathy_uship_vship_bottom_depth(self.filtered)
+
+    def peakmem_bathy_uship_vship_bottom_depth(self, cache, hours):
+        xsadcp.bathy_uship_vship_bottom_depth(self.filtered)
+
+    def time_section_aggregate(self, cache, hours):
+        xsadcp.aggregate_section(xsadcp.section_components(self.ds).SPEED, width=800, height=250)
+
+    def peakmem_section_aggregate(self, cache, hours):
+        xsadcp.aggregate_section(xsadcp.section_components(self.ds).SPEED, width=800, height=250)
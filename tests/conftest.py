@@ -0,0 +1,11 @@
+"""Fixtures shared by the tests."""
+
+import pytest
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Working directory with the transformed_netCDF/ folder written by transform_netCDF."""
+    (tmp_path / "transformed_netCDF").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,87 @@
+"""Tests of the QC policies of xsadcp.qc against the masking of the first versions of transform_netCDF."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xsadcp.qc import PER_VARIABLE_POLICY, load_policy
+from xsadcp.synthetic import GOOD, qc_flags, synthetic_sdn
+from xsadcp.util import fix_time, transform_netCDF
+
+VARIABLES = ["USHIP", "VSHIP", "BATHY", "BOTTOM_DEPTH", "UCUR", "VCUR"]
+
+
+def flagged_cruise(pattern, seed=0, bad="4"):
+    """Synthetic cruise whose data and ship velocity QC variables have samples flagged with one of `bad`."""
+    rng = np.random.default_rng(seed)
+    ds = synthetic_sdn(maxt=300, maxz=12, qc_pattern=pattern, qc_fraction=0.2, seed=seed)
+    for name in ["UCUR", "VCUR", "USHIP", "VSHIP", "BATHY", "BOTTOM_DEPTH"]:
+        if name in ("UCUR", "VCUR"):
+            values = ds[name + "_SEADATANET_QC"].values[0].copy()
+        else:
+            values = qc_flags((300, 12), pattern, 0.1, rng)
+        flagged = values != GOOD
+        values[flagged] = rng.choice([ord(flag) for flag in bad], flagged.sum())
+        ds[name + "_SEADATANET_QC"] = (("INSTANCE", "MAXT", "MAXZ"), values[None])
+    return ds
+
+
+def prepared(ds):
+    """The steps of transform_netCDF before the QC masking."""
+    ds = ds.squeeze().set_xindex("TIME")
+    ds["PROFZ"] = -(ds.PROFZ.isel(MAXT=0))
+    return ds
+
+
+def finished(ds):
+    """The steps of transform_netCDF after the QC masking."""
+    return fix_time(ds[["TIME"] + VARIABLES]).swap_dims({"MAXZ": "PROFZ"}).set_xindex("TIME")
+
+
+@pytest.mark.parametrize("pattern", ["random", "blocks", "deep"])
+def test_default_policy_matches_where_chain(workdir, pattern):
+    ds = flagged_cruise(pattern)
+    baseline = prepared(ds)
+    baseline = finished(baseline.where(
+        (baseline.VCUR_SEADATANET_QC == 49)
+        & (baseline.UCUR_SEADATANET_QC == 49)
+        & (baseline.USHIP_SEADATANET_QC == 49)
+        & (baseline.VSHIP_SEADATANET_QC == 49),
+        drop=False))
+
+    result = transform_netCDF(ds, "cruise.nc", qc_policy=None)
+    for name in VARIABLES:
+        xr.testing.assert_equal(result[name], baseline[name])
+    with xr.open_dataset(workdir / "transformed_netCDF" / "cruise.nc") as written:
+        for name in VARIABLES:
+            np.testing.assert_array_equal(written[name].values, baseline[name].values)
+
+
+def test_per_variable_policy(workdir):
+    ds = flagged_cruise("random", seed=1, bad="24")
+    raw = prepared(ds)
+
+    def kept(*names):
+        return np.logical_and.reduce([np.isin(raw[name].values, [ord("1"), ord("2")]) for name in names])
+
+    expected = {
+        "UCUR": kept("UCUR_SEADATANET_QC", "VCUR_SEADATANET_QC"),
+        "VCUR": kept("UCUR_SEADATANET_QC", "VCUR_SEADATANET_QC"),
+        "USHIP": kept("USHIP_SEADATANET_QC", "VSHIP_SEADATANET_QC"),
+        "VSHIP": kept("USHIP_SEADATANET_QC", "VSHIP_SEADATANET_QC"),
+        "BATHY": kept("BATHY_SEADATANET_QC"),
+        "BOTTOM_DEPTH": kept("BOTTOM_DEPTH_SEADATANET_QC"),
+    }
+    result = transform_netCDF(ds, "cruise.nc", qc_policy="per-variable")
+    assert load_policy("per-variable") is PER_VARIABLE_POLICY
+    for name, keep in expected.items():
+        # Probably good values are kept, and each variable is masked by its own flags only
+        assert 0 < keep.sum() < keep.size
+        np.testing.assert_array_equal(result[name].values, np.where(keep, raw[name].values, np.nan))
+
+
+def test_load_policy_rejects_unknown_flags():
+    with pytest.raises(ValueError, match="Unknown SeaDataNet flags"):
+        load_policy([{"flags": ["UCUR_SEADATANET_QC"], "accept": "1X", "apply_to": ["UCUR"]}])
+    with pytest.raises(ValueError, match="has no apply_to"):
+        load_policy([{"flags": ["UCUR_SEADATANET_QC"], "accept": "1"}])
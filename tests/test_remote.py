@@ -0,0 +1,151 @@
+"""Tests of the remote ingest path against a local HTTP stand-in of the archive."""
+
+import collections
+import functools
+import http.server
+import json
+import os
+import threading
+
+import pytest
+import xarray as xr
+
+from xsadcp import fetch_files, open_remote_dataset
+from xsadcp.synthetic import write_synthetic_sdn
+
+FILE_NAMES = ["a_SDN.nc", "b_SDN.nc", "c_SDN.nc"]
+
+
+class ArchiveHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file server which can answer 503 or cut the body of the next downloads of a file."""
+
+    # File name -> number of the next GET answered with 503, or cut in the middle of the body
+    failures = {}
+    truncated = {}
+    # File name -> number of GET received
+    gets = collections.Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        name = os.path.basename(self.path)
+        self.gets[name] += 1
+        if self.failures.get(name):
+            self.failures[name] -= 1
+            self.send_error(503)
+            return
+        if self.truncated.get(name):
+            self.truncated[name] -= 1
+            with open(self.translate_path(self.path), "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+            return
+        super().do_GET()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """URL of a directory of synthetic cruises served over HTTP, and the handler serving it."""
+    root = tmp_path / "archive"
+    root.mkdir()
+    for seed, file_name in enumerate(FILE_NAMES):
+        write_synthetic_sdn(str(root / file_name), maxt=200, maxz=10, seed=seed)
+    handler = type("Handler", (ArchiveHandler,), {"failures": {}, "truncated": {}, "gets": collections.Counter()})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/", root, handler
+    server.shutdown()
+    server.server_close()
+
+
+def read_manifest(cache_dir):
+    with open(os.path.join(cache_dir, "manifest.json")) as f:
+        return json.load(f)
+
+
+def test_fetch_files_lists_and_downloads(archive, tmp_path):
+    url, root, handler = archive
+    cache_dir = str(tmp_path / "cache")
+    paths = fetch_files(url, cache_dir=cache_dir, workers=2, backoff=0)
+    assert sorted(os.path.basename(path) for path in paths) == FILE_NAMES
+    for path in paths:
+        with open(path, "rb") as cached, open(root / os.path.basename(path), "rb") as source:
+            assert cached.read() == source.read()
+    assert sorted(read_manifest(cache_dir)) == FILE_NAMES
+
+
+def test_fetch_files_resumes(archive, tmp_path):
+    url, root, handler = archive
+    cache_dir = str(tmp_path / "cache")
+    # The first run fails on one file, which is left out of the manifest
+    handler.failures["b_SDN.nc"] = 10
+    fetch_files(url, FILE_NAMES, cache_dir=cache_dir, retries=1, backoff=0)
+    assert sorted(read_manifest(cache_dir)) == ["a_SDN.nc", "c_SDN.nc"]
+    assert not os.path.exists(os.path.join(cache_dir, "b_SDN.nc"))
+
+    # The next run only downloads the missing file
+    handler.failures.clear()
+    handler.gets.clear()
+    fetch_files(url, FILE_NAMES, cache_dir=cache_dir, backoff=0)
+    assert dict(handler.gets) == {"b_SDN.nc": 1}
+    assert sorted(read_manifest(cache_dir)) == FILE_NAMES
+
+    # A file rewritten on the server is downloaded again
+    write_synthetic_sdn(str(root / "a_SDN.nc"), maxt=300, maxz=10)
+    handler.gets.clear()
+    fetch_files(url, FILE_NAMES, cache_dir=cache_dir, backoff=0)
+    assert dict(handler.gets) == {"a_SDN.nc": 1}
+    assert os.path.getsize(os.path.join(cache_dir, "a_SDN.nc")) == os.path.getsize(root / "a_SDN.nc")
+
+
+def test_fetch_files_logs_progress(archive, tmp_path, capsys, caplog):
+    url, root, handler = archive
+    cache_dir = str(tmp_path / "cache")
+    handler.failures["b_SDN.nc"] = 10
+    with caplog.at_level("INFO", logger="xsadcp"):
+        fetch_files(url, FILE_NAMES, cache_dir=cache_dir, retries=1, backoff=0)
+        fetch_files(url, FILE_NAMES, cache_dir=cache_dir, retries=0, backoff=0)
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("b_SDN.nc failed:") and message.endswith("- retrying") for message in messages)
+    assert messages.count("2 files downloaded, 0 unchanged, 1 failed") == 1
+    assert messages.count("0 files downloaded, 2 unchanged, 1 failed") == 1
+    # The library leaves the console to the command line
+    assert capsys.readouterr().out == ""
+
+
+def test_fetch_files_retries(archive, tmp_path):
+    url, root, handler = archive
+    cache_dir = str(tmp_path / "cache")
+    handler.failures["a_SDN.nc"] = 1
+    handler.truncated["b_SDN.nc"] = 2
+    paths = fetch_files(url, FILE_NAMES, cache_dir=cache_dir, retries=2, backoff=0)
+    assert handler.gets["a_SDN.nc"] == 2
+    assert handler.gets["b_SDN.nc"] == 3
+    for path in paths:
+        with open(path, "rb") as cached, open(root / os.path.basename(path), "rb") as source:
+            assert cached.read() == source.read()
+
+
+def test_fetch_files_leaves_no_partial_file(archive, tmp_path):
+    url, root, handler = archive
+    cache_dir = str(tmp_path / "cache")
+    # Every attempt is cut in the middle of the body
+    handler.truncated["c_SDN.nc"] = 10
+    fetch_files(url, ["c_SDN.nc"], cache_dir=cache_dir, retries=1, backoff=0)
+    assert handler.gets["c_SDN.nc"] == 2
+    assert os.listdir(cache_dir) == ["manifest.json"]
+    assert read_manifest(cache_dir) == {}
+
+
+def test_open_remote_dataset(archive):
+    url, root, handler = archive
+    handler.failures["a_SDN.nc"] = 1
+    ds = open_remote_dataset(url + "a_SDN.nc", backoff=0)
+    expected = xr.open_dataset(root / "a_SDN.nc", decode_times=False, engine="scipy")
+    xr.testing.assert_identical(ds, expected)
@@ -0,0 +1,167 @@
+"""Tests of the vectorized conversions and selections of xsadcp.util."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xsadcp.synthetic import synthetic_sdn, write_synthetic_sdn
+from xsadcp.util import (aggregate_section, filter_data, greg_0hfull, inside_segments, julian_to_datetime64, open_ds,
+                         read_info, transform_netCDF, transform_netCDF_chunked, xlink_href)
+
+
+def greg_datetime64(jourjul):
+    """datetime64 of the calendar date and time returned by `greg_0hfull`."""
+    yr, mo, d, hour, mins, sec = greg_0hfull(jourjul)
+    return (np.datetime64(f"{yr:04d}-{mo:02d}-{d:02d}", "ns")
+            + np.timedelta64(hour * 3600 + mins * 60 + sec, "s"))
+
+
+def test_julian_to_datetime64_matches_greg_0hfull():
+    rng = np.random.default_rng(0)
+    # Days of 1950-2050, whole and half days, and times close to a second boundary
+    days = rng.uniform(2433282, 2469807, 20000)
+    seconds = np.round(rng.uniform(0, 86400, 2000)) / 86400
+    jourjul = np.concatenate([
+        days,
+        np.floor(days[:1000]),
+        np.floor(days[:1000]) + 0.5,
+        np.floor(days[:2000]) + seconds + rng.choice([-1e-9, 0, 1e-9], 2000),
+        2440000 + 300 * np.arange(1000) / 86400,
+    ])
+    expected = np.array([greg_datetime64(value) for value in jourjul])
+    np.testing.assert_array_equal(julian_to_datetime64(jourjul), expected)
+
+
+def test_julian_to_datetime64_nan_and_shape():
+    jourjul = np.array([[2455197.5, np.nan], [np.nan, 2440588.0]])
+    dates = julian_to_datetime64(jourjul)
+    assert dates.dtype == np.dtype("datetime64[ns]")
+    assert dates.shape == (2, 2)
+    assert np.isnat(dates).tolist() == [[False, True], [True, False]]
+    assert dates[0, 0] == greg_datetime64(2455197.5)
+    assert dates[1, 1] == np.datetime64("1970-01-01T00:00:00", "ns")
+
+
+@pytest.mark.parametrize("qc_policy", [None, "per-variable"])
+def test_transform_netCDF_chunked_matches_transform_netCDF(workdir, qc_policy):
+    base_path = str(workdir) + "/"
+    write_synthetic_sdn(base_path + "cruise.nc", maxt=300, maxz=12, gaps=3, qc_pattern="blocks", seed=2)
+    expected = transform_netCDF(open_ds("cruise.nc", base_path=base_path), "cruise.nc",
+                                qc_policy=qc_policy).load()
+    with xr.open_dataset(workdir / "transformed_netCDF" / "cruise.nc") as f:
+        expected_file = f.load()
+
+    # Small enough for about 20 chunks along MAXT
+    result = transform_netCDF_chunked("cruise.nc", base_path=base_path, max_memory=20000, qc_policy=qc_policy)
+    assert len(result.chunks["MAXT"]) > 10
+    xr.testing.assert_identical(result.compute(), expected)
+    with xr.open_dataset(workdir / "transformed_netCDF" / "cruise.nc") as f:
+        xr.testing.assert_identical(f.load(), expected_file)
+
+
+def zigzag_cruise():
+    """Hourly cruise whose track goes back and forth across 30W."""
+    time = np.arange("2010-01-01", "2010-01-11", dtype="datetime64[h]").astype("datetime64[ns]")
+    phase = np.linspace(0, 6 * np.pi, time.size)
+    rng = np.random.default_rng(0)
+    return xr.Dataset(
+        {
+            "UCUR": (("TIME", "PROFZ"), rng.normal(0, 0.3, (time.size, 5))),
+            "COUNT": (("TIME", "PROFZ"), rng.integers(0, 10, (time.size, 5)).astype(np.int16)),
+        },
+        coords={
+            "TIME": time,
+            "PROFZ": -20.0 - 8.0 * np.arange(5),
+            "LONGITUDE": ("TIME", -30 + 5 * np.sin(phase)),
+            "LATITUDE": ("TIME", np.linspace(40, 45, time.size)),
+        },
+    )
+
+
+@pytest.mark.parametrize("longitude_range, latitude_range, segments", [
+    ((-40, -20), (40, 45), 1),   # the whole track
+    ((-40, -20), (41, 42), 1),   # crossed once
+    ((-40, -31), (40, 45), 3),   # crossed several times
+    ((10, 20), (0, 5), 0),       # not crossed at all
+])
+def test_filter_data_matches_where(longitude_range, latitude_range, segments):
+    ds = zigzag_cruise()
+    mask = ((ds.LONGITUDE >= longitude_range[0]) & (ds.LONGITUDE <= longitude_range[1])
+            & (ds.LATITUDE >= latitude_range[0]) & (ds.LATITUDE <= latitude_range[1]))
+    assert len(inside_segments(mask.values)) == segments
+
+    result = filter_data(ds, longitude_range, latitude_range)
+    xr.testing.assert_equal(result, ds.where(mask, drop=True))
+    assert result.COUNT.dtype == np.int16
+    assert list(result.indexes["TIME"]) == list(ds.TIME.values[mask.values])
+
+
+def test_filter_data_2d_mask_falls_back_to_where():
+    # LONGITUDE and LATITUDE on (INSTANCE, MAXT), as read from a SeaDataNet file
+    ds = synthetic_sdn(maxt=200, maxz=5, seed=3)
+    for longitude_range, latitude_range in [((-29.5, -28.5), (40, 45)), ((10, 20), (0, 5))]:
+        mask = ((ds.LONGITUDE >= longitude_range[0]) & (ds.LONGITUDE <= longitude_range[1])
+                & (ds.LATITUDE >= latitude_range[0]) & (ds.LATITUDE <= latitude_range[1]))
+        assert mask.ndim == 2
+        xr.testing.assert_identical(filter_data(ds, longitude_range, latitude_range), ds.where(mask, drop=True))
+
+
+def regular_section(times=48, depths=20):
+    """Section on a regular TIME x PROFZ grid, PROFZ decreasing as in the store, with missing cells."""
+    rng = np.random.default_rng(4)
+    values = rng.normal(0, 1, (times, depths))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[8:12] = np.nan
+    return xr.DataArray(
+        values, name="SPEED", dims=("TIME", "PROFZ"),
+        coords={"TIME": np.arange(times).astype("timedelta64[h]") + np.datetime64("2010-01-01T00", "ns"),
+                "PROFZ": -20.0 - 8.0 * np.arange(depths)},
+    )
+
+
+def test_aggregate_section_matches_coarsen():
+    da = regular_section()
+    # 4 x 4 cells per pixel
+    result = aggregate_section(da, width=12, height=5)
+    expected = da.sortby("PROFZ").coarsen(TIME=4, PROFZ=4).mean().transpose("PROFZ", "TIME")
+    assert result.shape == (5, 12)
+    np.testing.assert_allclose(result.values, expected.values, rtol=1e-6)
+    # The 4 missing profiles make one empty pixel column
+    assert np.isnan(result.values[:, 2]).all() and not np.isnan(result.values[:, 3]).any()
+
+
+def test_aggregate_section_keeps_cells_smaller_than_pixels():
+    da = regular_section()
+    result = aggregate_section(da, width=600, height=250)
+    np.testing.assert_allclose(result.values, da.sortby("PROFZ").T.values, rtol=1e-6)
+
+
+def test_aggregate_section_time_range():
+    da = regular_section()
+    time_range = (da.TIME.values[8], da.TIME.values[31])
+    result = aggregate_section(da, time_range=time_range, width=6, height=5)
+    expected = da.sel(TIME=slice(*time_range)).sortby("PROFZ").coarsen(TIME=4, PROFZ=4).mean()
+    np.testing.assert_allclose(result.values, expected.transpose("PROFZ", "TIME").values, rtol=1e-6)
+
+
+@pytest.mark.parametrize("reference, href", [
+    ('<sdn_reference xlink:href="https://cdi.seadatanet.org/report/edmo/1/A/xml" xlink:role="isDescribedBy"/>',
+     "https://cdi.seadatanet.org/report/edmo/1/A/xml"),
+    ("<sdn_reference xlink:href='https://cdi.seadatanet.org/report/edmo/1/B/xml' xlink:type='SDN:L23::CDI'/>",
+     "https://cdi.seadatanet.org/report/edmo/1/B/xml"),
+    ('<sdn_reference xmlns:xlink="http://www.w3.org/1999/xlink" xlink:href="https://x.org/C/xml"/>\x00\x00',
+     "https://x.org/C/xml"),
+    ('<sdn_reference xlink:role="isDescribedBy"/>', None),
+    ("<sdn_reference xlink:href=", None),
+    ("", None),
+])
+def test_xlink_href(reference, href):
+    assert xlink_href(reference) == href
+
+
+def test_read_info_without_href():
+    ds = synthetic_sdn(maxt=50, maxz=5)
+    ds["SDN_XLINK"] = (("INSTANCE", "REFMAX"), np.array([[b"<sdn_reference xlink:role='isDescribedBy'/>"]]))
+    info = read_info(ds, "cruise.nc")
+    assert info["user_interface_url"] is None
+    assert info["date_start"] == "2010-01-01"
@@ -8,21 +8,49 @@ from .util import (
     get_range,
     load_csv,
     load_bathymetry,
+    bathy_extent,
     load_zarr,
     load_file,
+    load_levels,
+    open_file,
+    open_levels,
+    select_level,
     filter_df,
     filter_data,
+    filter_time,
+    depth_band_means,
+    quiver_depth_bands,
     quiver_depth_filtered,
+    selected_bands,
     bathy_uship_vship_bottom_depth,
+    section_components,
+    aggregate_section,
+    section_plot,
     corsen_data,
     vectors_plot,
+    climatology_plot,
+    quiver_depth_hvplot,
+    vectors_hvplot,
+    figure_to_png,
+    render_vectors_png,
+    julian_to_datetime64,
     fix_time,
     transform_netCDF,
+    transform_netCDF_chunked,
+    read_info,
     get_info,
     get_file_names,
     open_ds,
 #    SADCP_Viewer
 )
+from .catalog import build_catalog, transform_files, load_catalog, catalog_entry, convert_catalog
+from .qc import apply_qc, load_policy
+from .remote import fetch_files, open_remote_dataset
+from .shared import shared_dataset, clear_shared
+from .grid import build_climatology, load_climatology
+from .index import build_index, update_index, load_index, cruise_bounds, query
+from .store import (resample_1h, resample_time, write_cruise, write_pyramid, remove_cruise, update_zarr,
+                    zarr_encoding, compare_encodings, rewrite_zarr)
 
 __all__ = [
     'get_range',
@@ -30,12 +58,29 @@ __all__ = [
     'load_bathymetry',
     'load_zarr',
     'load_file',
+    'load_levels',
+    'select_level',
     'filter_df',
     'filter_data',
+    'filter_time',
+    'depth_band_means',
     'quiver_depth_filtered',
     'bathy_uship_vship_bottom_depth',
+    'section_plot',
     'corsen_data',
     'vectors_plot',
+    'vectors_hvplot',
+    'climatology_plot',
+    'build_catalog',
+    'load_catalog',
+    'catalog_entry',
+    'fetch_files',
+    'update_zarr',
+    'build_index',
+    'load_index',
+    'query',
+    'build_climatology',
+    'load_climatology',
 #    'SADCP_Viewer'
 ]
 
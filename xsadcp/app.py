@@ -1,10 +1,62 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+
+import numpy as np
 import panel as pn
 import param
 
-from xsadcp import load_csv, load_bathymetry, load_zarr, load_file
-from xsadcp import get_range, filter_df, filter_data
-from xsadcp import bathy_uship_vship_bottom_depth, vectors_plot
+from xsadcp import load_catalog, open_levels, select_level
+from xsadcp import get_range, filter_df, filter_data, filter_time
+from xsadcp import bathy_uship_vship_bottom_depth, corsen_data, vectors_hvplot, figure_to_png, render_vectors_png
+from xsadcp import load_climatology, climatology_plot
+from xsadcp import section_plot
+from xsadcp.util import SECTION_COMPONENTS
+from xsadcp.cache import RenderCache, quantize
+from xsadcp.metrics import registry, stage, timed
+from xsadcp.server import report_cold_start
+from xsadcp.shared import SHARED_DIR, source_signature
+
+
+# Zarr store of the cruises
+STORE_PATH = './data/1H_file.zarr'
+# Number of worker processes rendering the maps, 0 to render in the server process
+RENDER_WORKERS = int(os.environ.get("XSADCP_RENDER_WORKERS", "2"))
+# Delay (s) before a render starts, during which a newer request supersedes it
+RENDER_DEBOUNCE = 0.15
+
+
+def time_key(time_range):
+    """
+    Time window rounded to the hour, the resolution of the store, used in the cache keys.
+
+    Parameters:
+        time_range (tuple): First and last times of the window.
 
+    Returns:
+        tuple: First and last times, as numpy.datetime64 hours.
+    """
+    return tuple(np.datetime64(value, "h") for value in time_range)
+
+
+def make_render_pool():
+    """
+    Start the worker processes rendering the Cartopy maps.
+
+    They are spawned, as forking the threaded server is unsafe.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool, None if `RENDER_WORKERS` is 0 (maps
+        are then rendered in the server process).
+    """
+    if not RENDER_WORKERS:
+        return None
+    return ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
 
 
 class SADCP_Viewer(param.Parameterized):
@@ -16,24 +68,46 @@ class SADCP_Viewer(param.Parameterized):
     
     Available functions:
         - update_name_options: Update dropdown options and slider ranges based on selected years and file.
-        - update_plots: Update plots based on selected data and parameters.
+        - update_playback: Update the number of steps of the player to the playback window.
+        - cruise_levels: Open the pyramid levels of a cruise, again when it is replaced in the store.
+        - play: Move the time window to the player step and prefetch the next one.
+        - load_filtered: Load the data of the box and time window, going through the render cache.
+        - load_coarsened: Load the coarsened data of the map, going through the render cache.
+        - prefetch: Load the data of a time window in the background.
+        - render_map: Return the pane of the matplotlib vector map, rendered from the cache or in the background.
+        - render_map_async: Render the map in the render pool and show it, unless superseded.
+        - update_plots: Lay out the map of the selected backend and the side plots.
+        - update_map: Update the matplotlib vector map.
+        - update_bokeh_map: Update the Bokeh vector map when the cruise, time window or depth bands change.
+        - update_side_plots: Update the side plots of the box and time window.
+        - update_section: Update the TIME x depth section of the selected current component.
+        - update_climatology: Update the map of the climatology of all cruises.
     """
 
-    # Load data and initialize widgets
+    # Data is loaded lazily by each session (see __init__, bathy and update_name_options)
 #    df = load_csv()
     #bathy = load_bathymetry()
 #    tree=load_zarr()
-    df = pn.state.as_cached('df',load_csv,)
-    bathy = pn.state.as_cached('bathy',load_bathymetry)
-    tree = pn.state.as_cached('tree',load_zarr)
-    file_names = df["file_name"].tolist()
-    years = sorted(df["year"].unique())
+    # Rendered maps and filtered/coarsened datasets, shared by every session of the process
+    cache = pn.state.cache.setdefault('render_cache', RenderCache(max_bytes=512 * 2**20))
+    registry.register_gauges("render_cache", cache.stats)
+    # Worker processes rendering the Cartopy maps, shared by every session of the process
+    if 'render_pool' not in pn.state.cache:
+        pn.state.cache['render_pool'] = make_render_pool()
+    render_pool = pn.state.cache['render_pool']
+    # Loads the next time window during playback, one at a time
+    prefetcher = pn.state.cache.setdefault('prefetcher', ThreadPoolExecutor(max_workers=1))
 
     # Widgets for selecting data parameters
-    year_slider = pn.widgets.IntRangeSlider(name="Year Range", start=df["year"].min(), end=df["year"].max())
+    year_slider = pn.widgets.IntRangeSlider(name="Year Range")
     file_dropdown = pn.widgets.Select(name="File Selector")
     longitude_slider = pn.widgets.RangeSlider(name="Longitude Range", start=-180, end=180, step=1)
     latitude_slider = pn.widgets.RangeSlider(name="Latitude Range", start=-90, end=90, step=1)
+    # Time window within the cruise, by steps of one hour (in ms)
+    time_slider = pn.widgets.DatetimeRangeSlider(name="Time Range", start=datetime(2000, 1, 1), end=datetime(2000, 1, 2),
+                                                 step=3600 * 1000)
+    window_slider = pn.widgets.IntSlider(start=1, end=720, step=1, value=24, name="Playback Window (hours)")
+    player = pn.widgets.Player(name="Playback", start=0, end=1, value=0, interval=1000, loop_policy="once", width=300)
     depth_range_slider = pn.widgets.IntRangeSlider(start=100, end=300, value=(100, 300), step=1, name="Depth Range")
     depth_2_checkbox = pn.widgets.Checkbox(value=False, name="Depth 2 Checkbox")
     depth_3_checkbox = pn.widgets.Checkbox(value=False, name="Depth 3 Checkbox")
@@ -42,6 +116,11 @@ class SADCP_Viewer(param.Parameterized):
     num_vectors_slider = pn.widgets.IntSlider(start=40, end=800, step=1, value=100, name="Number of Vectors")
     scale_factor_slider = pn.widgets.FloatSlider(start=0.1, end=1, step=0.1, value=0.5, name="Scale Factor")
     bathy_checkbox = pn.widgets.Checkbox(value=False, name="Bathy Checkbox")
+    # Matplotlib: static png rendered on the server, Bokeh: zoom and pan in the browser
+    backend_select = pn.widgets.RadioButtonGroup(name="Map Backend", options=["Matplotlib", "Bokeh"], value="Matplotlib")
+    # Current component of the TIME x depth section
+    section_select = pn.widgets.RadioButtonGroup(name="Section", options=SECTION_COMPONENTS, value="SPEED")
+    climatology_depth_slider = pn.widgets.IntSlider(start=0, end=1000, step=10, value=100, name="Climatology Depth")
 
  
     data_table = pn.widgets.Tabulator(width=400, height=250)
@@ -58,6 +137,17 @@ class SADCP_Viewer(param.Parameterized):
         """
 
         super(SADCP_Viewer, self).__init__(**params)
+        # Render requests of the session: only the latest one is shown
+        self._render_generation = 0
+        self._render_future = None
+        self._last_png = None
+        # Set while the widgets are reset to a new cruise, see update_name_options
+        self._resetting = False
+        self.df = pn.state.as_cached('df',load_catalog)
+        self.file_names = self.df["file_name"].tolist()
+        self.years = sorted(self.df["year"].unique())
+        self.year_slider.param.update(start=self.df["year"].min(), end=self.df["year"].max(),
+                                      value=(self.df["year"].min(), self.df["year"].max()))
         self.file_dropdown.objects = self.file_names
         self.file_dropdown.value = (
             self.file_dropdown.objects[0] if self.file_dropdown.objects else None
@@ -65,6 +155,7 @@ class SADCP_Viewer(param.Parameterized):
         self.update_name_options()
 
     @param.depends("year_slider.value", "file_dropdown.value", watch=True)
+    @timed("SADCP_Viewer.update_name_options")
     def update_name_options(self):
         """
         Update dropdown options and slider ranges based on selected years and file.
@@ -76,9 +167,9 @@ class SADCP_Viewer(param.Parameterized):
         # Extract selected start and end years
         start_year, end_year = self.year_slider.value
         
-        # Filter DataFrame based on selected years and sort by year
-        mask = (self.df["year"] >= start_year) & (self.df["year"] <= end_year)
-        sorted_df = self.df[mask].sort_values(by="year")
+        # The catalog is sorted by year: the selected years are a slice of it
+        years = self.df["year"].to_numpy()
+        sorted_df = self.df.iloc[years.searchsorted(start_year, "left"):years.searchsorted(end_year, "right")]
         
         # Get unique file names
         files = sorted_df["file_name"].unique().tolist()
@@ -97,20 +188,300 @@ class SADCP_Viewer(param.Parameterized):
             # Update data table and metadata table based on selected file
             self.data_table.value, self.metadata_table.value = filter_df(sorted_df, selected_file)
             
-            # Load selected file's data
-            self.ds = load_file(self.tree,selected_file)
+            # Open only the selected file's groups, shared by the sessions of the process
+            _, self.levels = self.cruise_levels(selected_file)
+            self.ds = self.levels["1h"]
             
-            # Update slider ranges for longitude, latitude, and depth
-            for slider, coord in zip([self.longitude_slider, self.latitude_slider, self.depth_range_slider,
-                          self.depth_2_range_slider, self.depth_3_range_slider],
-                         [self.ds.LONGITUDE, self.ds.LATITUDE, self.ds.PROFZ,self.ds.PROFZ,self.ds.PROFZ]):
-                coord_range = get_range(coord)
-                slider.start, slider.end, slider.value = coord_range[0], coord_range[1], coord_range
+            sliders = [self.longitude_slider, self.latitude_slider, self.depth_range_slider,
+                       self.depth_2_range_slider, self.depth_3_range_slider]
+            # The events of the widgets are held until all of them are set, so that no plot
+            # is updated for the new cruise with the time window of the previous one
+            self._resetting = True
+            try:
+                with contextlib.ExitStack() as batch:
+                    for widget in [self.time_slider, self.player] + sliders:
+                        batch.enter_context(param.parameterized.batch_call_watchers(widget))
+
+                    # The time window starts as the whole cruise, and the player at its first window
+                    span = tuple(self.ds.indexes["TIME"][[0, -1]].to_pydatetime())
+                    self.time_slider.param.update(start=span[0], end=span[1], value=span)
+                    self.player.value = 0
+                    self.update_playback()
+
+                    # Update slider ranges for longitude, latitude, and depth
+                    for slider, coord in zip(sliders, [self.ds.LONGITUDE, self.ds.LATITUDE, self.ds.PROFZ,
+                                                       self.ds.PROFZ, self.ds.PROFZ]):
+                        coord_range = get_range(coord)
+                        slider.param.update(start=coord_range[0], end=coord_range[1], value=coord_range)
+            finally:
+                self._resetting = False
 
 
             # Close dataset to free up resources
             # self.ds.close()
 
+    @param.depends("window_slider.value", watch=True)
+    def update_playback(self):
+        """
+        Update the number of steps of the player: the cruise is cut in windows of the playback width.
+        """
+        start, end = self.time_slider.start, self.time_slider.end
+        steps = int(np.ceil((end - start).total_seconds() / (3600 * self.window_slider.value)))
+        last = max(steps - 1, 1)
+        self.player.param.update(end=last, value=min(self.player.value, last))
+
+    def window(self, step):
+        """
+        Time window of a step of the player.
+
+        Parameters:
+            step (int): Step of the player.
+
+        Returns:
+            tuple: First and last times of the window, the last one clipped to the end of the cruise.
+        """
+        width = np.timedelta64(self.window_slider.value, "h")
+        start = np.datetime64(self.time_slider.start, "h") + step * width
+        end = min(start + width - np.timedelta64(1, "h"), np.datetime64(self.time_slider.end, "h"))
+        return start.astype(datetime), end.astype(datetime)
+
+    @param.depends("player.value", watch=True)
+    def play(self):
+        """
+        Move the time window to the step of the player, and prefetch the data of the next step
+        so that it is ready when the player gets there.
+        """
+        if self._resetting:
+            # Rewound to a new cruise, whose time window is the whole cruise
+            return
+        # Submitted first, so that the next window loads while this one is rendered
+        if self.player.value < self.player.end:
+            lon, lat = quantize(self.longitude_slider.value), quantize(self.latitude_slider.value)
+            self.prefetch(self.file_dropdown.value, lon, lat, time_key(self.window(self.player.value + 1)),
+                          self.num_vectors_slider.value)
+        self.time_slider.value = self.window(self.player.value)
+
+    def cruise_levels(self, selected_file):
+        """
+        Open the pyramid levels of a cruise, shared by the sessions of the process.
+
+        They are cached with the signature of the cruise group, so that a running server
+        opens again a cruise replaced in the store (`xsadcp update-zarr`). The signature
+        is part of the render cache keys of the cruise for the same reason.
+
+        Parameters:
+            selected_file (str): Name of the selected cruise.
+
+        Returns:
+            tuple: Signature of the cruise group (see `source_signature`) and its levels (see `open_levels`).
+        """
+        def open_cruise(selected_file, signature):
+            return open_levels(selected_file, STORE_PATH, SHARED_DIR)
+
+        signature = source_signature(STORE_PATH, selected_file)
+        return signature, pn.state.as_cached('levels', open_cruise, selected_file=selected_file, signature=signature)
+
+    def load_filtered(self, selected_file, lon, lat, window):
+        """
+        Load the data of the box and time window, going through the render cache.
+
+        Parameters:
+            selected_file (str): Name of the selected cruise.
+            lon (tuple): Quantized longitude range.
+            lat (tuple): Quantized latitude range.
+            window (tuple): Time window, as returned by `time_key`.
+
+        Returns:
+            xarray.Dataset: The loaded data.
+        """
+        signature, levels = self.cruise_levels(selected_file)
+        return self.cache.get_or_compute(
+            ("filtered", selected_file, signature, lon, lat, window),
+            lambda: filter_data(filter_time(levels["1h"], window), lon, lat).load())
+
+    def load_coarsened(self, selected_file, lon, lat, window, sample):
+        """
+        Load the coarsened data of the map, from the coarsest pyramid level which still has
+        enough vectors in the box and time window, going through the render cache.
+
+        Parameters:
+            selected_file (str): Name of the selected cruise.
+            lon (tuple): Quantized longitude range.
+            lat (tuple): Quantized latitude range.
+            window (tuple): Time window, as returned by `time_key`.
+            sample (int): Number of vectors.
+
+        Returns:
+            xarray.Dataset: The loaded data.
+        """
+        signature, levels = self.cruise_levels(selected_file)
+
+        def coarsened():
+            # Slicing the sorted TIME index of each level is a binary search, not a scan
+            windowed = {name: filter_time(ds, window) for name, ds in levels.items()}
+            ds_map = select_level(windowed, lon, lat, sample)
+            if ds_map is not windowed["1h"]:
+                ds_map = filter_data(ds_map, lon, lat)
+            else:
+                ds_map = self.load_filtered(selected_file, lon, lat, window)
+            return corsen_data(ds_map, sample).load()
+        return self.cache.get_or_compute(("coarsened", selected_file, signature, lon, lat, window, sample),
+                                         coarsened)
+
+    def prefetch(self, selected_file, lon, lat, window, sample):
+        """
+        Load the data of a time window in the background, into the render cache.
+
+        Only the data is prefetched: the figures are rendered when the window is shown.
+
+        Parameters:
+            selected_file (str): Name of the selected cruise.
+            lon (tuple): Quantized longitude range.
+            lat (tuple): Quantized latitude range.
+            window (tuple): Time window, as returned by `time_key`.
+            sample (int): Number of vectors.
+
+        Returns:
+            concurrent.futures.Future: The loading task.
+        """
+        coarsen = self.backend_select.value == "Matplotlib"
+
+        def load():
+            with stage("SADCP_Viewer.prefetch"):
+                self.load_filtered(selected_file, lon, lat, window)
+                if coarsen:
+                    self.load_coarsened(selected_file, lon, lat, window, sample)
+        return self.prefetcher.submit(load)
+
+    @property
+    def climatology(self):
+        """
+        Climatology of all cruises (see `build_climatology`), opened on first use only.
+        None if it has not been built.
+        """
+        if not os.path.exists('./data/climatology.zarr'):
+            return None
+        return pn.state.as_cached('climatology', load_climatology)
+
+    def render_map(self, selected_file, lon, lat, window, sample):
+        """
+        Return the pane of the matplotlib vector map.
+
+        On a cache hit the png is shown at once. Otherwise the pane keeps showing the
+        previous map in a loading state, and `render_map_async` renders the new one in
+        the render pool and swaps it in, so a slow Cartopy render never blocks the
+        server. Each call supersedes the renders still pending for the session. If the
+        render fails, an error replaces the map.
+
+        Parameters:
+            selected_file (str): Name of the selected cruise.
+            lon (tuple): Quantized longitude range.
+            lat (tuple): Quantized latitude range.
+            window (tuple): Time window, as returned by `time_key`.
+            sample (int): Number of vectors.
+
+        Returns:
+            pn.Column: A Panel column containing the pane of the map.
+        """
+        self._render_generation += 1
+        if self._render_future is not None:
+            # Only possible while it waits in the pool queue, a running render finishes into the cache
+            self._render_future.cancel()
+
+        # Vector plots are kept as png so that a cache hit skips the Cartopy rendering
+        options = dict(
+            longitude_range=lon, latitude_range=lat,
+            depth_range=self.depth_range_slider.value, depth_2_range=self.depth_2_range_slider.value,
+            depth_3_range=self.depth_3_range_slider.value, scale_factor=self.scale_factor_slider.value,
+            sample=sample, depth_2_checkbox=self.depth_2_checkbox.value,
+            depth_3_checkbox=self.depth_3_checkbox.value, bathy_checkbox=self.bathy_checkbox.value,
+            shared_dir=SHARED_DIR,
+        )
+        state = quantize((
+            options["depth_range"], options["depth_2_range"], options["depth_3_range"], options["scale_factor"],
+            options["depth_2_checkbox"], options["depth_3_checkbox"], options["bathy_checkbox"],
+        ))
+        key = ("map", selected_file, source_signature(STORE_PATH, selected_file), lon, lat, window, sample) + state
+        png = self.cache.get(key)
+        if png is not None:
+            self._last_png = png
+            return pn.Column(pn.pane.PNG(png))
+
+        view = pn.Column(pn.pane.PNG(self._last_png, loading=True))
+        pn.state.execute(partial(self.render_map_async, self._render_generation, key, view,
+                                 (selected_file, lon, lat, window, sample), options))
+        return view
+
+    async def render_map_async(self, generation, key, view, selection, options):
+        """
+        Render the map in the render pool and show it, unless a newer render was requested meanwhile.
+
+        Parameters:
+            generation (int): Render counter of the session when the render was requested.
+            key (tuple): Key of the png in the render cache.
+            view (pn.Column): Column of the pane showing the map, see `render_map`.
+            selection (tuple): Arguments of `load_coarsened`.
+            options (dict): Arguments of `render_vectors_png`.
+        """
+        # Debounce: while a slider moves, the renders it requests are superseded before they start
+        await asyncio.sleep(RENDER_DEBOUNCE)
+        if generation != self._render_generation:
+            return
+        pane = view[0]
+        try:
+            with stage("SADCP_Viewer.render_map"):
+                ds_map = await asyncio.to_thread(self.load_coarsened, *selection)
+                if generation != self._render_generation:
+                    return
+                if self.render_pool is None:
+                    png = render_vectors_png(ds_map, **options)
+                else:
+                    self._render_future = self.render_pool.submit(render_vectors_png, ds_map, **options)
+                    png = await asyncio.wrap_future(self._render_future)
+        except asyncio.CancelledError:
+            return
+        except Exception as error:
+            if isinstance(error, BrokenProcessPool):
+                # A worker died: the pool refuses any further render, start a new one
+                type(self).render_pool = pn.state.cache['render_pool'] = make_render_pool()
+            pn.state.log(f"Rendering the map of {selection[0]} failed: {error!r}", level="error")
+            if generation == self._render_generation:
+                # Never leave the map of other widget values on screen
+                self._last_png = None
+                view.objects = [pn.pane.Alert(f"The map could not be rendered: {error}", alert_type="danger")]
+            return
+        finally:
+            if generation == self._render_generation:
+                pane.loading = False
+        self.cache.put(key, png)
+        if generation == self._render_generation:
+            self._last_png = png
+            pane.object = png
+
+    @param.depends("backend_select.value", watch=False)
+    @timed("SADCP_Viewer.update_plots")
+    def update_plots(self):
+        """
+        Lay out the map of the selected backend and the side plots.
+
+        Each of them is a separate method depending only on the widgets it uses, so that,
+        with the Bokeh backend, moving the box, the scale or the number of vectors updates
+        the map in place instead of sending the cruise to the browser again.
+
+        Returns:
+            pn.Row: A Panel row containing the map and the side plots.
+        """
+        map_view = self.update_bokeh_map if self.backend_select.value == "Bokeh" else self.update_map
+        # Generate plots which will be plotted on the left row.
+        self.plot_left = pn.Column(
+                              # Here adjust the style option later TODO
+                              # https://panel.holoviz.org/how_to/styling/matplotlib.html
+                               map_view,
+                                sizing_mode="stretch_both")
+        # Generate additional plots which will be plotted on the right row.
+        self.plot_right = pn.Column(self.update_side_plots, sizing_mode="stretch_width")
+        return pn.Row(self.plot_left, self.plot_right, sizing_mode="stretch_both")
+
     @param.depends(
         "year_slider.value",
         "file_dropdown.value",
@@ -121,52 +492,128 @@ class SADCP_Viewer(param.Parameterized):
         "depth_3_range_slider.value",
         "longitude_slider.value",
         "latitude_slider.value",
+        "time_slider.value",
         "num_vectors_slider.value",
         "scale_factor_slider.value",
         "bathy_checkbox.value",
         watch=False,)
-    def update_plots(self):
+    @timed("SADCP_Viewer.update_map")
+    def update_map(self):
         """
-        This function updates the plots based on the selected data and parameters.
-
-        The function filters the data, generates additional plots, and updates the main vector plot based on the selected parameters.
+        Update the matplotlib vector map, rendered on the server for the selected parameters.
 
         Returns:
-            pn.Row: A Panel row containing the updated map plot and additional plots.
+            pn.Column: The column of the pane of the map, see `render_map`.
+        """
+        # Widget state shared by the cache keys, floats rounded to avoid slider noise
+        lon, lat = quantize(self.longitude_slider.value), quantize(self.latitude_slider.value)
+        return self.render_map(self.file_dropdown.value, lon, lat, time_key(self.time_slider.value),
+                               self.num_vectors_slider.value)
 
+    @param.depends(
+        "file_dropdown.value",
+        "time_slider.value",
+        "depth_range_slider.value",
+        "depth_2_checkbox.value",
+        "depth_3_checkbox.value",
+        "depth_2_range_slider.value",
+        "depth_3_range_slider.value",
+        watch=False,)
+    @timed("SADCP_Viewer.update_bokeh_map")
+    def update_bokeh_map(self):
         """
-        # Filter the data
-        self.ds_filtered = filter_data(self.ds,self.longitude_slider.value,self.latitude_slider.value)
+        Update the Bokeh vector map, only when the cruise, the time window or the depth bands change.
 
-        # Prepare the plots shown in left
-        # Update vector plots
-        vector_plot = vectors_plot(self.ds_filtered, self.bathy, 
-                                   self.longitude_slider.value, self.latitude_slider.value,
-                                   self.depth_range_slider.value, self.depth_2_range_slider.value, self.depth_3_range_slider.value,
-                                   self.scale_factor_slider.value,self.num_vectors_slider.value,
-                                   depth_2_checkbox= self.depth_2_checkbox.value,
-                                   depth_3_checkbox= self.depth_3_checkbox.value,
-                                   bathy_checkbox=self.bathy_checkbox.value,
-                                   )
+        The box, the scale and the number of vectors are given to the plot as parameters,
+        which update the existing plot in the browser.
 
+        Returns:
+            pn.pane.HoloViews: The pane of the map.
+        """
+        selected_file = self.file_dropdown.value
+        window = time_key(self.time_slider.value)
+        # The whole cruise is sent once, the box only sets the view
+        signature, levels = self.cruise_levels(selected_file)
+        ds_cruise = self.cache.get_or_compute(("cruise", selected_file, signature, window),
+                                              lambda: filter_time(levels["1h"], window).compute())
+        return pn.pane.HoloViews(vectors_hvplot(
+            ds_cruise, self.longitude_slider.param.value, self.latitude_slider.param.value,
+            self.depth_range_slider.value, self.depth_2_range_slider.value, self.depth_3_range_slider.value,
+            self.scale_factor_slider.param.value, self.num_vectors_slider.param.value,
+            depth_2_checkbox=self.depth_2_checkbox.value,
+            depth_3_checkbox=self.depth_3_checkbox.value,
+        ))
 
-        # Generate plots which will be plotted on the left row.
-        self.plot_left = pn.Column(
-                              # Here adjust the style option later TODO
-                              # https://panel.holoviz.org/how_to/styling/matplotlib.html
-                               pn.pane.Matplotlib(vector_plot, dpi=144),
-                              # Add here the hvplot block of contour TODO
-                                sizing_mode="stretch_both")
+    @param.depends(
+        "file_dropdown.value",
+        "longitude_slider.value",
+        "latitude_slider.value",
+        "time_slider.value",
+        watch=False,)
+    @timed("SADCP_Viewer.update_side_plots")
+    def update_side_plots(self):
+        """
+        Update the bathymetry, ship velocity and bottom depth plots of the box and time window.
 
-        # Generate additional plots which will be plotted on the right row.
+        Returns:
+            pn.Column: A Panel column containing the plots.
+        """
+        selected_file = self.file_dropdown.value
+        lon, lat = quantize(self.longitude_slider.value), quantize(self.latitude_slider.value)
+        # Filter the data, reading it from the store on a cache miss (or prefetched during playback)
+        with stage("SADCP_Viewer.load_filtered"):
+            self.ds_filtered = self.load_filtered(selected_file, lon, lat, time_key(self.time_slider.value))
         other_plots = bathy_uship_vship_bottom_depth(self.ds_filtered)
-        self.plot_right = pn.Column(
-            *(pn.pane.HoloViews(plot, width=400, height=200) for plot in other_plots),
-            sizing_mode="stretch_width"
-        )
+        return pn.Column(*(pn.pane.HoloViews(plot, width=400, height=200) for plot in other_plots))
 
-        # Return a Panel row containing the updated map plot and additional plots
-        return pn.Row(self.plot_left, self.plot_right, sizing_mode="stretch_both")
+    @param.depends(
+        "file_dropdown.value",
+        "longitude_slider.value",
+        "latitude_slider.value",
+        "time_slider.value",
+        "section_select.value",
+        watch=False,)
+    @timed("SADCP_Viewer.update_section")
+    def update_section(self):
+        """
+        Update the TIME x depth section of the selected current component in the box and time window.
+
+        The section is aggregated on the server to the size of the plot, and again at
+        each zoom, so that long sections are never sent cell by cell to the browser.
+
+        Returns:
+            pn.Column: A Panel column containing the component selector and the section.
+        """
+        selected_file = self.file_dropdown.value
+        lon, lat = quantize(self.longitude_slider.value), quantize(self.latitude_slider.value)
+        ds = self.load_filtered(selected_file, lon, lat, time_key(self.time_slider.value))
+        plot = section_plot(ds, self.section_select.value, width=800, height=250)
+        return pn.Column(self.section_select, pn.pane.HoloViews(plot), sizing_mode="stretch_width")
+
+    @param.depends(
+        "longitude_slider.value",
+        "latitude_slider.value",
+        "scale_factor_slider.value",
+        "climatology_depth_slider.value",
+        watch=False,)
+    @timed("SADCP_Viewer.update_climatology")
+    def update_climatology(self):
+        """
+        Update the map of the mean currents of all cruises at the selected depth.
+
+        Returns:
+            pn.Column: A Panel column containing the climatology map and its depth slider.
+        """
+        clim = self.climatology
+        if clim is None:
+            return pn.pane.Markdown("No climatology yet, build it with `xsadcp build-climatology`.")
+
+        lon, lat = quantize(self.longitude_slider.value), quantize(self.latitude_slider.value)
+        state = quantize((self.climatology_depth_slider.value, self.scale_factor_slider.value))
+        png = self.cache.get_or_compute(
+            ("climatology", lon, lat) + state,
+            lambda: figure_to_png(climatology_plot(clim, lon, lat, *state), dpi=144))
+        return pn.Column(self.climatology_depth_slider, pn.pane.PNG(png), sizing_mode="stretch_both")
 
 
 pn.extension("tabulator")
@@ -175,13 +622,16 @@ pn.extension("tabulator")
 explorer = SADCP_Viewer()
 # Instantiate the SADCP_Viewer class and create a template
 tabs = pn.Tabs(
-    ("Plots", pn.Column(explorer.update_plots)),
+    ("Plots", pn.Column(explorer.update_plots, explorer.update_section)),
     (
         "Metadata",
         pn.Column(
             explorer.metadata_table, explorer.download_button, height=500, margin=10
         ),
     ),
+    ("Climatology", pn.Column(explorer.update_climatology)),
+    # The climatology is only opened when its tab is shown
+    dynamic=True,
 )
 
 sidebar = [
@@ -191,6 +641,9 @@ sidebar = [
     explorer.file_dropdown,
     explorer.longitude_slider,
     explorer.latitude_slider,
+    explorer.time_slider,
+    explorer.window_slider,
+    explorer.player,
     explorer.bathy_checkbox,
     explorer.depth_range_slider,
     explorer.depth_2_checkbox,
@@ -199,6 +652,7 @@ sidebar = [
     explorer.depth_3_range_slider,
     explorer.num_vectors_slider,
     explorer.scale_factor_slider,
+    explorer.backend_select,
     explorer.data_table,
     """You can consult detailed information on this data in the metadata tab shown on the right.
        To download full dataset, please go to https://cdi.seadatanet.org/search 
@@ -212,3 +666,5 @@ template = pn.template.FastListTemplate(
     
 )
 template.servable()
+# The first session of the process is built: its page is sent next
+report_cold_start()
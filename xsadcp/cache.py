@@ -0,0 +1,156 @@
+"""Byte-bounded LRU cache for the rendered figures and intermediate datasets of the viewer."""
+
+import threading
+from collections import OrderedDict
+
+
+def quantize(value, ndigits=3):
+    """
+    Round the floats of a (nested) widget value so that it can be used as a cache key.
+
+    Parameters:
+        value: Widget value, such as a float, a tuple of floats, a string or a bool.
+        ndigits (int): Number of decimals kept for floats.
+
+    Returns:
+        Hashable value with floats rounded and lists turned into tuples.
+    """
+    if isinstance(value, float):
+        return round(value, ndigits)
+    if isinstance(value, (tuple, list)):
+        return tuple(quantize(item, ndigits) for item in value)
+    return value
+
+
+def sizeof(value):
+    """
+    Estimate the memory used by a cached value.
+
+    Parameters:
+        value: xarray object, bytes, or any object with a `nbytes` attribute.
+
+    Returns:
+        int: Size in bytes (0 if unknown).
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return int(getattr(value, "nbytes", 0))
+
+
+class RenderCache:
+    """
+    Least recently used cache bounded by the total size of its values.
+
+    One instance is meant to be shared by every Panel session of a process (see
+    `SADCP_Viewer`), so that users looking at the same cruise with the same widget
+    values reuse each other's work.
+
+    Available functions:
+        - get_or_compute: Return the cached value of a key, computing and storing it on a miss.
+        - get: Return the cached value of a key, or a default on a miss.
+        - put: Store a value computed elsewhere, such as in a worker process.
+        - stats: Return the hit/miss counters and the current size of the cache.
+        - clear: Empty the cache.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        """
+        Initialize the cache.
+
+        Parameters:
+            max_bytes (int): Maximum total size of the cached values, in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, nbytes=sizeof):
+        """
+        Return the cached value of `key`, or compute, store and return it.
+
+        Parameters:
+            key (tuple): Hashable key, usually built with `quantize`.
+            compute (callable): Function without argument computing the value on a miss.
+            nbytes (callable, optional): Function returning the size of a value. Defaults to `sizeof`.
+
+        Returns:
+            The cached or computed value.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+        value = compute()
+        self._put(key, value, nbytes(value))
+        return value
+
+    def get(self, key, default=None):
+        """
+        Return the cached value of `key`, or `default` on a miss.
+
+        Parameters:
+            key (tuple): Hashable key, usually built with `quantize`.
+            default: Value returned on a miss.
+
+        Returns:
+            The cached value or `default`.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, nbytes=sizeof):
+        """
+        Store a value, for values which are not computed by `get_or_compute`.
+
+        Parameters:
+            key (tuple): Hashable key, usually built with `quantize`.
+            value: Value to store.
+            nbytes (callable, optional): Function returning the size of a value. Defaults to `sizeof`.
+        """
+        self._put(key, value, nbytes(value))
+
+    def _put(self, key, value, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def stats(self):
+        """
+        Return the counters of the cache.
+
+        Returns:
+            dict: Number of hits, misses and entries, and current and maximum size in bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
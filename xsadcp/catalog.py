@@ -0,0 +1,340 @@
+"""Parallel, resumable ingest of SeaDataNet files: the transformed netCDF files and the catalog, stored as Parquet and exported as csv."""
+
+import json
+import os
+
+from .util import as_finished, get_file_names, get_info, logger, open_ds, transform_netCDF, transform_netCDF_chunked
+
+# Types of the catalog columns which are not plain strings
+DATE_COLUMNS = ("date_start", "date_end")
+INTEGER_COLUMNS = ("adcp_frequency(KiloHz)", "bin_length(meter)")
+BOUNDS = ("lon_min", "lon_max", "lat_min", "lat_max")
+
+
+def file_signature(file_path):
+    """
+    Return the size and modification time of a file.
+
+    Parameters:
+        file_path (str): Path of the file.
+
+    Returns:
+        dict: Dictionary with the size (bytes) and mtime (nanoseconds) of the file.
+    """
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def load_manifest(manifest_path):
+    """
+    Load the checkpoint manifest of a catalog build, or an empty one if it does not exist.
+
+    Parameters:
+        manifest_path (str): Path of the json manifest.
+
+    Returns:
+        dict: Mapping of file name to its signature and catalog information.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Write the checkpoint manifest atomically so that a crash never leaves it half written.
+
+    Parameters:
+        manifest (dict): Mapping of file name to its signature and catalog information.
+        manifest_path (str): Path of the json manifest.
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def typed_catalog(df, index=None):
+    """
+    Give the catalog columns their types: dates as timestamps, year, frequency, bin length and bounds as numbers.
+
+    Parameters:
+        df (pandas.DataFrame): Catalog as built by `build_catalog` or read from the csv.
+        index (pandas.DataFrame, optional): Track index (see `xsadcp.index.load_index`), used to
+            fill the bounding box of cruises catalogued before it was recorded.
+
+    Returns:
+        pandas.DataFrame: The typed catalog, sorted by year and start date.
+    """
+    import pandas as pd
+
+    from .index import cruise_bounds
+
+    df = df.copy()
+    for column in BOUNDS:
+        if column not in df:
+            df[column] = float("nan")
+    if index is not None and len(index):
+        bounds = cruise_bounds(index)
+        for column in BOUNDS:
+            df[column] = df[column].fillna(df["file_name"].map(bounds[column]))
+    for column in DATE_COLUMNS:
+        df[column] = pd.to_datetime(df[column])
+    for column in INTEGER_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    for column in BOUNDS:
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+    df["year"] = df["year"].astype("int64")
+    return df.sort_values(by=["year", "date_start"], kind="stable").reset_index(drop=True)
+
+
+def write_catalog(df, output="./data/zarr_table.parquet", row_group_size=256):
+    """
+    Write the catalog as a Parquet file.
+
+    Rows are sorted by year, so that the row groups have narrow year statistics
+    which `load_catalog` uses to skip the ones outside the selected years.
+
+    Parameters:
+        df (pandas.DataFrame): Catalog, typed by `typed_catalog`.
+        output (str): Path of the Parquet file.
+        row_group_size (int): Number of cruises per row group.
+    """
+    df.to_parquet(output, index=False, row_group_size=row_group_size)
+
+
+def export_csv(df, output="./data/zarr_table.csv"):
+    """
+    Write the catalog in the csv format read by `load_csv`, dates as YYYY-MM-DD.
+
+    Parameters:
+        df (pandas.DataFrame): Typed catalog.
+        output (str): Path of the csv file.
+    """
+    df = df.assign(**{column: df[column].dt.strftime("%Y-%m-%d") for column in DATE_COLUMNS if column in df})
+    df.to_csv(output, index=False)
+
+
+def load_catalog(path="./data/zarr_table.parquet", years=None, lon_range=None, lat_range=None, columns=None):
+    """
+    Read the catalog, or the cruises of some years and crossing a region of it.
+
+    The filters are pushed down to the Parquet reader, which skips the row groups
+    outside them. When the Parquet file does not exist, the csv catalog next to it
+    is read and typed instead. The cruises are indexed by file name, for `catalog_entry`.
+
+    Parameters:
+        path (str): Path of the Parquet (or csv) catalog.
+        years (tuple, optional): First and last years of the cruises.
+        lon_range (tuple, optional): Minimum and maximum longitude crossed by the cruises.
+        lat_range (tuple, optional): Minimum and maximum latitude crossed by the cruises.
+            Cruises without bounding box are left out by the region filters.
+        columns (list, optional): Columns to read. Defaults to all.
+
+    Returns:
+        pandas.DataFrame: The cruises, sorted by year and start date.
+    """
+    import pandas as pd
+
+    filters = []
+    if years is not None:
+        filters += [("year", ">=", years[0]), ("year", "<=", years[1])]
+    if lon_range is not None:
+        filters += [("lon_max", ">=", lon_range[0]), ("lon_min", "<=", lon_range[1])]
+    if lat_range is not None:
+        filters += [("lat_max", ">=", lat_range[0]), ("lat_min", "<=", lat_range[1])]
+    if columns is not None and "file_name" not in columns:
+        columns = ["file_name", *columns]
+
+    csv_path = os.path.splitext(path)[0] + ".csv"
+    if path.endswith(".csv") or (not os.path.exists(path) and os.path.exists(csv_path)):
+        df = typed_catalog(pd.read_csv(csv_path, index_col=None))
+        for column, op, value in filters:
+            df = df[df[column] >= value] if op == ">=" else df[df[column] <= value]
+        if columns is not None:
+            df = df[columns]
+    else:
+        df = pd.read_parquet(path, columns=columns, filters=filters or None)
+    df.index = pd.Index(df["file_name"].to_numpy())
+    return df
+
+
+def catalog_entry(df, file_name):
+    """
+    Look up the row of a cruise in the catalog returned by `load_catalog`.
+
+    Parameters:
+        df (pandas.DataFrame): Catalog indexed by file name.
+        file_name (str): Name of the cruise file.
+
+    Returns:
+        pandas.DataFrame: The row of the cruise (empty if it is not catalogued).
+    """
+    return df.loc[df.index.intersection([file_name])]
+
+
+def convert_catalog(path="./data/zarr_table.csv", output="./data/zarr_table.parquet",
+                    index_path="./data/track_index.csv"):
+    """
+    Convert the catalog between csv and Parquet, depending on the extension of `output`.
+
+    Parameters:
+        path (str): Path of the catalog to read.
+        output (str): Path of the catalog to write, ending with .parquet or .csv.
+        index_path (str, optional): Track index used to fill the bounding boxes, when it exists.
+
+    Returns:
+        pandas.DataFrame: The typed catalog.
+    """
+    from .index import load_index
+
+    index = load_index(index_path) if index_path and os.path.exists(index_path) else None
+    df = load_catalog(path)
+    df = typed_catalog(df, index=index)
+    if output.endswith(".csv"):
+        export_csv(df, output)
+    else:
+        write_catalog(df, output)
+    return df
+
+
+def transform_file(file_name, path, max_memory=None, qc_policy=None):
+    """
+    Write the transformed copy of one file to transformed_netCDF/.
+
+    Parameters:
+        file_name (str): Name of the file.
+        path (str): Directory containing the file.
+        max_memory (int or str, optional): Memory ceiling of `transform_netCDF_chunked`. Defaults to
+            loading the whole file with `transform_netCDF`.
+        qc_policy (list, str or None): QC policy, see `xsadcp.qc.load_policy`.
+    """
+    if max_memory is not None:
+        transform_netCDF_chunked(file_name, base_path=path, max_memory=max_memory, qc_policy=qc_policy)
+    else:
+        ds = open_ds(file_name, base_path=path)
+        transform_netCDF(ds, file_name, qc_policy=qc_policy)
+        ds.close()
+
+
+def is_transformed(file_name, path, qc_policy=None):
+    """
+    Whether the transformed copy of a file is newer than the file and was masked with the same QC policy.
+
+    Parameters:
+        file_name (str): Name of the file.
+        path (str): Directory containing the file.
+        qc_policy (list, str or None): QC policy, see `xsadcp.qc.load_policy`.
+
+    Returns:
+        bool: True if the copy in transformed_netCDF/ is up to date.
+    """
+    import xarray as xr
+
+    from .qc import DEFAULT_POLICY, load_policy
+
+    transformed = "transformed_netCDF/" + file_name
+    if not os.path.exists(transformed) or os.stat(transformed).st_mtime_ns < os.stat(path + file_name).st_mtime_ns:
+        return False
+    # Only the header is read. Files transformed before the policies were recorded used the default one
+    with xr.open_dataset(transformed) as ds:
+        policy = ds.attrs.get("qc_policy", json.dumps(DEFAULT_POLICY))
+    return json.loads(policy) == load_policy(qc_policy)
+
+
+def transform_files(path="/Users/todaka/data/goship/octopus_output_newprofz/", workers=None,
+                    force=False, max_memory=None, qc_policy=None):
+    """
+    Transform every file of `path` which has no up-to-date copy in transformed_netCDF/, in a process pool.
+
+    A transformed file newer than its source and masked with the same QC policy is kept,
+    so only new and changed files are transformed, or every file when the policy changes.
+
+    Parameters:
+        path (str): Directory containing the SeaDataNet .nc files.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        force (bool, optional): Whether to transform every file again. Defaults to False.
+        max_memory (int or str, optional): Memory ceiling per file, see `transform_file`.
+        qc_policy (list, str or None): QC policy, see `xsadcp.qc.load_policy`.
+
+    Returns:
+        list: Names of the files transformed.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    file_names = get_file_names(path)
+    todo = [file_name for file_name in file_names if force or not is_transformed(file_name, path, qc_policy)]
+    logger.info("%d files up to date, %d files to transform", len(file_names) - len(todo), len(todo))
+
+    os.makedirs("transformed_netCDF", exist_ok=True)
+    done = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(transform_file, file_name, path, max_memory, qc_policy): file_name for file_name in todo}
+            done = [file_name for file_name, _ in as_finished(futures)]
+    return done
+
+
+def build_catalog(path="/Users/todaka/data/goship/octopus_output_newprofz/",
+                  output="./data/zarr_table.parquet", csv_output="./data/zarr_table.csv",
+                  manifest=None, workers=None, force=False, transform=True):
+    """
+    Build the catalog by running `get_info` on every file of `path` in a process pool.
+
+    Each finished file is recorded in a checkpoint manifest together with its size and
+    mtime, so a crashed run resumes where it stopped and files which did not change
+    since the last run are skipped. With `transform=False` only the metadata of the
+    files is read, and they are transformed separately by `transform_files`.
+
+    Parameters:
+        path (str): Directory containing the SeaDataNet .nc files.
+        output (str): Path of the Parquet catalog to write.
+        csv_output (str, optional): Path of the csv export of the catalog. None to skip it.
+        manifest (str, optional): Path of the checkpoint manifest. Defaults to `csv_output` (or
+            `output` without csv export) + ".manifest.json".
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        force (bool, optional): Whether to ignore the manifest and process every file again. Defaults to False.
+        transform (bool, optional): Whether `get_info` also writes the transformed files. Defaults to True.
+
+    Returns:
+        pandas.DataFrame: The typed catalog written to `output`.
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+
+    manifest_path = manifest if manifest else (csv_output or output) + ".manifest.json"
+    file_names = get_file_names(path)
+    signatures = {file_name: file_signature(path + file_name) for file_name in file_names}
+
+    entries = {} if force else load_manifest(manifest_path)
+    # Forget files which are no longer in the archive
+    entries = {name: entry for name, entry in entries.items() if name in signatures}
+    todo = [
+        file_name for file_name in file_names
+        if file_name not in entries or entries[file_name]["signature"] != signatures[file_name]
+    ]
+    logger.info("%d files unchanged, %d files to process", len(file_names) - len(todo), len(todo))
+
+    # get_info writes the transformed file there
+    if transform:
+        os.makedirs("transformed_netCDF", exist_ok=True)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(get_info, file_name, path, transform): file_name for file_name in todo}
+            # A failed file is not recorded in the manifest, so it is retried on the next run
+            for file_name, info in as_finished(futures):
+                entries[file_name] = {"signature": signatures[file_name], "info": info}
+                save_manifest(entries, manifest_path)
+    save_manifest(entries, manifest_path)
+
+    df = pd.DataFrame(
+        [{"file_name": file_name, **entries[file_name]["info"]}
+         for file_name in file_names if file_name in entries]
+    )
+    if not df.empty:
+        df = typed_catalog(df)
+    write_catalog(df, output)
+    if csv_output:
+        export_csv(df, csv_output)
+    return df
@@ -1,16 +1,102 @@
 """Console script for xsadcp."""
 
+import logging
+import sys
+
 import fire
 
+from . import catalog, grid, index, remote, store
+
 
 def help() -> None:
     print("xsadcp")
     print("=" * len("xsadcp"))
     print("Skeleton project created by Python Project Wizard (ppw)")
 
+def build_catalog(path="/Users/todaka/data/goship/octopus_output_newprofz/",
+                  output="./data/zarr_table.parquet", csv_output="./data/zarr_table.csv",
+                  manifest=None, workers=None, force=False, transform=True) -> None:
+    """Build the Parquet catalog (and its csv export) of the SeaDataNet files in `path` in parallel."""
+    df = catalog.build_catalog(path, output=output, csv_output=csv_output, manifest=manifest,
+                               workers=workers, force=force, transform=transform)
+    print(len(df), "files in", output)
+
+def transform(path="/Users/todaka/data/goship/octopus_output_newprofz/", workers=None,
+              force=False, max_memory=None, qc_policy=None) -> None:
+    """Transform the new and changed SeaDataNet files of `path` into transformed_netCDF/."""
+    done = catalog.transform_files(path, workers=workers, force=force, max_memory=max_memory,
+                                   qc_policy=qc_policy)
+    print(len(done), "files transformed")
+
+def convert_catalog(path="./data/zarr_table.csv", output="./data/zarr_table.parquet",
+                    index_path="./data/track_index.csv") -> None:
+    """Convert the catalog between csv and Parquet, depending on the extension of `output`."""
+    df = catalog.convert_catalog(path, output=output, index_path=index_path)
+    print(len(df), "files in", output)
+
+def fetch(url="https://data-eurogoship.ifremer.fr/copy_seadatanet/", cache_dir="./data/remote_cache/",
+          file_names=None, workers=8, retries=3, force=False) -> None:
+    """Download the SeaDataNet files of a remote archive (comma separated file names, all by default)."""
+    if isinstance(file_names, str):
+        file_names = file_names.split(",")
+    paths = remote.fetch_files(url, file_names=file_names, cache_dir=cache_dir,
+                               workers=workers, retries=retries, force=force)
+    print(len(paths), "files in", cache_dir)
+
+def update_zarr(add=(), remove=(), path="./data/1H_file.zarr",
+                transformed_path="./transformed_netCDF/", velocity_dtype="int16",
+                time_chunk=720, compressor="blosc-zstd") -> None:
+    """Add, replace or delete cruise groups of the zarr store (comma separated file names)."""
+    if isinstance(add, str):
+        add = add.split(",")
+    if isinstance(remove, str):
+        remove = remove.split(",")
+    store.update_zarr(add=add, remove=remove, path=path,
+                      transformed_path=transformed_path,
+                      encoding_options=dict(velocity_dtype=velocity_dtype, time_chunk=time_chunk,
+                                            compressor=compressor))
+
+def rewrite_zarr(path="./data/1H_file.zarr", output="./data/1H_file_compact.zarr",
+                 velocity_dtype="int16", time_chunk=720, compressor="blosc-zstd") -> None:
+    """Copy the zarr store to `output` with a compact encoding."""
+    store.rewrite_zarr(path, output, encoding_options=dict(velocity_dtype=velocity_dtype,
+                                                          time_chunk=time_chunk, compressor=compressor))
+
+def encoding_report(file_name, transformed_path="./transformed_netCDF/") -> None:
+    """Compare the size and read speed of one cruise stored with several encodings."""
+    import xarray as xr
+
+    with xr.open_dataset(transformed_path + file_name) as ds:
+        print(store.compare_encodings(store.resample_1h(ds)).to_string(index=False))
+
+def build_index(path="./data/1H_file.zarr", output="./data/track_index.csv",
+                chunk_size=24) -> None:
+    """Build the spatial/temporal track index of every cruise of the zarr store."""
+    df = index.build_index(path, output=output, chunk_size=chunk_size)
+    print(len(df), "chunks in", output)
+
+def build_climatology(path="./data/1H_file.zarr", output="./data/climatology.zarr",
+                      lon_step=1.0, lat_step=1.0, depth_step=50.0, max_depth=1000.0,
+                      workers=None) -> None:
+    """Grid the currents of every cruise of the zarr store on a lon/lat/depth grid."""
+    clim = grid.build_climatology(path, output=output, lon_step=lon_step, lat_step=lat_step,
+                                  depth_step=depth_step, max_depth=max_depth, workers=workers)
+    print(int((clim.COUNT > 0).sum()), "cells with data in", output)
+
 def main() -> None:
+    # The library logs its progress, shown on the console by the commands
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
     fire.Fire({
-        "help": help
+        "help": help,
+        "fetch": fetch,
+        "build-catalog": build_catalog,
+        "transform": transform,
+        "convert-catalog": convert_catalog,
+        "update-zarr": update_zarr,
+        "rewrite-zarr": rewrite_zarr,
+        "encoding-report": encoding_report,
+        "build-index": build_index,
+        "build-climatology": build_climatology,
     })
 
 
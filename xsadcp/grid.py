@@ -0,0 +1,230 @@
+"""Climatology of the currents of every cruise of the zarr store, binned on a lon/lat/depth grid."""
+
+import numpy as np
+import xarray as xr
+
+# Sums accumulated in each grid cell, from which the mean, std and count are derived
+SUMS = ("COUNT", "UCUR_SUM", "VCUR_SUM", "UCUR_SUM2", "VCUR_SUM2")
+
+
+def grid_edges(lon_step=1.0, lat_step=1.0, depth_step=50.0, max_depth=1000.0,
+               longitude_range=(-180, 180), latitude_range=(-90, 90)):
+    """
+    Cell edges of the climatology grid.
+
+    Parameters:
+        lon_step (float): Width of the cells in degrees of longitude.
+        lat_step (float): Height of the cells in degrees of latitude.
+        depth_step (float): Thickness of the depth layers in meters.
+        max_depth (float): Depth of the bottom of the deepest layer in meters.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude of the grid.
+        latitude_range (tuple): Tuple containing the minimum and maximum latitude of the grid.
+
+    Returns:
+        tuple: Longitude, latitude and depth edges. Depth edges are negative and increasing, as PROFZ.
+    """
+    lon_edges = np.arange(longitude_range[0], longitude_range[1] + lon_step / 2, lon_step)
+    lat_edges = np.arange(latitude_range[0], latitude_range[1] + lat_step / 2, lat_step)
+    depth_edges = -np.arange(0, max_depth + depth_step / 2, depth_step)[::-1]
+    return lon_edges, lat_edges, depth_edges
+
+
+def empty_sums():
+    """
+    Sums of no cell, the starting point of `merge_sums`.
+
+    Returns:
+        dict: Empty cell indices ("CELL") and `SUMS` arrays.
+    """
+    return {"CELL": np.zeros(0, dtype=np.int64), **{name: np.zeros(0) for name in SUMS}}
+
+
+def merge_sums(first, second):
+    """
+    Merge two sparse sets of cell sums.
+
+    Parameters:
+        first (dict): Flat cell indices ("CELL") and the arrays of `SUMS` for these cells.
+        second (dict): Same as `first`.
+
+    Returns:
+        dict: Sums of the union of the cells, with sorted unique indices.
+    """
+    cells, inverse = np.unique(np.concatenate([first["CELL"], second["CELL"]]), return_inverse=True)
+    merged = {"CELL": cells}
+    for name in SUMS:
+        merged[name] = np.bincount(inverse, np.concatenate([first[name], second[name]]), minlength=cells.size)
+    return merged
+
+
+def bin_sums(ds, lon_edges, lat_edges, depth_edges):
+    """
+    Sum the current vectors of a dataset in the cells of the grid.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset with UCUR and VCUR along TIME and PROFZ.
+        lon_edges (numpy.ndarray): Longitude edges of the grid.
+        lat_edges (numpy.ndarray): Latitude edges of the grid.
+        depth_edges (numpy.ndarray): Depth edges of the grid (negative, increasing).
+
+    Returns:
+        dict: Flat indices of the cells holding data ("CELL") and their `SUMS`.
+    """
+    nlon, nlat, ndepth = lon_edges.size - 1, lat_edges.size - 1, depth_edges.size - 1
+    i = np.searchsorted(lon_edges, ds.LONGITUDE.values, side="right") - 1
+    j = np.searchsorted(lat_edges, ds.LATITUDE.values, side="right") - 1
+    k = np.searchsorted(depth_edges, ds.PROFZ.values, side="right") - 1
+    u = ds.UCUR.transpose("TIME", "PROFZ").values
+    v = ds.VCUR.transpose("TIME", "PROFZ").values
+
+    # Points outside the grid (or without position) are dropped
+    inside = ((i >= 0) & (i < nlon) & (j >= 0) & (j < nlat))[:, None] & ((k >= 0) & (k < ndepth))[None, :]
+    valid = inside & np.isfinite(u) & np.isfinite(v)
+    cell = ((k[None, :] * nlat + j[:, None]) * nlon + i[:, None])[valid]
+    u, v = u[valid].astype(np.float64), v[valid].astype(np.float64)
+
+    cells, inverse = np.unique(cell, return_inverse=True)
+    sums = {"CELL": cells}
+    for name, weights in [("COUNT", None), ("UCUR_SUM", u), ("VCUR_SUM", v),
+                          ("UCUR_SUM2", u * u), ("VCUR_SUM2", v * v)]:
+        sums[name] = np.bincount(inverse, weights, minlength=cells.size).astype(np.float64)
+    return sums
+
+
+def cruise_sums(file_name, path, lon_edges, lat_edges, depth_edges, chunk_size=5000):
+    """
+    Sum the current vectors of one cruise of the zarr store, streaming it by chunks of TIME.
+
+    Parameters:
+        file_name (str): Name of the cruise group.
+        path (str): Path of the zarr store.
+        lon_edges (numpy.ndarray): Longitude edges of the grid.
+        lat_edges (numpy.ndarray): Latitude edges of the grid.
+        depth_edges (numpy.ndarray): Depth edges of the grid (negative, increasing).
+        chunk_size (int): Number of TIME steps read at once.
+
+    Returns:
+        dict: Flat indices of the cells holding data ("CELL") and their `SUMS`.
+    """
+    from .util import open_file
+
+    ds = open_file(file_name, path)[["UCUR", "VCUR"]]
+    sums = empty_sums()
+    for start in range(0, ds.sizes["TIME"], chunk_size):
+        chunk = ds.isel(TIME=slice(start, start + chunk_size)).load()
+        sums = merge_sums(bin_sums(chunk, lon_edges, lat_edges, depth_edges), sums)
+    ds.close()
+    return sums
+
+
+def climatology_slab(sums, shape):
+    """
+    Mean, standard deviation and count of the cells of one depth layer.
+
+    Parameters:
+        sums (dict): Sums of the cells of the layer, with indices flattened within the layer.
+        shape (tuple): Number of latitudes and longitudes of the grid.
+
+    Returns:
+        dict: UCUR_MEAN, UCUR_STD, VCUR_MEAN, VCUR_STD (NaN in empty cells) and COUNT arrays of `shape`.
+    """
+    count = np.zeros(shape[0] * shape[1], dtype=np.int32)
+    count[sums["CELL"]] = sums["COUNT"]
+    slab = {"COUNT": count.reshape(shape)}
+    for name in ("UCUR", "VCUR"):
+        mean = sums[name + "_SUM"] / sums["COUNT"]
+        variance = np.maximum(sums[name + "_SUM2"] / sums["COUNT"] - mean**2, 0)
+        for stat, values in [("MEAN", mean), ("STD", np.sqrt(variance))]:
+            dense = np.full(shape[0] * shape[1], np.nan, dtype=np.float32)
+            dense[sums["CELL"]] = values
+            slab[name + "_" + stat] = dense.reshape(shape)
+    return slab
+
+
+def build_climatology(path='./data/1H_file.zarr', output='./data/climatology.zarr',
+                      lon_step=1.0, lat_step=1.0, depth_step=50.0, max_depth=1000.0,
+                      longitude_range=(-180, 180), latitude_range=(-90, 90),
+                      workers=None, chunk_size=5000):
+    """
+    Grid the currents of every cruise of the zarr store and write the climatology as a zarr product.
+
+    Cruises are processed in parallel in a process pool, each one streamed by chunks of TIME.
+    Only the cells crossed by a cruise are kept in memory (as sums), and the output is
+    written one depth layer at a time, so that a whole cruise or grid is never held at once.
+
+    Parameters:
+        path (str): Path of the zarr store.
+        output (str): Path of the climatology zarr store to write.
+        lon_step (float): Width of the cells in degrees of longitude.
+        lat_step (float): Height of the cells in degrees of latitude.
+        depth_step (float): Thickness of the depth layers in meters.
+        max_depth (float): Depth of the bottom of the deepest layer in meters.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude of the grid.
+        latitude_range (tuple): Tuple containing the minimum and maximum latitude of the grid.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int): Number of TIME steps read at once by the workers.
+
+    Returns:
+        xarray.Dataset: The climatology, opened lazily from `output`.
+    """
+    import zarr
+    import dask.array as da
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .util import as_finished
+
+    lon_edges, lat_edges, depth_edges = grid_edges(lon_step, lat_step, depth_step, max_depth,
+                                                   longitude_range, latitude_range)
+    file_names = list(zarr.open_consolidated(path, mode='r').group_keys())
+
+    sums = empty_sums()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(cruise_sums, file_name, path, lon_edges, lat_edges, depth_edges, chunk_size): file_name
+            for file_name in file_names
+        }
+        for _, cruise in as_finished(futures, skip_errors=False):
+            sums = merge_sums(cruise, sums)
+
+    # Empty store with the layout of the product, then filled layer by layer
+    shape = (depth_edges.size - 1, lat_edges.size - 1, lon_edges.size - 1)
+    chunks = (1, min(shape[1], 512), min(shape[2], 512))
+    coords = {
+        "DEPTH": ("DEPTH", (depth_edges[:-1] + depth_edges[1:]) / 2),
+        "LATITUDE": ("LATITUDE", (lat_edges[:-1] + lat_edges[1:]) / 2),
+        "LONGITUDE": ("LONGITUDE", (lon_edges[:-1] + lon_edges[1:]) / 2),
+    }
+    dims = ("DEPTH", "LATITUDE", "LONGITUDE")
+    template = xr.Dataset(
+        {name: (dims, da.full(shape, np.nan, dtype=np.float32, chunks=chunks))
+         for name in ("UCUR_MEAN", "UCUR_STD", "VCUR_MEAN", "VCUR_STD")},
+        coords=coords,
+        attrs={"lon_step": lon_step, "lat_step": lat_step, "depth_step": depth_step,
+               "max_depth": max_depth, "cruises": len(file_names)},
+    )
+    template["COUNT"] = (dims, da.zeros(shape, dtype=np.int32, chunks=chunks))
+    template.to_zarr(output, mode="w", compute=False, consolidated=False)
+
+    layer_size = shape[1] * shape[2]
+    bounds = np.searchsorted(sums["CELL"], np.arange(shape[0] + 1) * layer_size)
+    for k in range(shape[0]):
+        layer = {name: values[bounds[k]:bounds[k + 1]] for name, values in sums.items()}
+        layer["CELL"] = layer["CELL"] - k * layer_size
+        slab = climatology_slab(layer, shape[1:])
+        xr.Dataset({name: (dims, values[None]) for name, values in slab.items()}).to_zarr(
+            output, region={"DEPTH": slice(k, k + 1)}, consolidated=False)
+    zarr.consolidate_metadata(output)
+    return load_climatology(output)
+
+
+def load_climatology(path='./data/climatology.zarr'):
+    """
+    Open the climatology written by `build_climatology`.
+
+    Parameters:
+        path (str): Path of the climatology zarr store.
+
+    Returns:
+        xarray.Dataset: The climatology, opened lazily.
+    """
+    return xr.open_dataset(path, engine='zarr', consolidated=True)
@@ -0,0 +1,178 @@
+"""Spatial and temporal index of the cruise tracks stored in the zarr DataTree."""
+
+import os
+
+COLUMNS = [
+    "file_name", "start", "stop",
+    "lon_min", "lon_max", "lat_min", "lat_max",
+    "time_min", "time_max",
+]
+
+
+def track_extents(ds, file_name, chunk_size=24):
+    """
+    Compute the extent of consecutive chunks of a cruise track.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset of the cruise, with LONGITUDE, LATITUDE and TIME along TIME.
+        file_name (str): Name of the cruise file.
+        chunk_size (int): Number of TIME steps per chunk.
+
+    Returns:
+        pandas.DataFrame: One row per chunk with its TIME index range [start, stop) and its
+                          longitude, latitude and time extents. Chunks without position are dropped.
+    """
+    import numpy as np
+    import pandas as pd
+
+    lon = ds.LONGITUDE.values
+    lat = ds.LATITUDE.values
+    time = ds.TIME.values
+    starts = np.arange(0, time.size, chunk_size)
+    stops = np.minimum(starts + chunk_size, time.size)
+    valid = np.isfinite(lon) & np.isfinite(lat)
+
+    rows = []
+    for start, stop in zip(starts, stops):
+        inside = valid[start:stop]
+        if not inside.any():
+            continue
+        rows.append((
+            file_name, start, stop,
+            lon[start:stop][inside].min(), lon[start:stop][inside].max(),
+            lat[start:stop][inside].min(), lat[start:stop][inside].max(),
+            time[start:stop].min(), time[start:stop].max(),
+        ))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def build_index(path='./data/1H_file.zarr', output='./data/track_index.csv', chunk_size=24):
+    """
+    Build the track index of every cruise of the zarr store.
+
+    Parameters:
+        path (str): Path of the zarr store.
+        output (str): Path of the csv index to write.
+        chunk_size (int): Number of TIME steps per chunk.
+
+    Returns:
+        pandas.DataFrame: The index written to `output`.
+    """
+    import pandas as pd
+    from .util import load_zarr
+
+    tree = load_zarr(path)
+    index = pd.concat(
+        [track_extents(node.ds, name, chunk_size) for name, node in tree.children.items()],
+        ignore_index=True,
+    ) if tree.children else pd.DataFrame(columns=COLUMNS)
+    index.to_csv(output, index=False)
+    return index
+
+
+def update_index(add=(), remove=(), path='./data/1H_file.zarr', output='./data/track_index.csv',
+                 chunk_size=24):
+    """
+    Replace or delete the rows of some cruises in the track index.
+
+    Parameters:
+        add (list of str): Cruises of the zarr store to (re)index.
+        remove (list of str): Cruises to remove from the index.
+        path (str): Path of the zarr store.
+        output (str): Path of the csv index. It is created if it does not exist.
+        chunk_size (int): Number of TIME steps per chunk.
+
+    Returns:
+        pandas.DataFrame: The index written to `output`.
+    """
+    import pandas as pd
+    from .util import load_zarr
+
+    index = load_index(output) if os.path.exists(output) else pd.DataFrame(columns=COLUMNS)
+    index = index[~index["file_name"].isin(list(add) + list(remove))]
+    if add:
+        tree = load_zarr(path)
+        frames = [track_extents(tree[name].ds, name, chunk_size) for name in add]
+        # An empty index (no csv yet, or every cruise replaced) is left out of the concatenation,
+        # which pandas deprecates for empty frames
+        if not index.empty:
+            frames.insert(0, index)
+        index = pd.concat(frames, ignore_index=True)
+    index.to_csv(output, index=False)
+    return index
+
+
+def load_index(path='./data/track_index.csv'):
+    """
+    Load the track index.
+
+    Parameters:
+        path (str): Path of the csv index.
+
+    Returns:
+        pandas.DataFrame: The index, with times parsed as datetime64.
+    """
+    import pandas as pd
+    return pd.read_csv(path, parse_dates=["time_min", "time_max"])
+
+
+def cruise_bounds(index):
+    """
+    Bounding box and time span of each cruise of the index.
+
+    Parameters:
+        index (pandas.DataFrame): Index returned by `load_index`.
+
+    Returns:
+        pandas.DataFrame: One row per file_name with lon_min, lon_max, lat_min, lat_max, time_min and time_max.
+    """
+    return index.groupby("file_name").agg(
+        lon_min=("lon_min", "min"), lon_max=("lon_max", "max"),
+        lat_min=("lat_min", "min"), lat_max=("lat_max", "max"),
+        time_min=("time_min", "min"), time_max=("time_max", "max"),
+    )
+
+
+def query(index, lon_range=(-180, 180), lat_range=(-90, 90), time_range=None):
+    """
+    Find the cruises, and the TIME index slices within them, which may cross a box and a time range.
+
+    The slices have the granularity of the index chunks: they contain every point of
+    the box, and `filter_data` keeps only the points actually inside.
+
+    Parameters:
+        index (pandas.DataFrame): Index returned by `load_index`.
+        lon_range (tuple): Tuple containing the minimum and maximum longitude values.
+        lat_range (tuple): Tuple containing the minimum and maximum latitude values.
+        time_range (tuple, optional): Tuple containing the first and last times (anything accepted by pandas.Timestamp).
+
+    Returns:
+        dict: Mapping of file name to the list of TIME index slices, adjacent chunks being merged.
+    """
+    import pandas as pd
+
+    # Cruises whose bounding box does not cross the box are discarded first
+    bounds = cruise_bounds(index)
+    mask = (
+        (bounds.lon_max >= lon_range[0]) & (bounds.lon_min <= lon_range[1])
+        & (bounds.lat_max >= lat_range[0]) & (bounds.lat_min <= lat_range[1])
+    )
+    if time_range is not None:
+        mask &= (bounds.time_max >= pd.Timestamp(time_range[0])) & (bounds.time_min <= pd.Timestamp(time_range[1]))
+
+    chunks = index[index["file_name"].isin(bounds.index[mask])]
+    mask = (
+        (chunks.lon_max >= lon_range[0]) & (chunks.lon_min <= lon_range[1])
+        & (chunks.lat_max >= lat_range[0]) & (chunks.lat_min <= lat_range[1])
+    )
+    if time_range is not None:
+        mask &= (chunks.time_max >= pd.Timestamp(time_range[0])) & (chunks.time_min <= pd.Timestamp(time_range[1]))
+
+    result = {}
+    for file_name, start, stop in chunks.loc[mask, ["file_name", "start", "stop"]].itertuples(index=False):
+        slices = result.setdefault(file_name, [])
+        if slices and slices[-1].stop == start:
+            slices[-1] = slice(slices[-1].start, int(stop))
+        else:
+            slices.append(slice(int(start), int(stop)))
+    return result
@@ -0,0 +1,186 @@
+"""Timing and payload sizes of the hot paths, exported in the Prometheus text format.
+
+Instrumentation is enabled by setting the XSADCP_METRICS environment variable to 1
+before xsadcp is imported. Otherwise `timed` returns the functions unchanged and
+`stage` is a no-op, so that the instrumented code runs exactly as before.
+"""
+
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get("XSADCP_METRICS", "0").lower() in ("1", "true", "yes")
+
+# Upper bounds of the duration histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    """
+    Durations and payload sizes recorded per stage, and gauges read at export time.
+
+    Available functions:
+        - record: Record one run of a stage.
+        - register_gauges: Add a function whose values are exported as gauges.
+        - summary: Return the statistics of the stages as a DataFrame.
+        - prometheus_text: Return every metric in the Prometheus text format.
+        - clear: Forget the recorded runs.
+    """
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._stages = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, nbytes=None):
+        """
+        Record one run of a stage.
+
+        Parameters:
+            name (str): Name of the stage.
+            seconds (float): Duration of the run.
+            nbytes (int, optional): Size of the payload produced by the run.
+        """
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {
+                    "count": 0, "seconds": 0.0, "max": 0.0,
+                    "buckets": [0] * len(BUCKETS), "bytes_count": 0, "bytes": 0,
+                }
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["max"] = max(stage["max"], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stage["buckets"][i] += 1
+            if nbytes is not None:
+                stage["bytes_count"] += 1
+                stage["bytes"] += int(nbytes)
+
+    def register_gauges(self, name, read):
+        """
+        Add a function whose values are exported as gauges, such as `RenderCache.stats`.
+
+        Parameters:
+            name (str): Prefix of the gauges.
+            read (callable): Function without argument returning a dict of numbers.
+        """
+        with self._lock:
+            self._gauges[name] = read
+
+    def summary(self):
+        """
+        Return the statistics of the stages.
+
+        Returns:
+            pandas.DataFrame: Count, total, mean and max duration (s) and mean payload (bytes) per stage.
+        """
+        import pandas as pd
+
+        with self._lock:
+            rows = [
+                {
+                    "stage": name, "count": stage["count"], "total_s": stage["seconds"],
+                    "mean_s": stage["seconds"] / stage["count"], "max_s": stage["max"],
+                    "mean_bytes": stage["bytes"] / stage["bytes_count"] if stage["bytes_count"] else None,
+                }
+                for name, stage in self._stages.items()
+            ]
+        return pd.DataFrame(rows, columns=["stage", "count", "total_s", "mean_s", "max_s", "mean_bytes"])
+
+    def prometheus_text(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The xsadcp_stage_seconds histogram, the xsadcp_stage_bytes summary and the gauges.
+        """
+        with self._lock:
+            stages = {name: dict(stage, buckets=list(stage["buckets"])) for name, stage in self._stages.items()}
+            gauges = dict(self._gauges)
+
+        lines = [
+            "# HELP xsadcp_stage_seconds Duration of the instrumented stages.",
+            "# TYPE xsadcp_stage_seconds histogram",
+        ]
+        for name, stage in stages.items():
+            for bound, count in zip(BUCKETS, stage["buckets"]):
+                lines.append(f'xsadcp_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'xsadcp_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'xsadcp_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'xsadcp_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines += [
+            "# HELP xsadcp_stage_bytes Size of the payloads produced by the instrumented stages.",
+            "# TYPE xsadcp_stage_bytes summary",
+        ]
+        for name, stage in stages.items():
+            if stage["bytes_count"]:
+                lines.append(f'xsadcp_stage_bytes_sum{{stage="{name}"}} {stage["bytes"]}')
+                lines.append(f'xsadcp_stage_bytes_count{{stage="{name}"}} {stage["bytes_count"]}')
+        for prefix, read in gauges.items():
+            for key, value in read().items():
+                lines.append(f"# TYPE xsadcp_{prefix}_{key} gauge")
+                lines.append(f"xsadcp_{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """Forget the recorded runs, keeping the gauges."""
+        with self._lock:
+            self._stages.clear()
+
+
+registry = Registry()
+
+
+def timed(name, nbytes=None):
+    """
+    Decorator recording the duration of each call of a function in `registry`.
+
+    When instrumentation is disabled, the function is returned unchanged.
+
+    Parameters:
+        name (str): Name of the stage.
+        nbytes (callable, optional): Function returning the payload size of the result, such as `len`.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            registry.record(name, time.perf_counter() - start,
+                            nbytes(result) if nbytes is not None else None)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def _stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.record(name, time.perf_counter() - start)
+
+
+def stage(name):
+    """
+    Context manager recording the duration of a block in `registry`.
+
+    Parameters:
+        name (str): Name of the stage.
+
+    Returns:
+        A context manager, doing nothing when instrumentation is disabled.
+    """
+    return _stage(name) if ENABLED else nullcontext()
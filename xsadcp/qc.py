@@ -0,0 +1,177 @@
+"""Masking of the SeaDataNet data by their quality flags, following a declarative policy."""
+
+import json
+
+import numpy as np
+import xarray as xr
+
+# SeaDataNet quality flags, stored as characters in the *_SEADATANET_QC variables
+FLAGS = {
+    "0": "no quality control", "1": "good value", "2": "probably good value",
+    "3": "probably bad value", "4": "bad value", "5": "changed value",
+    "6": "value below detection", "7": "value in excess", "8": "interpolated value",
+    "9": "missing value", "A": "value phenomenon uncertain", "B": "nominal value",
+    "Q": "value below limit of quantification",
+}
+MISSING = ord("9")
+
+# Policy of the first versions of transform_netCDF: a sample is kept only when the
+# currents and the ship velocity are all flagged good, and every variable is masked.
+DEFAULT_POLICY = [
+    {
+        "flags": ["UCUR_SEADATANET_QC", "VCUR_SEADATANET_QC", "USHIP_SEADATANET_QC", "VSHIP_SEADATANET_QC"],
+        "accept": "1",
+        "apply_to": ["USHIP", "VSHIP", "BATHY", "BOTTOM_DEPTH", "UCUR", "VCUR"],
+    },
+]
+
+# Each variable masked by its own flags, good and probably good values kept
+PER_VARIABLE_POLICY = [
+    {"flags": ["UCUR_SEADATANET_QC", "VCUR_SEADATANET_QC"], "accept": "12", "apply_to": ["UCUR", "VCUR"]},
+    {"flags": ["USHIP_SEADATANET_QC", "VSHIP_SEADATANET_QC"], "accept": "12", "apply_to": ["USHIP", "VSHIP"]},
+    {"flags": ["BATHY_SEADATANET_QC"], "accept": "12", "apply_to": ["BATHY"]},
+    {"flags": ["BOTTOM_DEPTH_SEADATANET_QC"], "accept": "12", "apply_to": ["BOTTOM_DEPTH"]},
+]
+
+POLICIES = {"default": DEFAULT_POLICY, "per-variable": PER_VARIABLE_POLICY}
+
+
+def load_policy(policy=None):
+    """
+    Return the rules of a QC policy.
+
+    A policy is a list of rules, each one a dict with:
+        - "flags": names of the QC variables tested;
+        - "accept": accepted SeaDataNet flags, such as "12" for good and probably good;
+        - "apply_to": names of the variables masked where any of the tested flags is not accepted.
+
+    Parameters:
+        policy (list, str or None): The rules, the name of one of `POLICIES`, or the path of a json
+            file holding the rules. Defaults to `DEFAULT_POLICY`.
+
+    Returns:
+        list: The rules.
+    """
+    if policy is None:
+        return DEFAULT_POLICY
+    if isinstance(policy, str):
+        if policy in POLICIES:
+            return POLICIES[policy]
+        with open(policy) as f:
+            policy = json.load(f)
+    for rule in policy:
+        missing = {"flags", "accept", "apply_to"} - set(rule)
+        if missing:
+            raise ValueError(f"QC rule {rule} has no {', '.join(sorted(missing))}")
+        unknown = set(rule["accept"]) - set(FLAGS)
+        if unknown:
+            raise ValueError(f"Unknown SeaDataNet flags {sorted(unknown)} in QC rule {rule}")
+    return policy
+
+
+def lookup_table(accept):
+    """
+    Table of the accepted flags, indexed by the flag byte.
+
+    Parameters:
+        accept (str): Accepted SeaDataNet flags.
+
+    Returns:
+        numpy.ndarray: Boolean array of 256 values, True at the codes of the accepted flags.
+    """
+    table = np.zeros(256, dtype=bool)
+    table[[ord(flag) for flag in accept]] = True
+    return table
+
+
+def flag_codes(values):
+    """
+    Flags as uint8 codes, without copy when they are stored as bytes.
+
+    Flags decoded as floats (when the QC variable has a _FillValue) have NaN where
+    the flag is missing, which is coded as the missing value flag "9".
+
+    Parameters:
+        values (numpy.ndarray): Values of a QC variable.
+
+    Returns:
+        numpy.ndarray: uint8 codes of the flags.
+    """
+    if values.dtype.kind in "iuS" and values.dtype.itemsize == 1:
+        return values.view(np.uint8)
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), MISSING, values).astype(np.uint8)
+    return values.astype(np.uint8)
+
+
+def flag_counts(flags):
+    """
+    Number of samples of each flag of a QC variable.
+
+    Parameters:
+        flags (xarray.DataArray): QC variable.
+
+    Returns:
+        dict: Number of samples per flag character, for the flags present.
+    """
+    if flags.chunks is not None:
+        import dask.array as da
+
+        codes = flags.data.map_blocks(flag_codes, dtype=np.uint8)
+        counts = da.bincount(codes.ravel(), minlength=256).compute()
+    else:
+        counts = np.bincount(flag_codes(flags.values).ravel(), minlength=256)
+    return {chr(code): int(counts[code]) for code in np.flatnonzero(counts)}
+
+
+def rule_mask(ds, rule):
+    """
+    Mask of the samples whose flags are all accepted by a rule.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset with the QC variables of the rule.
+        rule (dict): Rule of a QC policy.
+
+    Returns:
+        xarray.DataArray: Boolean mask, True where the samples are kept.
+    """
+    table = lookup_table(rule["accept"])
+
+    def accepted(*flags):
+        keep = table[flag_codes(flags[0])]
+        for values in flags[1:]:
+            keep &= table[flag_codes(values)]
+        return keep
+
+    flags = [ds[name] for name in rule["flags"]]
+    return xr.apply_ufunc(accepted, *flags, dask="parallelized", output_dtypes=[bool])
+
+
+def apply_qc(ds, policy=None):
+    """
+    Mask the variables of a SeaDataNet dataset according to a QC policy.
+
+    Each rule is evaluated once on the uint8 flags through a lookup table, and its
+    mask is applied only to the variables of the rule, which keep their dtype.
+    The policy and the number of samples of each flag are recorded in the
+    "qc_policy" and "qc_flag_counts" attributes (json).
+
+    Parameters:
+        ds (xarray.Dataset): Dataset with the data and QC variables.
+        policy (list, str or None): QC policy, see `load_policy`.
+
+    Returns:
+        xarray.Dataset: The masked dataset.
+    """
+    rules = load_policy(policy)
+    masks = {}
+    for rule in rules:
+        mask = rule_mask(ds, rule)
+        for name in rule["apply_to"]:
+            masks[name] = mask if name not in masks else masks[name] & mask
+    ds = ds.assign({name: ds[name].where(mask) for name, mask in masks.items() if name in ds})
+
+    flags = sorted({name for rule in rules for name in rule["flags"]})
+    ds.attrs["qc_policy"] = json.dumps(rules)
+    ds.attrs["qc_flag_counts"] = json.dumps({name: flag_counts(ds[name]) for name in flags})
+    return ds
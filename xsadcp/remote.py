@@ -0,0 +1,185 @@
+"""Concurrent download of SeaDataNet files from a remote archive (HTTPS) into a local content cache."""
+
+import io
+import os
+import time
+
+from .catalog import load_manifest, save_manifest
+from .util import as_finished, get_file_names, logger
+
+
+def remote_filesystem(url, **storage_options):
+    """
+    Return the fsspec filesystem serving `url`.
+
+    Parameters:
+        url (str): URL of a file or directory, such as "https://data-eurogoship.ifremer.fr/copy_seadatanet/".
+        **storage_options: Options of the filesystem (headers, client_kwargs...).
+
+    Returns:
+        fsspec.AbstractFileSystem: The filesystem.
+    """
+    import fsspec
+
+    protocol = url.split("://")[0] if "://" in url else "file"
+    return fsspec.filesystem(protocol, **storage_options)
+
+
+def remote_signature(fs, url):
+    """
+    Return the size and checksum advertised by the server for a file.
+
+    Parameters:
+        fs (fsspec.AbstractFileSystem): Filesystem serving `url`.
+        url (str): URL of the file.
+
+    Returns:
+        dict: Size (bytes) and ETag of the file, None when the server does not send them.
+    """
+    info = fs.info(url)
+    return {"size": info.get("size"), "etag": info.get("ETag")}
+
+
+def retry(func, retries=3, backoff=1.0, label=""):
+    """
+    Call `func`, retrying with an exponential backoff on transient errors.
+
+    A missing file (FileNotFoundError) is not retried.
+
+    Parameters:
+        func (callable): Function without argument.
+        retries (int): Number of retries after the first attempt.
+        backoff (float): Delay before the first retry in seconds, doubled at each retry.
+        label (str): Name logged with the errors.
+
+    Returns:
+        The result of `func`.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except FileNotFoundError:
+            raise
+        except Exception as error:
+            if attempt == retries:
+                raise
+            logger.warning("%s failed: %s - retrying", label, error)
+            time.sleep(backoff * 2**attempt)
+
+
+def fetch_file(fs, url, local_path, retries=3, backoff=1.0):
+    """
+    Download one file, retrying on transient errors.
+
+    The file is written next to `local_path` then renamed, so an interrupted
+    download never leaves a truncated file in the cache.
+
+    Parameters:
+        fs (fsspec.AbstractFileSystem): Filesystem serving `url`.
+        url (str): URL of the file.
+        local_path (str): Path of the downloaded file.
+        retries (int): Number of retries after the first attempt.
+        backoff (float): Delay before the first retry in seconds, doubled at each retry.
+
+    Returns:
+        str: `local_path`.
+    """
+    tmp_path = local_path + ".part"
+
+    def download():
+        try:
+            fs.get_file(url, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return local_path
+
+    return retry(download, retries, backoff, label=os.path.basename(url))
+
+
+def fetch_files(url, file_names=None, cache_dir="./data/remote_cache/", workers=8,
+                retries=3, backoff=1.0, force=False, **storage_options):
+    """
+    Download SeaDataNet files of a remote archive into a local cache, several at a time.
+
+    The cache keeps a manifest of the size and ETag of every downloaded file, so a
+    refresh only downloads the files which are new or changed on the server. The
+    cache directory can then be used as the `path` of `build_catalog`.
+
+    Parameters:
+        url (str): URL of the remote directory, ending with "/".
+        file_names (list, optional): Names of the files to download. Defaults to every .nc file of `url`.
+        cache_dir (str): Local directory of the cache.
+        workers (int): Maximum number of concurrent downloads.
+        retries (int): Number of retries of a failed download.
+        backoff (float): Delay before the first retry in seconds, doubled at each retry.
+        force (bool, optional): Whether to download every file again. Defaults to False.
+        **storage_options: Options of the fsspec filesystem.
+
+    Returns:
+        list: Paths of the cached files, in the order of `file_names`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    fs = remote_filesystem(url, **storage_options)
+    if file_names is None:
+        file_names = get_file_names(url, local_pc=False, **storage_options)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    entries = {} if force else load_manifest(manifest_path)
+
+    def fetch(file_name):
+        signature = retry(lambda: remote_signature(fs, url + file_name), retries, backoff, label=file_name)
+        local_path = os.path.join(cache_dir, file_name)
+        cached = entries.get(file_name)
+        # Without size nor ETag, a change on the server cannot be detected: the cached copy is kept
+        if cached is not None and os.path.exists(local_path) and cached["signature"] == signature:
+            return file_name, signature, False
+        fetch_file(fs, url + file_name, local_path, retries=retries, backoff=backoff)
+        return file_name, signature, True
+
+    downloaded, unchanged = 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, file_name): file_name for file_name in file_names}
+        # A failed file is not recorded in the manifest, so it is retried on the next refresh
+        for file_name, (_, signature, fetched) in as_finished(futures):
+            if not fetched:
+                unchanged += 1
+                continue
+            entries[file_name] = {"signature": signature}
+            save_manifest(entries, manifest_path)
+            downloaded += 1
+    save_manifest(entries, manifest_path)
+    logger.info("%d files downloaded, %d unchanged, %d failed",
+                downloaded, unchanged, len(file_names) - downloaded - unchanged)
+    return [os.path.join(cache_dir, file_name) for file_name in file_names]
+
+
+def open_remote_dataset(url, retries=3, backoff=1.0, **storage_options):
+    """
+    Open a remote SeaDataNet file in memory, without writing it to disk.
+
+    The netCDF3 reader reads every variable when the file is opened, so reading it
+    by blocks with range requests would fetch all of them anyway: the file is fetched
+    whole in one request, retried on transient errors. Files read more than once are
+    better downloaded into the cache of `fetch_files`.
+
+    Parameters:
+        url (str): URL of the file.
+        retries (int): Number of retries of a failed open.
+        backoff (float): Delay before the first retry in seconds, doubled at each retry.
+        **storage_options: Options of the fsspec filesystem.
+
+    Returns:
+        xarray.Dataset: The dataset, with TIME in julian days.
+    """
+    import xarray as xr
+
+    fs = remote_filesystem(url, **storage_options)
+
+    def open_dataset():
+        data = fs.cat_file(url)
+        return xr.open_dataset(io.BytesIO(data), decode_cf=True, decode_times=False, engine="scipy").load()
+
+    return retry(open_dataset, retries, backoff, label=os.path.basename(url))
@@ -0,0 +1,41 @@
+"""Routes added to the Panel server with `panel serve xsadcp/app.py --plugins xsadcp.server`."""
+
+import time
+
+from tornado.web import RequestHandler
+
+from .metrics import registry
+
+# Start of the server process: Panel imports the plugins before it listens
+# (without the plugin, when the first session imports the app)
+STARTED = time.perf_counter()
+
+# Cold start of the process, set once by `report_cold_start`
+cold_start = {}
+registry.register_gauges("server", lambda: dict(cold_start))
+
+
+def report_cold_start():
+    """
+    Log the cold start of the server process, from its start to the first session served.
+
+    Only the first call of the process reports, as every session runs the app again.
+    The duration is also exported as the xsadcp_server_cold_start_seconds gauge.
+    """
+    if cold_start:
+        return
+    import panel as pn
+
+    cold_start["cold_start_seconds"] = time.perf_counter() - STARTED
+    pn.state.log(f"SADCP_Viewer ready in {cold_start['cold_start_seconds']:.2f}s after the server start")
+
+
+class MetricsHandler(RequestHandler):
+    """Serve the metrics of `xsadcp.metrics` in the Prometheus text format."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(registry.prometheus_text())
+
+
+ROUTES = [("/metrics", MetricsHandler, {})]
@@ -0,0 +1,185 @@
+"""Read-only memory-mapped copies of the bathymetry and the cruise groups, shared by the processes of the server.
+
+Each dataset is decoded once into a directory of .npy files, one per variable, named
+after a signature of its source. Every process (`panel serve --num-procs N`, the render
+workers of `SADCP_Viewer`) then maps these files instead of decoding its own copy: the
+pages are held once by the operating system, whatever the number of processes.
+
+Sharing is off unless the XSADCP_SHARED_DIR environment variable names the directory
+of the copies: a copy is a full decode of the cruise, made when the cruise is first
+opened, and the directory keeps one copy of every cruise viewed until `clear_shared`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import xarray as xr
+
+from .metrics import timed
+
+# Directory of the mapped copies, empty (the default) to read the sources directly
+SHARED_DIR = os.environ.get("XSADCP_SHARED_DIR", "")
+
+# Name of the description of the variables, written last so that a directory which has it is complete
+META_FILE = "dataset.json"
+
+
+def source_signature(path, group=None):
+    """
+    Return a signature which changes when a source file or zarr group is rewritten.
+
+    Parameters:
+        path (str): Path of the netCDF file or of the zarr store.
+        group (str, optional): Group of the zarr store, such as "cruise_SDN.nc/6h".
+
+    Returns:
+        str: Hexadecimal digest of the path, size and modification time of the source.
+    """
+    if group is None:
+        stamps = [path]
+    else:
+        # The group is recreated by store.write_cruise, which rewrites these files
+        stamps = [os.path.join(path, group, name) for name in (".zgroup", ".zattrs")]
+    parts = [os.path.abspath(path), group or ""]
+    for stamp in stamps:
+        if os.path.exists(stamp):
+            stat = os.stat(stamp)
+            parts += [str(stat.st_size), str(stat.st_mtime_ns)]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def mapped_directory(name, signature, shared_dir=SHARED_DIR):
+    """
+    Return the directory of the mapped copy of a dataset.
+
+    Parameters:
+        name (str): Name of the dataset, such as "bathy6min.nc" or "cruise_SDN.nc/6h".
+        signature (str): Signature of the source, see `source_signature`.
+        shared_dir (str): Directory of the mapped copies.
+
+    Returns:
+        str: Path of the directory.
+    """
+    return os.path.join(shared_dir, name.strip("/").replace("/", "__") + "-" + signature)
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} attribute cannot be stored")
+
+
+def write_mapped(ds, directory):
+    """
+    Decode a dataset into a directory of .npy files which `open_mapped` maps.
+
+    The files are written into a temporary directory renamed at the end, so that
+    processes decoding the same dataset at the same time never see a partial copy:
+    the first rename wins and the other copies are discarded.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset to copy. Its variables are loaded one at a time.
+        directory (str): Path of the directory, see `mapped_directory`.
+    """
+    tmp_directory = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(tmp_directory, exist_ok=True)
+    try:
+        variables = {}
+        for i, (name, variable) in enumerate(ds.variables.items()):
+            values = variable.values
+            if values.dtype.kind == "O":
+                values = values.astype(str)
+            file_name = f"{i}.npy"
+            np.save(os.path.join(tmp_directory, file_name), values, allow_pickle=False)
+            variables[name] = {"file": file_name, "dims": list(variable.dims), "attrs": variable.attrs}
+        meta = {"variables": variables, "coords": list(ds.coords), "attrs": ds.attrs}
+        with open(os.path.join(tmp_directory, META_FILE), "w") as f:
+            json.dump(meta, f, default=_json_value)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # Another process renamed its copy first
+            if not os.path.exists(os.path.join(directory, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def open_mapped(directory):
+    """
+    Open a copy written by `write_mapped`, its variables backed by read-only memory maps.
+
+    Nothing is read until the values are used, and writing to them raises an error.
+
+    Parameters:
+        directory (str): Path of the directory.
+
+    Returns:
+        xarray.Dataset: The dataset.
+    """
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    variables = {
+        name: xr.Variable(item["dims"], np.load(os.path.join(directory, item["file"]), mmap_mode="r"),
+                          item["attrs"])
+        for name, item in meta["variables"].items()
+    }
+    coords = {name: variables.pop(name) for name in meta["coords"]}
+    return xr.Dataset(variables, coords=coords, attrs=meta["attrs"])
+
+
+def remove_stale(name, signature, shared_dir=SHARED_DIR):
+    """
+    Delete the copies of a dataset made from previous versions of its source.
+
+    Processes still mapping them keep reading their pages until they open the new copy.
+
+    Parameters:
+        name (str): Name of the dataset.
+        signature (str): Signature of the current source.
+        shared_dir (str): Directory of the mapped copies.
+    """
+    prefix = os.path.basename(mapped_directory(name, "", shared_dir))
+    current = os.path.basename(mapped_directory(name, signature, shared_dir))
+    for entry in os.listdir(shared_dir):
+        # Same name and a signature of the same length, so "a.nc" never matches "a.nc-b.nc"
+        if entry.startswith(prefix) and len(entry) == len(current) and entry != current:
+            shutil.rmtree(os.path.join(shared_dir, entry), ignore_errors=True)
+
+
+@timed("shared_dataset")
+def shared_dataset(open_source, name, signature, shared_dir=SHARED_DIR):
+    """
+    Return the memory-mapped copy of a dataset, decoding it first if no process did.
+
+    Parameters:
+        open_source (callable): Function without argument opening the source dataset.
+        name (str): Name of the dataset, such as "bathy6min.nc" or "cruise_SDN.nc/6h".
+        signature (str): Signature of the source, see `source_signature`.
+        shared_dir (str): Directory of the mapped copies.
+
+    Returns:
+        xarray.Dataset: The dataset, backed by the mapped files.
+    """
+    directory = mapped_directory(name, signature, shared_dir)
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        os.makedirs(shared_dir, exist_ok=True)
+        with open_source() as ds:
+            write_mapped(ds, directory)
+        remove_stale(name, signature, shared_dir)
+    return open_mapped(directory)
+
+
+def clear_shared(shared_dir=SHARED_DIR):
+    """
+    Delete every mapped copy, which are made again when the datasets are next opened.
+
+    Parameters:
+        shared_dir (str): Directory of the mapped copies.
+    """
+    shutil.rmtree(shared_dir, ignore_errors=True)
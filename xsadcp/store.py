@@ -0,0 +1,325 @@
+"""Incremental update of the 1H_file.zarr DataTree store, one cruise group at a time."""
+
+import numpy as np
+import xarray as xr
+
+from .util import logger
+
+
+# Coarser TIME resolutions stored as children of each cruise group, finest first
+PYRAMID_LEVELS = ("6h", "1D")
+
+# Per-ping quantities repeated along PROFZ in the files, stored as 1-D TIME series
+PING_SERIES = ("BATHY", "USHIP", "VSHIP", "BOTTOM_DEPTH")
+
+
+# Velocities (m/s) which may be stored as int16 in mm/s
+VELOCITIES = ("UCUR", "VCUR", "USHIP", "VSHIP")
+
+# Compressors of `zarr_encoding`, by name
+COMPRESSORS = ("blosc-zstd", "blosc-lz4", "zstd", "none")
+
+
+def zarr_encoding(ds, velocity_dtype="int16", time_chunk=720, compressor="blosc-zstd", clevel=5):
+    """
+    Encoding of a resampled cruise for `to_zarr`.
+
+    Velocities (and their envelopes) are stored as int16 scaled to 1 mm/s, or as
+    float32, and the other floats as float32, with explicit fill values. Chunks hold
+    whole profiles and `time_chunk` steps of TIME, the contiguous runs read by
+    `filter_data` and `corsen_data`. The default is a multiple of the 24 steps
+    chunks of the track index, so that its slices never straddle two chunks.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset to store, such as the output of `resample_time`.
+        velocity_dtype (str): "int16", "float32" or "float64".
+        time_chunk (int): Number of TIME steps per chunk.
+        compressor (str): One of `COMPRESSORS`.
+        clevel (int): Compression level.
+
+    Returns:
+        dict: Encoding of each variable and coordinate of `ds`.
+    """
+    from numcodecs import Blosc, Zstd
+
+    if compressor == "blosc-zstd":
+        codec = Blosc(cname="zstd", clevel=clevel, shuffle=Blosc.SHUFFLE)
+    elif compressor == "blosc-lz4":
+        codec = Blosc(cname="lz4", clevel=clevel, shuffle=Blosc.SHUFFLE)
+    elif compressor == "zstd":
+        codec = Zstd(level=clevel)
+    elif compressor == "none":
+        codec = None
+    else:
+        raise ValueError(f"Unknown compressor {compressor!r}, expected one of {COMPRESSORS}")
+
+    encoding = {}
+    for name, var in ds.variables.items():
+        chunks = tuple(min(time_chunk, size) if dim == "TIME" else size for dim, size in var.sizes.items())
+        encoding[name] = {"chunks": chunks, "compressor": codec}
+        if var.dtype.kind != "f":
+            continue
+        velocity = name in VELOCITIES or (name.endswith(("_MIN", "_MAX")) and name[:-4] in VELOCITIES)
+        if velocity and velocity_dtype == "int16":
+            encoding[name].update(dtype="int16", scale_factor=0.001, _FillValue=-32768)
+        else:
+            encoding[name].update(dtype=velocity_dtype if velocity else "float32", _FillValue=np.nan)
+    return encoding
+
+
+def ping_series(ds):
+    """
+    Reduce the per-ping variables of a transformed cruise to 1-D series along TIME.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset written by `transform_netCDF`.
+
+    Returns:
+        xarray.Dataset: `ds` with the variables of `PING_SERIES` reduced by their maximum over PROFZ.
+    """
+    return ds.assign({
+        name: ds[name].max(dim="PROFZ")
+        for name in PING_SERIES if name in ds and "PROFZ" in ds[name].dims
+    })
+
+
+def resample_time(ds, freq="1h"):
+    """
+    Average a transformed cruise over bins of TIME.
+
+    The variables of `PING_SERIES` are stored as 1-D series, with their minimum
+    and maximum over each bin (NAME_MIN, NAME_MAX) so that the side panels can
+    draw the envelope of the pings at any level.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset written by `transform_netCDF`.
+        freq (str): Resampling frequency, such as "1h" or "1D".
+
+    Returns:
+        xarray.Dataset: Dataset averaged over `freq` bins of TIME.
+    """
+    coords = ["LATITUDE", "LONGITUDE"]
+    ds = ping_series(ds)
+    names = [name for name in PING_SERIES if name in ds]
+    series = ds[names].reset_coords(coords, drop=True).resample(TIME=freq)
+    envelopes = xr.merge([
+        series.min().rename({name: name + "_MIN" for name in names}),
+        series.max().rename({name: name + "_MAX" for name in names}),
+    ])
+    return (
+        ds.reset_coords(coords)
+        .resample(TIME=freq)
+        .mean()
+        .merge(envelopes)
+        .set_coords(["TIME", "LONGITUDE", "LATITUDE"])
+    )
+
+
+def resample_1h(ds):
+    """
+    Resample a transformed cruise to 1 hour, as stored in the zarr DataTree.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset written by `transform_netCDF`.
+
+    Returns:
+        xarray.Dataset: Dataset averaged over 1 hour bins of TIME.
+    """
+    return resample_time(ds, "1h")
+
+
+def write_pyramid(ds, file_name, path='./data/1H_file.zarr', levels=PYRAMID_LEVELS, consolidated=True,
+                  encoding_options=None):
+    """
+    Write the 1 hour group of one cruise and its coarser levels as child groups.
+
+    The group `file_name` keeps the 1 hour data read by `load_file`, and each level
+    of `levels` is stored in `file_name/<level>` so that `load_levels` can pick a
+    coarser one when few vectors are drawn.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset written by `transform_netCDF`.
+        file_name (str): Name of the cruise file, used as group name.
+        path (str): Path of the zarr store. It is created if it does not exist.
+        levels (tuple of str): Resampling frequencies of the coarser levels.
+        consolidated (bool, optional): Whether to update the consolidated metadata. Defaults to True.
+        encoding_options (dict, optional): Arguments of `zarr_encoding`. Defaults to its defaults.
+    """
+    # Replacing the cruise group also removes its previous levels
+    write_cruise(resample_1h(ds), file_name, path, consolidated=False, encoding_options=encoding_options)
+    for level in levels:
+        write_cruise(resample_time(ds, level), file_name + "/" + level, path, consolidated=False,
+                     encoding_options=encoding_options)
+    if consolidated:
+        consolidate_zarr(path)
+
+
+def write_cruise(ds, file_name, path='./data/1H_file.zarr', consolidated=True, encoding_options=None):
+    """
+    Add or replace the group of one cruise in the zarr store, leaving the other groups untouched.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset to store, usually the output of `resample_1h`.
+        file_name (str): Name of the cruise file, used as group name.
+        path (str): Path of the zarr store. It is created if it does not exist.
+        consolidated (bool, optional): Whether to update the consolidated metadata. Defaults to True.
+        encoding_options (dict, optional): Arguments of `zarr_encoding`. Defaults to its defaults.
+    """
+    # Encodings read from a previous store would override the policy
+    ds = ds.drop_encoding()
+    ds.to_zarr(path, group=file_name, mode="w", consolidated=False,
+               encoding=zarr_encoding(ds, **(encoding_options or {})))
+    if consolidated:
+        consolidate_zarr(path)
+
+
+def compare_encodings(ds, policies=None, repeat=3):
+    """
+    Compare the size, write and read times and precision of a cruise stored with several encodings.
+
+    Each policy is written to a temporary zarr store and read back as the viewer does
+    (`filter_data` on the whole track, then loaded), keeping the best of `repeat` reads.
+
+    Parameters:
+        ds (xarray.Dataset): Resampled cruise, such as the output of `resample_1h`.
+        policies (dict, optional): Mapping of policy name to the arguments of `zarr_encoding`,
+                                   None standing for the default encoding of xarray.
+        repeat (int): Number of reads timed per policy.
+
+    Returns:
+        pandas.DataFrame: One row per policy with the store size in bytes, its ratio to the
+                          xarray default, the write and read times in seconds, the read
+                          throughput in millions of values per second and the maximum error on UCUR/VCUR.
+    """
+    import os
+    import tempfile
+    import time
+    import pandas as pd
+    from .util import filter_data
+
+    if policies is None:
+        policies = {
+            "xarray default": None,
+            "float32 blosc-zstd": {"velocity_dtype": "float32"},
+            "int16 blosc-zstd": {},
+            "int16 blosc-lz4": {"compressor": "blosc-lz4"},
+            "int16 zstd": {"compressor": "zstd"},
+        }
+    ds = ds.drop_encoding().load()
+    box = ((float(ds.LONGITUDE.min()), float(ds.LONGITUDE.max())),
+           (float(ds.LATITUDE.min()), float(ds.LATITUDE.max())))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (name, options) in enumerate(policies.items()):
+            store = os.path.join(tmp, f"{i}.zarr")
+            start = time.perf_counter()
+            if options is None:
+                ds.to_zarr(store, group="cruise", mode="w", consolidated=False)
+            else:
+                write_cruise(ds, "cruise", store, consolidated=False, encoding_options=options)
+            write_s = time.perf_counter() - start
+            size = sum(
+                os.path.getsize(os.path.join(root, file))
+                for root, _, files in os.walk(store) for file in files
+            )
+
+            read_s = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                read = xr.open_dataset(store, engine="zarr", group="cruise", consolidated=False)
+                read = filter_data(read, *box).load()
+                read_s = min(read_s, time.perf_counter() - start)
+            error = max(float(abs(read[var] - ds[var]).max()) for var in ("UCUR", "VCUR"))
+            values = sum(var.size for var in read.variables.values())
+            rows.append({"policy": name, "size_bytes": size, "write_s": write_s, "read_s": read_s,
+                         "read_Mvalues_s": values / 1e6 / read_s, "max_error": error})
+
+    report = pd.DataFrame(rows)
+    report.insert(2, "size_ratio", report["size_bytes"] / report["size_bytes"].iloc[0])
+    return report
+
+
+def rewrite_zarr(path='./data/1H_file.zarr', output='./data/1H_file_compact.zarr', encoding_options=None):
+    """
+    Copy every group of a zarr store to a new store with the encoding policy of `zarr_encoding`.
+
+    Parameters:
+        path (str): Path of the zarr store to read.
+        output (str): Path of the zarr store to write.
+        encoding_options (dict, optional): Arguments of `zarr_encoding`. Defaults to its defaults.
+    """
+    import zarr
+
+    root = zarr.open_consolidated(path, mode='r')
+    groups = [name for name, _ in root.groups()]
+    for file_name in groups:
+        logger.info('%s rewriting', file_name)
+        names = [file_name] + [file_name + "/" + level for level in root[file_name].group_keys()]
+        for name in names:
+            with xr.open_dataset(path, engine='zarr', group=name, consolidated=True) as ds:
+                write_cruise(ds, name, output, consolidated=False, encoding_options=encoding_options)
+    consolidate_zarr(output)
+
+
+def remove_cruise(file_name, path='./data/1H_file.zarr', consolidated=True):
+    """
+    Delete the group of one cruise from the zarr store.
+
+    Parameters:
+        file_name (str): Name of the cruise file, used as group name.
+        path (str): Path of the zarr store.
+        consolidated (bool, optional): Whether to update the consolidated metadata. Defaults to True.
+    """
+    import zarr
+
+    root = zarr.open_group(path, mode="a")
+    if file_name in root:
+        del root[file_name]
+    if consolidated:
+        consolidate_zarr(path)
+
+
+def consolidate_zarr(path='./data/1H_file.zarr'):
+    """
+    Rewrite the consolidated metadata of the zarr store so that `load_zarr` sees the current groups.
+
+    Parameters:
+        path (str): Path of the zarr store.
+    """
+    import zarr
+
+    zarr.consolidate_metadata(path)
+
+
+def update_zarr(add=(), remove=(), path='./data/1H_file.zarr',
+                transformed_path='./transformed_netCDF/', levels=PYRAMID_LEVELS,
+                index_path='./data/track_index.csv', encoding_options=None):
+    """
+    Add, replace or delete cruise groups of the zarr store without rewriting the others.
+
+    The rows of the same cruises are updated in the track index (see `xsadcp.index`).
+
+    Parameters:
+        add (list of str): Files of `transformed_path` to resample and add (or replace) in the store.
+        remove (list of str): Cruise groups to delete from the store.
+        path (str): Path of the zarr store.
+        transformed_path (str): Directory of the files written by `transform_netCDF`.
+        levels (tuple of str): Resampling frequencies of the coarser levels written with each cruise.
+        index_path (str, optional): Path of the csv track index, or None to leave it alone.
+        encoding_options (dict, optional): Arguments of `zarr_encoding`. Defaults to its defaults.
+    """
+    from .index import update_index
+
+    for file_name in remove:
+        logger.info('%s removing', file_name)
+        remove_cruise(file_name, path, consolidated=False)
+    for file_name in add:
+        logger.info('%s adding', file_name)
+        with xr.open_dataset(transformed_path + file_name) as ds:
+            write_pyramid(ds, file_name, path, levels=levels, consolidated=False,
+                          encoding_options=encoding_options)
+    # Consolidate once, at the end of the batch
+    consolidate_zarr(path)
+    if index_path:
+        update_index(add=add, remove=remove, path=path, output=index_path)
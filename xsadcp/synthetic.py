@@ -0,0 +1,144 @@
+"""Synthetic SeaDataNet-like ship ADCP files, for benchmarks and trying the pipeline without the archive."""
+
+import numpy as np
+import xarray as xr
+
+# SeaDataNet quality flags, as stored in the *_SEADATANET_QC variables
+GOOD, BAD = ord("1"), ord("4")
+
+QC_PATTERNS = ("good", "random", "blocks", "deep")
+
+
+def qc_flags(shape, pattern="random", fraction=0.1, rng=None):
+    """
+    Quality flags of a synthetic cruise.
+
+    Parameters:
+        shape (tuple): Number of MAXT and MAXZ samples.
+        pattern (str): One of `QC_PATTERNS`:
+            - "good": every sample is good;
+            - "random": a `fraction` of the samples, scattered, is bad;
+            - "blocks": bad runs of whole profiles covering a `fraction` of the time;
+            - "deep": the deepest `fraction` of the bins of each profile is bad, with a varying bottom.
+        fraction (float): Fraction of bad samples.
+        rng (numpy.random.Generator, optional): Random generator.
+
+    Returns:
+        numpy.ndarray: int8 flags of `shape`.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    flags = np.full(shape, GOOD, dtype=np.int8)
+    if pattern == "random":
+        flags[rng.random(shape) < fraction] = BAD
+    elif pattern == "blocks":
+        length = max(1, shape[0] // 50)
+        starts = rng.choice(shape[0], size=int(fraction * shape[0] / length), replace=False)
+        for start in starts:
+            flags[start:start + length] = BAD
+    elif pattern == "deep":
+        bottom = shape[1] - rng.integers(0, int(2 * fraction * shape[1]) + 1, size=shape[0])
+        flags[np.arange(shape[1])[None, :] >= bottom[:, None]] = BAD
+    elif pattern != "good":
+        raise ValueError(f"Unknown QC pattern {pattern!r}, expected one of {QC_PATTERNS}")
+    return flags
+
+
+def synthetic_sdn(maxt=2000, maxz=40, gaps=0, qc_pattern="random", qc_fraction=0.1,
+                  time_step=300, start="2010-01-01", seed=0):
+    """
+    Build a dataset laid out like the SeaDataNet ADCP files read by `open_ds`.
+
+    The ship drifts from 30W 40N, currents are random, TIME is in julian days and
+    PROFZ is positive, as in the archive.
+
+    Parameters:
+        maxt (int): Number of pings (MAXT).
+        maxz (int): Number of depth bins (MAXZ).
+        gaps (int): Number of data gaps, runs of pings without position nor currents.
+        qc_pattern (str): Pattern of the current quality flags, one of `QC_PATTERNS`.
+        qc_fraction (float): Fraction of bad current flags.
+        time_step (float): Time between pings in seconds.
+        start (str): Date of the first ping.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        xarray.Dataset: Dataset with the INSTANCE, MAXT and MAXZ dimensions and the SDN variables.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (maxt, maxz)
+
+    # Julian days starting at 0h, as read by `julian_to_datetime64`
+    julian_start = (np.datetime64(start, "s") - np.datetime64("1970-01-01", "s")) / np.timedelta64(1, "D") + 2440588
+    time = julian_start + np.arange(maxt) * time_step / 86400
+    lon = -30 + np.cumsum(rng.normal(0.01, 0.002, maxt))
+    lat = 40 + np.cumsum(rng.normal(0.005, 0.002, maxt))
+    profz = np.broadcast_to(20.0 + 8.0 * np.arange(maxz), shape)
+    ucur = rng.normal(0, 0.3, shape)
+    vcur = rng.normal(0, 0.3, shape)
+
+    # Gaps: the instrument keeps pinging without position nor valid currents
+    if gaps:
+        length = max(1, maxt // (20 * gaps))
+        for gap_start in rng.choice(maxt - length, size=gaps, replace=False):
+            gap = slice(gap_start, gap_start + length)
+            lon[gap] = lat[gap] = np.nan
+            ucur[gap] = vcur[gap] = np.nan
+
+    flags = qc_flags(shape, qc_pattern, qc_fraction, rng)
+    good = np.full(shape, GOOD, dtype=np.int8)
+
+    def profile(values):
+        return np.repeat(values[:, None], maxz, axis=1)
+
+    dims = ("INSTANCE", "MAXT", "MAXZ")
+    return xr.Dataset(
+        {
+            "UCUR": (dims, ucur[None]),
+            "VCUR": (dims, vcur[None]),
+            "USHIP": (dims, profile(rng.normal(5, 1, maxt))[None]),
+            "VSHIP": (dims, profile(rng.normal(1, 1, maxt))[None]),
+            "BATHY": (dims, profile(rng.normal(-3000, 100, maxt))[None]),
+            "BOTTOM_DEPTH": (dims, profile(rng.normal(3000, 100, maxt))[None]),
+            "UCUR_SEADATANET_QC": (dims, flags[None]),
+            "VCUR_SEADATANET_QC": (dims, flags[None]),
+            "USHIP_SEADATANET_QC": (dims, good[None]),
+            "VSHIP_SEADATANET_QC": (dims, good[None]),
+            "BATHY_SEADATANET_QC": (dims, good[None]),
+            "BOTTOM_DEPTH_SEADATANET_QC": (dims, good[None]),
+            "SDN_XLINK": (("INSTANCE", "REFMAX"), np.array([[
+                b'<sdn_reference xlink:href="https://cdi.seadatanet.org/report/edmo/0/SYNTHETIC/xml" '
+                b'xlink:role="isDescribedBy" xlink:type="SDN:L23::CDI"/>'
+            ]])),
+            "SDN_LOCAL_CDI_ID": (("INSTANCE",), np.array([b"SYNTHETIC"])),
+            "SDN_CRUISE": (("INSTANCE",), np.array([b"SYNTHETIC"]), {"shipname": "SYNTHETIC", "shipcode": "00XX"}),
+        },
+        coords={
+            "TIME": (("INSTANCE", "MAXT"), time[None]),
+            "LONGITUDE": (("INSTANCE", "MAXT"), lon[None]),
+            "LATITUDE": (("INSTANCE", "MAXT"), lat[None]),
+            "PROFZ": (dims, profz[None]),
+        },
+        attrs={
+            "title": "Synthetic ship ADCP cruise", "Conventions": "SeaDataNet_1.0 CF1.6",
+            "featureType": "trajectoryProfile", "date_creation": start, "date_update": start,
+            "data_type": "SDN_ADCP", "ADCP_type": "OS", "ADCP_frequency": "150 kHz",
+            "ADCP_beam_angle": "30", "ADCP_ship_angle": "0", "bin_length": "8 m",
+            "middle_bin1_depth": "20", "heading_corr": "0", "pitch_corr": "0",
+            "ampli_corr": "0", "pitch_roll_used": "no",
+        },
+    )
+
+
+def write_synthetic_sdn(path, **kwargs):
+    """
+    Write a synthetic cruise as a netCDF3 file, readable by `open_ds`.
+
+    Parameters:
+        path (str): Path of the file to write.
+        **kwargs: Arguments of `synthetic_sdn`.
+
+    Returns:
+        str: `path`.
+    """
+    synthetic_sdn(**kwargs).to_netcdf(path, engine="scipy")
+    return path
@@ -1,5 +1,21 @@
+import functools
+import logging
+import os
+
 import xarray as xr
 
+from .cache import RenderCache, quantize, sizeof
+from .metrics import registry, timed
+
+# Projected background layers of the map, keyed by extent and projection,
+# shared by every call of vectors_plot in the process
+base_map_cache = RenderCache(max_bytes=128 * 2**20)
+registry.register_gauges("base_map_cache", base_map_cache.stats)
+
+# Progress of the library (files opened and transformed, catalog, download, store, climatology),
+# silent unless the caller configures logging as the command line does
+logger = logging.getLogger("xsadcp")
+
 def get_range(da):
     return  ( int(da.min().round() - 1), int(da.max().round() + 1),)
 
@@ -8,19 +24,184 @@ def load_csv(path='./data/zarr_table.csv'):
     df = pd.read_csv(path,index_col=None)
     return df.sort_values(by="year") #inplace=True)
 
-def load_bathymetry(path='./data/bathy6min.nc'):
-    return xr.open_dataset(path, decode_times=False, use_cftime=True)
+def load_bathymetry(path='./data/bathy6min.nc', shared_dir=None):
+    """
+    Open the bathymetry grid.
+
+    Parameters:
+        path (str): Path of the netCDF file.
+        shared_dir (str, optional): Directory of the memory-mapped copies shared by the
+            processes (see `xsadcp.shared`). Defaults to None, reading the file directly.
+
+    Returns:
+        xarray.Dataset: The bathymetry, with the signature of its file in the "source_signature"
+            encoding, which identifies it in the cache of `bathy_contour_lines`.
+    """
+    from .shared import shared_dataset, source_signature
+
+    def open_source():
+        return xr.open_dataset(path, decode_times=False, use_cftime=True)
+
+    signature = source_signature(path)
+    bathy = open_source() if not shared_dir else shared_dataset(
+        open_source, os.path.basename(path), signature, shared_dir)
+    bathy.encoding["source_signature"] = signature
+    return bathy
+
+@functools.lru_cache(maxsize=4)
+def cached_bathymetry(path, signature, shared_dir=None):
+    """
+    `load_bathymetry` opened once per process and version of the file, for the render workers.
+
+    Parameters:
+        path (str): Path of the netCDF file.
+        signature (str): Signature of the file (see `xsadcp.shared.source_signature`), so that
+            a rewritten file is opened again.
+        shared_dir (str, optional): Directory of the memory-mapped copies, see `load_bathymetry`.
+
+    Returns:
+        xarray.Dataset: The bathymetry.
+    """
+    return load_bathymetry(path, shared_dir)
+
+def bathy_extent(bathy, longitude_range, latitude_range, margin=1):
+    """
+    Cut the bathymetry grid to an extent, lazily: only the cut is read when it is used.
+
+    Parameters:
+        bathy (xarray.Dataset): Bathymetry returned by `load_bathymetry`.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range  (tuple): Tuple containing the minimum and maximum latitude values.
+        margin (float): Margin in degrees kept around the extent.
+
+    Returns:
+        xarray.Dataset: The part of the bathymetry covering the extent, with the signature of
+            its file in the "source_signature" encoding.
+    """
+    lon, lat = bathy.longitude, bathy.latitude
+    cut = bathy.isel(
+        longitude=((lon >= longitude_range[0] - margin) & (lon <= longitude_range[1] + margin)).values,
+        latitude=((lat >= latitude_range[0] - margin) & (lat <= latitude_range[1] + margin)).values,
+    )
+    cut.encoding = dict(bathy.encoding)
+    return cut
 
 def load_zarr(path='./data/1H_file.zarr'):
     from datatree import open_datatree
-    return open_datatree(path, engine='zarr')
+    # The consolidated metadata is rewritten by every update of the store (see xsadcp.store)
+    return open_datatree(path, engine='zarr', consolidated=True)
 
 def load_file(tree,selected_file):
     return tree[selected_file+"/"].ds
 
+def _level_names(names):
+    """Keep the names of the pyramid levels, such as "6h" or "1D", sorted finest first."""
+    import pandas as pd
+    durations = {}
+    for name in names:
+        try:
+            durations[name] = pd.to_timedelta(name)
+        except ValueError:
+            # A group which is not a pyramid level
+            continue
+    return sorted(durations, key=durations.get)
+
+def load_levels(tree,selected_file):
+    """
+    Collect the 1 hour data of a cruise and its coarser pyramid levels.
+
+    Parameters:
+        tree (datatree.DataTree): Tree returned by `load_zarr`.
+        selected_file (str): Name of the cruise file.
+
+    Returns:
+        dict: Mapping of level name to dataset, finest first. Cruises stored without
+              pyramid only have the "1h" level, and child groups which are not levels are skipped.
+    """
+    node = tree[selected_file+"/"]
+    levels = {"1h": node.ds}
+    levels.update((name, node[name].ds) for name in _level_names(node.children))
+    return levels
+
+def open_file(selected_file,path='./data/1H_file.zarr',shared_dir=None):
+    """
+    Open the group of one cruise lazily, without opening the rest of the store.
+
+    Parameters:
+        selected_file (str): Name of the cruise file (or "<file>/<level>" for a pyramid level).
+        path (str): Path of the zarr store.
+        shared_dir (str, optional): Directory of the memory-mapped copies shared by the
+            processes (see `xsadcp.shared`). Defaults to None, reading the store directly.
+
+    Returns:
+        xarray.Dataset: Lazily loaded dataset of the group, or its decoded, memory-mapped copy.
+    """
+    def open_source():
+        return xr.open_dataset(path, engine='zarr', group=selected_file, consolidated=True)
+
+    if not shared_dir:
+        return open_source()
+    from .shared import shared_dataset, source_signature
+    return shared_dataset(open_source, selected_file, source_signature(path, selected_file), shared_dir)
+
+@timed("open_levels")
+def open_levels(selected_file,path='./data/1H_file.zarr',shared_dir=None):
+    """
+    Lazy counterpart of `load_levels` which reads only the consolidated metadata of the store.
+
+    Parameters:
+        selected_file (str): Name of the cruise file.
+        path (str): Path of the zarr store.
+        shared_dir (str, optional): Directory of the memory-mapped copies, see `open_file`.
+
+    Returns:
+        dict: Mapping of level name to dataset, finest first.
+    """
+    import zarr
+    names = _level_names(zarr.open_consolidated(path, mode='r')[selected_file].group_keys())
+    levels = {"1h": open_file(selected_file, path, shared_dir)}
+    levels.update((name, open_file(selected_file+"/"+name, path, shared_dir)) for name in names)
+    return levels
+
+@timed("select_level")
+def select_level(levels,longitude_range,latitude_range,sample):
+    """
+    Pick the coarsest pyramid level which still has at least `sample` vectors in the box.
+
+    Only the LONGITUDE/LATITUDE coordinates of each level are read to count the vectors.
+
+    Parameters:
+        levels (dict): Mapping of level name to dataset, finest first, as returned by `load_levels`.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range (tuple): Tuple containing the minimum and maximum latitude values.
+        sample (int): Number of vectors used for downsampling.
+
+    Returns:
+        xarray.Dataset: Dataset of the selected level (the finest one if none has enough vectors).
+    """
+    datasets = list(levels.values())
+    for ds in reversed(datasets[1:]):
+        inside = (
+            (ds.LONGITUDE >= longitude_range[0])
+            & (ds.LONGITUDE <= longitude_range[1])
+            & (ds.LATITUDE >= latitude_range[0])
+            & (ds.LATITUDE <= latitude_range[1])
+        )
+        if int(inside.sum()) >= sample:
+            return ds
+    return datasets[0]
+
 def filter_df(sorted_df,selected_file):
+    import pandas as pd
+    # The catalog of load_catalog is indexed by file name, the csv of load_csv has to be scanned
+    if selected_file in sorted_df.index:
+        rows = sorted_df.loc[[selected_file]]
+    else:
+        rows = sorted_df[sorted_df["file_name"] == selected_file]
+    rows = rows.assign(**{column: rows[column].dt.strftime("%Y-%m-%d") for column in ("date_start", "date_end")
+                          if pd.api.types.is_datetime64_any_dtype(rows[column])})
     # include  user_interface_url here
-    dataframe = sorted_df[sorted_df["file_name"] == selected_file][[
+    dataframe = rows[[
                     "shipname",
                     "date_start",
                     "date_end",
@@ -31,20 +212,171 @@ def filter_df(sorted_df,selected_file):
                 ]]
     # include  LOCAL_CDI_ID here
     dataframe2 = (
-              sorted_df[sorted_df["file_name"] == selected_file]
+              rows
                # .drop( columns=[ "file_name", "date_start", "date_end", "ADCP_frequency(kHz)", "bin_length(meter)", "year", ])
             )
     return dataframe.transpose(), dataframe2.transpose()
 
+def inside_segments(inside):
+    """
+    Find the runs of True of a 1-D boolean array.
+
+    Parameters:
+        inside (numpy.ndarray): 1-D boolean array.
+
+    Returns:
+        list: List of slices, one per contiguous run of True.
+    """
+    import numpy as np
+    edges = np.flatnonzero(np.diff(inside.astype("int8"), prepend=0, append=0))
+    return [slice(int(start), int(stop)) for start, stop in zip(edges[::2], edges[1::2])]
+
+@timed("filter_data", nbytes=sizeof)
 def filter_data(ds,longitude_range,latitude_range):
-    return ds.where(
+    """
+    Keep the points of the track which are inside a longitude/latitude box.
+
+    The box is tested on the 1-D LONGITUDE/LATITUDE coordinates only. When the points
+    inside form one contiguous segment, as for a ship crossing the box once, the
+    result is an `isel` view of `ds`; otherwise the points are gathered with one
+    `isel` over their indices. Either way the variables keep their dtype.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset to filter.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range (tuple): Tuple containing the minimum and maximum latitude values.
+
+    Returns:
+        xarray.Dataset: Dataset restricted to the points inside the box.
+    """
+    import numpy as np
+    mask = (
         (ds.LONGITUDE >= longitude_range[0])
         & (ds.LONGITUDE <= longitude_range[1])
         & (ds.LATITUDE >= latitude_range[0])
-        & (ds.LATITUDE <= latitude_range[1]),
-        drop=True,
+        & (ds.LATITUDE <= latitude_range[1])
     )
+    if mask.ndim != 1:
+        return ds.where(mask, drop=True)
+    dim = mask.dims[0]
+    segments = inside_segments(mask.values)
+    if len(segments) == 1:
+        return ds.isel({dim: segments[0]})
+    return ds.isel({dim: np.flatnonzero(mask.values)})
+
+
+@timed("filter_time", nbytes=sizeof)
+def filter_time(ds,time_range):
+    """
+    Keep the points of a cruise within a time window.
+
+    TIME is the sorted index of the zarr store, so the window is found by binary
+    search in the index and the result is an `isel` view of `ds`, whatever the
+    length of the cruise. A TIME without index, or not sorted (such as before
+    `fix_time`), is compared point by point instead.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset to filter.
+        time_range (tuple): Tuple containing the first and last times (anything accepted by
+                            pandas.Timestamp), both included. None keeps the whole cruise.
+
+    Returns:
+        xarray.Dataset: Dataset restricted to the points of the window.
+    """
+    import numpy as np
+    import pandas as pd
+    if time_range is None:
+        return ds
+    start, stop = pd.Timestamp(time_range[0]), pd.Timestamp(time_range[1])
+    dim = ds["TIME"].dims[0]
+    index = ds.indexes.get("TIME")
+    if index is not None and index.is_monotonic_increasing:
+        return ds.isel({dim: index.slice_indexer(start, stop)})
+    mask = (ds.TIME >= start.to_datetime64()) & (ds.TIME <= stop.to_datetime64())
+    return ds.isel({dim: np.flatnonzero(mask.values)})
+
+
+@timed("depth_band_means")
+def depth_band_means(ds, depth_ranges):
+    """
+    Mean current vectors of several depth bands, computed in one pass over PROFZ.
+
+    The bands are stacked in a 0/1 membership matrix of shape (PROFZ, band), so that the
+    sums and the numbers of valid bins of every band come from a single matrix product
+    of UCUR and VCUR. Comparing more layers no longer multiplies the cost.
+
+    Parameters:
+        ds (xarray.Dataset): The dataset containing the current data.
+        depth_ranges (list of tuple): Minimum and maximum depth values of each band, selected
+                                      as `ds.sel(PROFZ=slice(depth_range[1], depth_range[0]))`.
+
+    Returns:
+        xarray.Dataset: UCUR and VCUR means over the bins where both are valid, and the COUNT
+                        of these bins, along a new leading BAND dimension (with DEPTH_MIN and
+                        DEPTH_MAX coordinates). Bands without valid bins are NaN.
+    """
+    import numpy as np
+
+    # Membership of the PROFZ bins in each band, with the same label semantics as sel
+    index = ds.indexes["PROFZ"]
+    bounds = [index.slice_indexer(depth_range[1], depth_range[0]) for depth_range in depth_ranges]
+    position = np.arange(index.size)[:, None]
+    weights = ((position >= [bound.start for bound in bounds])
+               & (position < [bound.stop for bound in bounds])).astype(np.float64)
+
+    # A bin counts when both components are valid, as a vector needs both
+    u = ds.UCUR.transpose(..., "PROFZ")
+    v = ds.VCUR.transpose(..., "PROFZ").values
+    dims = u.dims[:-1] + ("BAND",)
+    u = u.values
+    valid = np.isfinite(u) & np.isfinite(v)
+    count = valid.astype(np.float64) @ weights
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = {
+            name: (dims, np.where(count > 0, (np.where(valid, values, 0) @ weights) / count, np.nan))
+            for name, values in [("UCUR", u), ("VCUR", v)]
+        }
+    result["COUNT"] = (dims, count.astype(np.int64))
+
+    coords = {name: coord for name, coord in ds.coords.items() if "PROFZ" not in coord.dims}
+    coords["DEPTH_MIN"] = ("BAND", [depth_range[0] for depth_range in depth_ranges])
+    coords["DEPTH_MAX"] = ("BAND", [depth_range[1] for depth_range in depth_ranges])
+    return xr.Dataset(result, coords=coords).transpose("BAND", ...)
+
+def quiver_depth_bands(ax, bands, scale_factor, colors):
+    """
+    Plot quiver plots of the mean current vectors of each depth band.
+
+    Parameters:
+        ax (matplotlib.axes.Axes): The matplotlib axes object to plot on.
+        bands (xarray.Dataset): Band means returned by `depth_band_means`.
+        scale_factor (float): Scaling factor for the magnitude of the current vectors.
+        colors (list of str): Color of the quiver arrows of each band.
+
+    Returns:
+        list of matplotlib.quiver.Quiver: The quiver plot objects.
+    """
+    import cartopy.crs as ccrs
 
+    # Extract longitude and latitude coordinates
+    lon = bands.coords["LONGITUDE"].values
+    lat = bands.coords["LATITUDE"].values
+
+    # Plot one quiver plot per band
+    return [
+        ax.quiver(
+            lon,
+            lat,
+            bands.UCUR.values[band] * scale_factor,
+            bands.VCUR.values[band] * scale_factor,
+            color=color,
+            scale=2,
+            width=0.001,
+            headwidth=3,
+            transform=ccrs.PlateCarree(),
+        )
+        for band, color in enumerate(colors)
+    ]
 
 def quiver_depth_filtered(ax, ds, depth_range, scale_factor, color="blue"):
     """
@@ -60,51 +392,276 @@ def quiver_depth_filtered(ax, ds, depth_range, scale_factor, color="blue"):
     Returns:
         matplotlib.quiver.Quiver: The quiver plot object.
     """
-    # Filter data based on depth range
-    import cartopy.crs as ccrs
-    ds = ds.sel( PROFZ=slice(depth_range[1],depth_range[0]))
+    return quiver_depth_bands(ax, depth_band_means(ds, [depth_range]), scale_factor, [color])[0]
 
-    # Calculate mean current vectors within the selected depth range
-    u_mean = ds.UCUR.mean(dim="PROFZ", skipna=True)
-    v_mean = ds.VCUR.mean(dim="PROFZ", skipna=True)
+def selected_bands(depth_range, depth_2_range, depth_3_range, depth_2_checkbox=False, depth_3_checkbox=False):
+    """
+    Depth ranges and colors of the bands shown on the map.
 
-    # Extract longitude and latitude coordinates
-    lon = ds.coords["LONGITUDE"].values
-    lat = ds.coords["LATITUDE"].values
-
-    # Plot quiver plot
-    return ax.quiver(
-        lon,
-        lat,
-        u_mean * scale_factor,
-        v_mean * scale_factor,
-        color=color,
-        scale=2,
-        width=0.001,
-        headwidth=3,
-        transform=ccrs.PlateCarree(),
-    )
+    Parameters:
+        depth_range (tuple): Tuple containing the minimum and maximum depth values for filtering.
+        depth_2_range (tuple): Tuple containing the minimum and maximum depth values for filtering depth 2.
+        depth_3_range (tuple): Tuple containing the minimum and maximum depth values for filtering depth 3.
+        depth_2_checkbox (bool, optional): Whether to show depth 2. Defaults to False.
+        depth_3_checkbox (bool, optional): Whether to show depth 3. Defaults to False.
+
+    Returns:
+        tuple: List of depth ranges and list of colors.
+    """
+    depth_ranges, colors = [depth_range], ["blue"]
+    if depth_2_checkbox:
+        depth_ranges.append(depth_2_range)
+        colors.append("green")
+    if depth_3_checkbox:
+        depth_ranges.append(depth_3_range)
+        colors.append("red")
+    return depth_ranges, colors
+
+def lttb(x, y, n_out):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are kept, and in each of the `n_out - 2` buckets in
+    between the point forming the largest triangle with the previous kept point
+    and the mean of the next bucket, so that peaks survive the downsampling.
+
+    Parameters:
+        x (numpy.ndarray): Increasing abscissa, as floats.
+        y (numpy.ndarray): Values, without NaN.
+        n_out (int): Number of points to keep.
+
+    Returns:
+        numpy.ndarray: Sorted indices of the kept points (all of them if there are at most `n_out`).
+    """
+    import numpy as np
+
+    if n_out >= x.size or n_out < 3:
+        return np.arange(x.size)
+    edges = np.linspace(1, x.size - 1, n_out - 1).astype(int)
+    kept = np.zeros(n_out, dtype=int)
+    kept[-1] = x.size - 1
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < n_out - 1 else x.size
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        prev_x, prev_y = x[kept[i]], y[kept[i]]
+        area = np.abs((prev_x - next_x) * (y[start:stop] - prev_y) - (prev_x - x[start:stop]) * (next_y - prev_y))
+        kept[i + 1] = start + np.argmax(area)
+    return kept
+
+def envelope(low, high, n_out):
+    """
+    Reduce a min/max envelope to `n_out` buckets, keeping its extremes.
+
+    Parameters:
+        low (numpy.ndarray): Lower bound of the envelope.
+        high (numpy.ndarray): Upper bound of the envelope.
+        n_out (int): Number of buckets.
+
+    Returns:
+        tuple: Start index of each bucket, and minimum of `low` and maximum of `high` within it.
+    """
+    import numpy as np
+
+    starts = np.unique(np.linspace(0, low.size, min(n_out, low.size), endpoint=False).astype(int))
+    return starts, np.fmin.reduceat(low, starts), np.fmax.reduceat(high, starts)
 
-def bathy_uship_vship_bottom_depth(ds):
+@timed("bathy_uship_vship_bottom_depth")
+def bathy_uship_vship_bottom_depth(ds, width=400):
     """
-    Plot maximum values of bathymetry, USHIP, VSHIP, and bottom depth over time.
+    Plot bathymetry, USHIP, VSHIP, and bottom depth over time.
+
+    The 1-D series stored by `resample_time` are read directly (stores written before
+    are reduced by their maximum over PROFZ) and downsampled to `width` points with
+    `lttb`. When the level holds the NAME_MIN/NAME_MAX envelopes of the pings, they
+    are drawn behind each curve.
 
     Parameters:
         ds (xarray.Dataset): Dataset containing the required variables.
+        width (int): Width of the plots in pixels, the number of points sent per series.
 
     Returns:
-        list: List of hvplot objects representing the plots of maximum values of bathymetry,
+        list: List of HoloViews objects representing the plots of bathymetry,
               USHIP, VSHIP, and bottom depth over time.
     """
-    import hvplot.xarray
-    return [
-        ds["BATHY"].max(dim="PROFZ").hvplot(x="TIME", width=400, height=200),
-        ds["USHIP"].max(dim="PROFZ").hvplot(x="TIME", width=400, height=200),
-        ds["VSHIP"].max(dim="PROFZ").hvplot(x="TIME", width=400, height=200),
-        ds["BOTTOM_DEPTH"].max(dim="PROFZ").hvplot(x="TIME", width=400, height=200),
-    ]
+    import numpy as np
+    import holoviews as hv
+    import holoviews.plotting.bokeh  # noqa: F401, registers the Bokeh options used below
+
+    plots = []
+    for name in ["BATHY", "USHIP", "VSHIP", "BOTTOM_DEPTH"]:
+        series = ds[name].max(dim="PROFZ") if "PROFZ" in ds[name].dims else ds[name]
+        time = series.TIME.values
+        values = series.values
+        valid = np.isfinite(values)
+        x = time[valid].astype("int64").astype(np.float64)
+        kept = lttb(x, values[valid], width)
+        plot = hv.Curve((time[valid][kept], values[valid][kept]), "TIME", name)
+        if name + "_MIN" in ds and name + "_MAX" in ds:
+            low, high = ds[name + "_MIN"].values, ds[name + "_MAX"].values
+            bounded = np.isfinite(low) & np.isfinite(high)
+            if bounded.any():
+                starts, low, high = envelope(low[bounded], high[bounded], width)
+                plot = hv.Area((time[bounded][starts], low, high), "TIME", [name + "_MIN", name + "_MAX"]).opts(
+                    alpha=0.3, line_width=0) * plot
+        plots.append(plot.opts(width=width, height=200))
+    return plots
+
+
+# Components of the along-track section, as labels of the app and variables of `section_components`
+SECTION_COMPONENTS = {
+    "U": "UCUR", "V": "VCUR", "Speed": "SPEED", "Along-track": "ALONG_TRACK", "Cross-track": "CROSS_TRACK",
+}
+
+def section_components(ds):
+    """
+    Current components of the TIME x PROFZ section of a cruise.
+
+    The along- and cross-track components are projected on the direction of the ship
+    velocity (USHIP, VSHIP), positive forward and to port. They are NaN where the ship
+    does not move, as its heading is then unknown.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset with UCUR, VCUR, USHIP and VSHIP.
+
+    Returns:
+        xarray.Dataset: UCUR, VCUR, SPEED, ALONG_TRACK and CROSS_TRACK on (TIME, PROFZ).
+    """
+    import numpy as np
+    # Stores written before resample_time repeat the ship velocity on every depth bin
+    uship = ds.USHIP.max(dim="PROFZ") if "PROFZ" in ds.USHIP.dims else ds.USHIP
+    vship = ds.VSHIP.max(dim="PROFZ") if "PROFZ" in ds.VSHIP.dims else ds.VSHIP
+    ship_speed = np.hypot(uship, vship)
+    ship_speed = ship_speed.where(ship_speed > 0)
+    cos, sin = uship / ship_speed, vship / ship_speed
+    return xr.Dataset({
+        "UCUR": ds.UCUR, "VCUR": ds.VCUR, "SPEED": np.hypot(ds.UCUR, ds.VCUR),
+        "ALONG_TRACK": ds.UCUR * cos + ds.VCUR * sin,
+        "CROSS_TRACK": ds.VCUR * cos - ds.UCUR * sin,
+    }).transpose("TIME", "PROFZ")
+
+@timed("aggregate_section", nbytes=sizeof)
+def aggregate_section(da, time_range=None, depth_range=None, width=600, height=250):
+    """
+    Mean of the cells of a TIME x PROFZ section falling in each pixel of a canvas.
+
+    Like a datashader mean reduction, each cell is binned by its TIME and PROFZ values
+    (gaps between the segments kept by `filter_data` stay empty), so the result never
+    has more than `width` x `height` values, whatever the length of the section. Axes
+    with fewer cells than pixels keep one bin per cell.
+
+    Parameters:
+        da (xarray.DataArray): Section on (TIME, PROFZ).
+        time_range (tuple, optional): First and last times shown. Defaults to the whole section.
+        depth_range (tuple, optional): Lowest and highest PROFZ shown. Defaults to the whole section.
+        width (int): Number of pixels along TIME.
+        height (int): Number of pixels along PROFZ.
 
+    Returns:
+        xarray.DataArray: Mean values on (PROFZ, TIME), at the centers of the bins.
+    """
+    import numpy as np
+
+    # Times in whole seconds, so that the bins of cells on a regular grid are computed exactly
+    time = da.TIME.values.astype("datetime64[s]").astype(np.int64)
+    depth = da.PROFZ.values.astype(np.float64)
+    if time.size == 0 or depth.size == 0:
+        return xr.DataArray(np.full((0, 0), np.nan), coords={"PROFZ": [], "TIME": np.array([], "datetime64[ns]")},
+                            dims=("PROFZ", "TIME"), name=da.name)
+    t0, t1 = (time.min(), time.max()) if time_range is None else (
+        np.datetime64(time_range[0], "s").astype(np.int64), np.datetime64(time_range[1], "s").astype(np.int64))
+    d0, d1 = (depth.min(), depth.max()) if depth_range is None else (min(depth_range), max(depth_range))
+
+    in_time = np.flatnonzero((time >= t0) & (time <= t1))
+    in_depth = np.flatnonzero((depth >= d0) & (depth <= d1))
+    nx, ny = max(1, min(width, in_time.size)), max(1, min(height, in_depth.size))
+    ix = np.minimum((time[in_time] - t0) * nx // max(t1 - t0, 1), nx - 1)
+    iy = np.minimum(((depth[in_depth] - d0) * ny / max(d1 - d0, 1e-9)).astype(np.int64), ny - 1)
+
+    def block(indices):
+        # Sorted coordinates in range are a contiguous block, read as a view
+        contiguous = indices.size and np.all(np.diff(indices) == 1)
+        return slice(indices[0], indices[-1] + 1) if contiguous else indices
+
+    values = da.transpose("TIME", "PROFZ").values[block(in_time)][:, block(in_depth)]
+    if not np.all(np.diff(ix) >= 0):
+        order = np.argsort(ix, kind="stable")
+        values, ix = values[order], ix[order]
+
+    # Reduce along TIME first, the long axis, one contiguous block of rows per pixel column,
+    # then along PROFZ with a (PROFZ, pixel) membership matrix
+    starts = np.flatnonzero(np.diff(ix, prepend=-1))
+    stops = np.append(starts[1:], ix.size)
+    sums, counts = np.zeros((nx, in_depth.size)), np.zeros((nx, in_depth.size))
+    for column, start, stop in zip(ix[starts], starts, stops):
+        rows = values[start:stop]
+        valid = np.isfinite(rows)
+        counts[column] = valid.sum(axis=0)
+        sums[column] = np.where(valid, rows, 0).sum(axis=0, dtype=np.float64)
+    membership = np.zeros((in_depth.size, ny))
+    membership[np.arange(in_depth.size), iy] = 1
+    with np.errstate(invalid="ignore"):
+        mean = ((sums @ membership) / (counts @ membership)).T
+
+    time_centers = (t0 + (np.arange(nx) + 0.5) * (t1 - t0) / nx) * 1e9
+    depth_centers = d0 + (np.arange(ny) + 0.5) * (d1 - d0) / ny
+    return xr.DataArray(mean.astype(np.float32),
+                        coords={"PROFZ": depth_centers, "TIME": time_centers.astype(np.int64).astype("datetime64[ns]")},
+                        dims=("PROFZ", "TIME"), name=da.name)
+
+@timed("section_plot")
+def section_plot(ds, component="SPEED", width=600, height=250):
+    """
+    Interactive TIME x depth section of a current component, aggregated on the server.
+
+    Only the canvas-sized output of `aggregate_section` is sent to the browser. Zooming
+    or panning re-aggregates the cells of the visible range, so that details appear at
+    full resolution without sending the whole section.
 
+    Parameters:
+        ds (xarray.Dataset): Dataset with UCUR, VCUR, USHIP and VSHIP.
+        component (str): Variable of `section_components`, such as "SPEED" or "ALONG_TRACK".
+        width (int): Width of the plot in pixels.
+        height (int): Height of the plot in pixels.
+
+    Returns:
+        holoviews.DynamicMap: Image of the section, updated with the visible range.
+    """
+    import numpy as np
+    import holoviews as hv
+    import holoviews.plotting.bokeh  # noqa: F401, registers the Bokeh options used below
+    from holoviews.streams import RangeXY
+
+    section = section_components(ds)[component].load()
+    values = section.values[np.isfinite(section.values)]
+    if component == "SPEED":
+        clim, cmap = (0, float(values.max()) if values.size else 1), "viridis"
+    else:
+        # Diverging colors centred on 0, the same scale at every zoom level
+        limit = float(np.abs(values).max()) if values.size else 1
+        clim, cmap = (-limit, limit), "RdBu_r"
+
+    time, depth = np.sort(section.TIME.values), np.sort(section.PROFZ.values)
+    # Cells centred on their coordinates, one step wide (one hour and one bin for the 1 hour level)
+    time_step = np.median(np.diff(time)) if time.size > 1 else np.timedelta64(3600, "s")
+    depth_step = np.median(np.diff(depth)) if depth.size > 1 else 1
+    extent = (time[0] - time_step / 2, time[-1] + time_step / 2,
+              depth[0] - depth_step / 2, depth[-1] + depth_step / 2) if time.size else None
+
+    def image(x_range, y_range):
+        if extent is None:
+            return hv.Image(aggregate_section(section), kdims=["TIME", "PROFZ"], vdims=[component])
+        t0, t1 = (extent[0], extent[1]) if x_range is None else (np.datetime64(x_range[0]), np.datetime64(x_range[1]))
+        d0, d1 = (extent[2], extent[3]) if y_range is None else (min(y_range), max(y_range))
+        mean = aggregate_section(section, (t0, t1), (d0, d1), width, height)
+        # Bounds given explicitly, as a canvas of one column cannot be located from its coordinates
+        return hv.Image(np.flipud(mean.values), bounds=(t0, d0, t1, d1), kdims=["TIME", "PROFZ"],
+                        vdims=[component]).opts(
+            width=width, height=height, cmap=cmap, clim=clim, colorbar=True, tools=["hover"])
+
+    return hv.DynamicMap(image, streams=[RangeXY()])
+
+@timed("corsen_data", nbytes=sizeof)
 def corsen_data(ds, sample):
     """
     Downsample the dataset `ds` based on the number of vectors specified by `sample`.
@@ -114,8 +671,11 @@ def corsen_data(ds, sample):
         sample (int): Number of vectors used for downsampling.
 
     Returns:
-        xarray.Dataset: Downsampled dataset.
+        xarray.Dataset: Downsampled dataset, `ds` itself if it is empty.
     """
+    if ds.TIME.size == 0:
+        # An empty box or time window, which xarray cannot reduce
+        return ds
     coords = ["LATITUDE", "LONGITUDE"]
     corsen = max(1, ds.TIME.size // sample)
     return (
@@ -127,10 +687,88 @@ def corsen_data(ds, sample):
 
 
 
+@timed("base_map_layers")
+def base_map_layers(longitude_range, latitude_range, projection, margin=1):
+    """
+    Coastlines, borders and land clipped to an extent and projected once, then cached.
+
+    Parameters:
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range  (tuple): Tuple containing the minimum and maximum latitude values.
+        projection (cartopy.crs.Projection): Projection of the map.
+        margin (float): Margin in degrees kept around the extent, within [-180, 180] x [-90, 90].
+
+    Returns:
+        dict: Lists of shapely geometries in `projection` coordinates for "coastline", "borders" and "land".
+    """
+    def compute():
+        import shapely
+        import cartopy.crs as ccrs
+        import cartopy.feature as cfeature
+        # The margin stops at the antimeridian and the poles, the bounds of the Natural Earth data
+        extent = (max(longitude_range[0] - margin, -180), min(longitude_range[1] + margin, 180),
+                  max(latitude_range[0] - margin, -90), min(latitude_range[1] + margin, 90))
+        layers = {}
+        for name, feature in (("coastline", cfeature.COASTLINE), ("borders", cfeature.BORDERS),
+                              ("land", cfeature.LAND)):
+            geoms = (shapely.clip_by_rect(geom, extent[0], extent[2], extent[1], extent[3])
+                     for geom in feature.intersecting_geometries(extent))
+            layers[name] = [projection.project_geometry(geom, ccrs.PlateCarree())
+                            for geom in geoms if not geom.is_empty]
+        return layers
+
+    def nbytes(layers):
+        import shapely
+        return 16 * sum(int(shapely.get_num_coordinates(geoms).sum()) for geoms in layers.values() if geoms)
+
+    key = ("layers", projection.proj4_init, quantize(tuple(longitude_range)), quantize(tuple(latitude_range)))
+    return base_map_cache.get_or_compute(key, compute, nbytes)
+
+@timed("bathy_contour_lines")
+def bathy_contour_lines(bathy, longitude_range, latitude_range, projection, level=-1000, margin=1):
+    """
+    Bathymetry contour lines at `level` inside an extent, projected once, then cached.
+
+    Only the part of the bathymetry grid covering the extent is contoured. The lines are
+    cached under the signature of the bathymetry file, so a grid without one (not opened
+    by `load_bathymetry`) is contoured at every call.
+
+    Parameters:
+        bathy (xarray.Dataset): Dataset containing bathymetry data (z on latitude, longitude).
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range  (tuple): Tuple containing the minimum and maximum latitude values.
+        projection (cartopy.crs.Projection): Projection of the map.
+        level (float): Depth of the contour.
+        margin (float): Margin in degrees kept around the extent.
+
+    Returns:
+        list: List of (N, 2) arrays of the contour lines in `projection` coordinates.
+    """
+    def compute():
+        import numpy as np
+        import contourpy
+        import cartopy.crs as ccrs
+        sub = bathy_extent(bathy, longitude_range, latitude_range, margin).z.transpose("latitude", "longitude")
+        if min(sub.shape) < 2:
+            return []
+        generator = contourpy.contour_generator(sub.longitude.values, sub.latitude.values,
+                                                np.ma.masked_invalid(sub.values),
+                                                line_type=contourpy.LineType.Separate)
+        return [projection.transform_points(ccrs.PlateCarree(), line[:, 0], line[:, 1])[:, :2]
+                for line in generator.lines(level)]
+
+    signature = bathy.encoding.get("source_signature")
+    if signature is None:
+        return compute()
+    key = ("bathy", signature, level, projection.proj4_init,
+           quantize(tuple(longitude_range)), quantize(tuple(latitude_range)))
+    return base_map_cache.get_or_compute(key, compute, lambda lines: sum(line.nbytes for line in lines))
+
+@timed("vectors_plot")
 def vectors_plot(ds, bathy, longitude_range, latitude_range ,
                  depth_range, depth_2_range, depth_3_range,
                  scale_factor=0.5, sample=100,
-                 depth_2_checkbox=False, depth_3_checkbox=False, bathy_checkbox=False):
+                 depth_2_checkbox=False, depth_3_checkbox=False, bathy_checkbox=False, coarsen=True):
     """
     Plot vectors filtered by depth on a map with specified features.
 
@@ -147,36 +785,40 @@ def vectors_plot(ds, bathy, longitude_range, latitude_range ,
         depth_2_checkbox (bool, optional): Whether to plot vectors for depth 2. Defaults to False.
         depth_3_checkbox (bool, optional): Whether to plot vectors for depth 3. Defaults to False.
         bathy_checkbox (bool, optional): Whether to plot bathymetry. Defaults to False.
+        coarsen (bool, optional): Whether to downsample `ds` to `sample` vectors with `corsen_data`.
+            Defaults to True, False for data already coarsened (see `render_vectors_png`).
 
     Returns:
         matplotlib.figure.Figure: The generated plot.
     """
     import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
     import cartopy.crs as ccrs
     import cartopy.feature as cfeature
     # Create subplot with Mercator projection
     fig, ax = plt.subplots(figsize=(5, 4), subplot_kw={"projection": ccrs.Mercator()})
 
     # Apply data downsampling
-    ds = corsen_data(ds, sample)
+    if coarsen:
+        ds = corsen_data(ds, sample)
 
-    # Plot vectors filtered by depth
-    quiver_depth_filtered(ax, ds, depth_range, scale_factor, color="blue")
-    if depth_2_checkbox:
-        quiver_depth_filtered(ax, ds, depth_2_range, scale_factor, color="green")
-    if depth_3_checkbox:
-        quiver_depth_filtered(ax, ds, depth_3_range, scale_factor, color="red")
+    # Plot vectors filtered by depth, every band being averaged in one pass
+    depth_ranges, colors = selected_bands(depth_range, depth_2_range, depth_3_range,
+                                          depth_2_checkbox, depth_3_checkbox)
+    quiver_depth_bands(ax, depth_band_means(ds, depth_ranges), scale_factor, colors)
 
-    # Add map features
-    ax.add_feature(cfeature.COASTLINE)
-    ax.add_feature(cfeature.BORDERS, linestyle=":")
-    ax.add_feature(cfeature.LAND, color="lightgray")
+    # Add map features, clipped and projected once per extent
+    layers = base_map_layers(longitude_range, latitude_range, ax.projection)
+    ax.add_geometries(layers["coastline"], ax.projection, **cfeature.COASTLINE.kwargs)
+    ax.add_geometries(layers["borders"], ax.projection, **cfeature.BORDERS.kwargs, linestyle=":")
+    ax.add_geometries(layers["land"], ax.projection, **{**cfeature.LAND.kwargs, "color": "lightgray"})
 
     # Plot bathymetry if provided
     if bathy_checkbox:
-        contour_levels = [-1000]
-        ax.contour(bathy.longitude, bathy.latitude, bathy.z,
-                   levels=contour_levels, colors="black", transform=ccrs.PlateCarree())
+        lines = bathy_contour_lines(bathy, longitude_range, latitude_range, ax.projection, level=-1000)
+        # Negative levels are dashed, as with ax.contour
+        ax.add_collection(LineCollection(lines, colors="black",
+                                         linestyles=plt.rcParams["contour.negative_linestyle"]))
 
     # Set extent and add gridlines
     ax.set_extent([longitude_range[0], longitude_range[1],
@@ -190,6 +832,208 @@ def vectors_plot(ds, bathy, longitude_range, latitude_range ,
     plt.close(fig) 
     return fig
 
+@timed("climatology_plot")
+def climatology_plot(clim, longitude_range, latitude_range, depth, scale_factor=0.5, min_count=1):
+    """
+    Plot the mean currents of one depth layer of the climatology on a map.
+
+    Parameters:
+        clim (xarray.Dataset): Climatology written by `build_climatology`.
+        longitude_range (tuple): Tuple containing the minimum and maximum longitude values.
+        latitude_range  (tuple): Tuple containing the minimum and maximum latitude values.
+        depth (float): Depth in meters (positive), the nearest layer is shown.
+        scale_factor (float): Scaling factor for the magnitude of the current vectors.
+        min_count (int, optional): Minimum number of hourly profile bins averaged in a cell for it
+            to be shown. Defaults to 1.
+
+    Returns:
+        matplotlib.figure.Figure: The generated plot.
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+
+    # Read only the layer and the cells of the box
+    layer = clim.sel(DEPTH=-abs(depth), method="nearest").sel(
+        LONGITUDE=slice(*longitude_range), LATITUDE=slice(*latitude_range)).load()
+    lon, lat = np.meshgrid(layer.LONGITUDE.values, layer.LATITUDE.values)
+    shown = layer.COUNT.values >= min_count
+
+    fig, ax = plt.subplots(figsize=(5, 4), subplot_kw={"projection": ccrs.Mercator()})
+    ax.quiver(
+        lon[shown],
+        lat[shown],
+        layer.UCUR_MEAN.values[shown] * scale_factor,
+        layer.VCUR_MEAN.values[shown] * scale_factor,
+        color="blue",
+        scale=2,
+        width=0.001,
+        headwidth=3,
+        transform=ccrs.PlateCarree(),
+    )
+
+    # Add map features, clipped and projected once per extent
+    layers = base_map_layers(longitude_range, latitude_range, ax.projection)
+    ax.add_geometries(layers["coastline"], ax.projection, **cfeature.COASTLINE.kwargs)
+    ax.add_geometries(layers["borders"], ax.projection, **cfeature.BORDERS.kwargs, linestyle=":")
+    ax.add_geometries(layers["land"], ax.projection, **{**cfeature.LAND.kwargs, "color": "lightgray"})
+
+    ax.set_extent([longitude_range[0], longitude_range[1],
+                   latitude_range[0], latitude_range[1]])
+    ax.gridlines(draw_labels=True)
+    ax.set_title(f"Climatology at {-float(layer.DEPTH):g} m ({int(layer.COUNT.values[shown].sum())} hourly profile bins)",
+                 fontsize=9)
+    plt.close(fig)
+    return fig
+
+def quiver_depth_hvplot(ds, depth_range, scale_factor, color="blue", band=None):
+    """
+    Build a HoloViews vector field of mean current vectors filtered by depth.
+
+    This is the Bokeh counterpart of `quiver_depth_filtered`. Positions are converted
+    to Web Mercator so that the field can be overlaid on map tiles.
+
+    Parameters:
+        ds (xarray.Dataset): The dataset containing the current data.
+        depth_range (tuple): Tuple containing the minimum and maximum depth values for filtering.
+        scale_factor (float): Scaling factor for the magnitude of the current vectors.
+        color (str, optional): Color of the arrows. Defaults to "blue".
+        band (xarray.Dataset, optional): Band already averaged by `depth_band_means`, used
+                                         instead of `ds` and `depth_range`.
+
+    Returns:
+        holoviews.VectorField: The vector field.
+    """
+    import numpy as np
+    import holoviews as hv
+    import holoviews.plotting.bokeh  # noqa: F401, registers the Bokeh options used below
+    from holoviews.util.transform import lon_lat_to_easting_northing
+
+    # Calculate mean current vectors within the selected depth range
+    if band is None:
+        band = depth_band_means(ds, [depth_range]).isel(BAND=0)
+    u_mean = band.UCUR.values
+    v_mean = band.VCUR.values
+    x, y = lon_lat_to_easting_northing(band.LONGITUDE.values, band.LATITUDE.values)
+
+    valid = np.isfinite(u_mean) & np.isfinite(v_mean) & np.isfinite(x) & np.isfinite(y)
+    return hv.VectorField(
+        (x[valid], y[valid],
+         np.arctan2(v_mean, u_mean)[valid], np.hypot(u_mean, v_mean)[valid] * scale_factor),
+        kdims=["x", "y"], vdims=["angle", "magnitude"],
+    ).opts(color=color, magnitude="magnitude", pivot="tail", line_width=1)
+
+@timed("vectors_hvplot")
+def vectors_hvplot(ds, longitude_range, latitude_range,
+                   depth_range, depth_2_range, depth_3_range,
+                   scale_factor=0.5, sample=100,
+                   depth_2_checkbox=False, depth_3_checkbox=False):
+    """
+    Interactive Bokeh version of `vectors_plot`, zoomed and panned in the browser.
+
+    The whole cruise is given to the plot and the longitude/latitude ranges only set the
+    view. Each vector field is decimated to at most `sample` arrows inside the visible
+    range, so zooming in reveals more arrows without redrawing the map on the server.
+
+    The view, the scale and the number of arrows may be given as parameters (such as
+    `widget.param.value`): the plot then follows them in place, without being built
+    again nor sending the cruise to the browser again.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset containing current data.
+        longitude_range (tuple or parameter): Minimum and maximum longitude values of the view.
+        latitude_range  (tuple or parameter): Minimum and maximum latitude values of the view.
+        depth_range (tuple): Tuple containing the minimum and maximum depth values for filtering.
+        depth_2_range (tuple): Tuple containing the minimum and maximum depth values for filtering depth 2.
+        depth_3_range (tuple): Tuple containing the minimum and maximum depth values for filtering depth 3.
+        scale_factor (float or parameter): Scaling factor of the length of the arrows.
+        sample (int or parameter): Maximum number of vectors shown in the visible range.
+        depth_2_checkbox (bool, optional): Whether to plot vectors for depth 2. Defaults to False.
+        depth_3_checkbox (bool, optional): Whether to plot vectors for depth 3. Defaults to False.
+
+    Returns:
+        holoviews.Overlay: Map tiles overlaid with the decimated vector fields.
+    """
+    import numpy as np
+    import param
+    from holoviews.element import tiles
+    from holoviews.operation import decimate
+    from holoviews.util.transform import lon_lat_to_easting_northing
+
+    # Every band is averaged in one pass
+    depth_ranges, colors = selected_bands(depth_range, depth_2_range, depth_3_range,
+                                          depth_2_checkbox, depth_3_checkbox)
+    bands = depth_band_means(ds, depth_ranges)
+    fields = [quiver_depth_hvplot(None, depth_range, 1, color=color, band=bands.isel(BAND=i))
+              for i, (depth_range, color) in enumerate(zip(depth_ranges, colors))]
+
+    # Web Mercator x depends only on the longitude, and y only on the latitude
+    xlim = param.bind(lambda lon: tuple(lon_lat_to_easting_northing(np.asarray(lon), np.zeros(2))[0]),
+                      longitude_range)
+    ylim = param.bind(lambda lat: tuple(lon_lat_to_easting_northing(np.zeros(2), np.asarray(lat))[1]),
+                      latitude_range)
+    plot = tiles.CartoLight()
+    for field in fields:
+        # framewise so that a new view is applied, zooming in the browser still keeps its own range
+        plot = plot * decimate(field, max_samples=sample).apply.opts(
+            scale=scale_factor, xlim=xlim, ylim=ylim, framewise=True)
+    return plot.opts(width=500, height=400, xlabel="Longitude", ylabel="Latitude")
+
+@timed("figure_to_png", nbytes=len)
+def figure_to_png(fig, dpi=144):
+    """
+    Render a matplotlib figure to png bytes, as `pn.pane.Matplotlib` does.
+
+    Parameters:
+        fig (matplotlib.figure.Figure): Figure to render.
+        dpi (int): Resolution of the png.
+
+    Returns:
+        bytes: The png image.
+    """
+    from io import BytesIO
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi,
+                facecolor=fig.get_facecolor(), edgecolor=fig.get_edgecolor())
+    return buffer.getvalue()
+
+@timed("render_vectors_png", nbytes=len)
+def render_vectors_png(ds, longitude_range, latitude_range,
+                       depth_range, depth_2_range, depth_3_range,
+                       scale_factor=0.5, sample=100,
+                       depth_2_checkbox=False, depth_3_checkbox=False, bathy_checkbox=False,
+                       bathy_path='./data/bathy6min.nc', dpi=144, shared_dir=None):
+    """
+    Render the vector map of `vectors_plot` as png.
+
+    Only picklable arguments are taken, and the bathymetry is opened from its path once
+    per process, so that the map can be rendered in a worker process (see `SADCP_Viewer`).
+    Only the extent of the map is read from the bathymetry grid.
+
+    Parameters:
+        ds (xarray.Dataset): The loaded dataset, already coarsened with `corsen_data` (see
+            `SADCP_Viewer.load_coarsened`), which is not coarsened again.
+        bathy_path (str): Path of the bathymetry, opened when `bathy_checkbox` is True.
+        dpi (int): Resolution of the png.
+        shared_dir (str, optional): Directory of the memory-mapped bathymetry shared by the
+            workers, see `load_bathymetry`.
+        Other parameters: see `vectors_plot`.
+
+    Returns:
+        bytes: The png image of the map.
+    """
+    from .shared import source_signature
+    bathy = None
+    if bathy_checkbox:
+        bathy = bathy_extent(cached_bathymetry(bathy_path, source_signature(bathy_path), shared_dir),
+                             longitude_range, latitude_range)
+    fig = vectors_plot(ds, bathy, longitude_range, latitude_range,
+                       depth_range, depth_2_range, depth_3_range, scale_factor, sample,
+                       depth_2_checkbox=depth_2_checkbox, depth_3_checkbox=depth_3_checkbox,
+                       bathy_checkbox=bathy_checkbox, coarsen=False)
+    return figure_to_png(fig, dpi=dpi)
+
 def greg_0h(jourjul):
     import math
     import numpy as np
@@ -280,23 +1124,57 @@ def greg_0hfull(jourjul):
     return gtime
 
 
-def fix_time(ds):
-    from datetime import datetime, timedelta
+def julian_to_datetime64(jourjul):
+    """
+    Convert an array of Julian days to datetime64[ns] in one vectorized pass.
+
+    This is the array counterpart of `greg_0hfull`: the same rounding is
+    applied, the seconds are truncated the same way, and NaN Julian days
+    are returned as NaT.
+
+    Parameters:
+        jourjul (array-like): Julian days (Julian day 2440000 begins at 00 hours, May 23, 1968).
+
+    Returns:
+        numpy.ndarray: Array of datetime64[ns] with the shape of `jourjul`.
+    """
+    import numpy as np
+
+    jourjul = np.asarray(jourjul, dtype="float64")
+    valid = np.isfinite(jourjul)
+
+    # Round the input Julian day number to avoid precision errors
+    fac = 10**9
+    jourjul = np.round(fac * jourjul + 0.5) / fac
+
+    # Calculate seconds in the day and round them the same way
+    secs = (jourjul % 1) * 24 * 3600
+    secs = np.round(fac * secs + 0.5) / fac
 
+    hour = np.floor(secs / 3600)
+    mins = np.floor((secs % 3600) / 60)
+    sec = np.trunc(secs % 60)
+
+    # Julian day 2440588 begins at 00 hours, January 1, 1970
+    days = np.where(valid, np.floor(jourjul) - 2440588, 0).astype("int64")
+    seconds = np.where(valid, hour * 3600 + mins * 60 + sec, 0).astype("int64")
+
+    date = days.astype("datetime64[D]").astype("datetime64[ns]")
+    date = date + seconds.astype("timedelta64[s]")
+    return np.where(valid, date, np.datetime64("NaT", "ns"))
+
+
+@timed("fix_time")
+def fix_time(ds):
     time = ds["TIME"]
     time2 = time.dropna(dim="MAXT")
     time2 = time2.reindex_like(time, method="nearest")
-    jourjul = [greg_0hfull(jourjul) for jourjul in time2.values]
-    date = [
-        datetime(jourjul[0], jourjul[1], jourjul[2], jourjul[3], jourjul[4], jourjul[5])
-        for jourjul in jourjul
-    ]
-    date = xr.DataArray(date, dims="MAXT")
+    date = xr.DataArray(julian_to_datetime64(time2.values), dims="MAXT")
     return ds.assign(TIME=date)
 
 
 def transform_netCDF_old(ds,selected_file):
-    print(selected_file,'transforminig')
+    logger.info('%s transforming', selected_file)
 
     ds = (
                 ds
@@ -330,8 +1208,24 @@ def transform_netCDF_old(ds,selected_file):
     return 
 
 
-def transform_netCDF(ds,selected_file):
-    print(selected_file,'transforminig')
+@timed("transform_netCDF")
+def transform_netCDF(ds,selected_file,engine=None,qc_policy=None):
+    """
+    Mask the data by their quality flags, fix TIME and write the file to transformed_netCDF/.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset as returned by `open_ds`.
+        selected_file (str): Name of the file.
+        engine (str, optional): Engine of `to_netcdf`.
+        qc_policy (list, str or None): QC policy, see `xsadcp.qc.load_policy`. Defaults to good
+            currents and ship velocity, applied to every variable.
+
+    Returns:
+        xarray.Dataset: The transformed dataset.
+    """
+    from .qc import apply_qc
+
+    logger.info('%s transforming', selected_file)
 
     ds = (
                 ds
@@ -344,18 +1238,8 @@ def transform_netCDF(ds,selected_file):
     #
     #ds.reset_coords("PROFZ")
     ds["PROFZ"]=PROFZ
-    ds = ds.where(
-            (ds.VCUR_SEADATANET_QC == 49)
-            & (ds.UCUR_SEADATANET_QC == 49)
-            #& (ds.WCUR_SEADATANET_QC == 49)
-            #& (ds.ECUR_SEADATANET_QC == 49)
-           # & (ds.PGOOD_SEADATANET_QC == 49)
-            #& (ds.ECI_SEADATANET_QC == 49)
-            #& (ds.BOTTOM_DEPTH_SEADATANET_QC == 49)
-           # & (ds.BATHY_SEADATANET_QC == 49)
-            & (ds.USHIP_SEADATANET_QC == 49)
-            & (ds.VSHIP_SEADATANET_QC == 49),
-            drop=False)
+    # Only the variables of each rule are masked, see xsadcp.qc
+    ds = apply_qc(ds, qc_policy)
     ds = ds[
                 [
                     "TIME",
@@ -366,46 +1250,125 @@ def transform_netCDF(ds,selected_file):
                 ]
             ]
     ds=fix_time(ds).swap_dims({"MAXZ":"PROFZ"}).set_xindex("TIME")
-    ds.to_netcdf('transformed_netCDF/'+selected_file,mode='w')
+    ds.to_netcdf('transformed_netCDF/'+selected_file,mode='w',engine=engine)
     return ds
 
 
-def get_info(file_name):
-    
-    from datetime import date, datetime, timedelta
-    from bs4 import BeautifulSoup
-#    file_path='https://data-eurogoship.ifremer.fr/copy_seadatanet/18000510_3_OVIDE2018_THALASSA_OS150_SDN2.nc'
-#    if local_pc:
-#        file_path = glob.glob("/Users/lfranc/Documents/octopus_ok/output/" + file_name)[0]
-#    else:
-#        file_path = fs.glob("https://data-eurogoship.ifremer.fr/copy_seadatanet/" + file_name)[0]
-    ds=open_ds(file_name)
-    transform_netCDF(ds,file_name)
-    
-    xml_path=BeautifulSoup(ds.SDN_XLINK.data[0][0].decode('utf-8'), 'xml').sdn_reference.get('href')
-#    print(xml_path)
-    user_interface_url = "/".join(xml_path.split("/")[:-1])
-    print('You can consult detailed information on this data at ', user_interface_url)
-    LOCAL_CDI_ID = ds.SDN_LOCAL_CDI_ID.data[0].decode('utf-8')
-    print('To download full dataset, please go to https://cdi.seadatanet.org/search ' + 
-          'and search with LOCAL_CDI_ID as',LOCAL_CDI_ID)
+def maxt_chunk_size(ds, max_memory="512MB"):
+    """
+    Number of MAXT samples whose transformation fits in `max_memory`.
 
-    ds = (
-        ds.squeeze()
-        .set_coords(["LATITUDE", "LONGITUDE", "TIME", "PROFZ"])
-#        .set_xindex("PROFZ")
-        .set_xindex("TIME")
+    The estimate counts the variables read by `transform_netCDF` (data and QC flags)
+    twice, once as read from the file and once after QC masking.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset as returned by `open_ds` (not loaded).
+        max_memory (int or str): Memory ceiling in bytes, or a string such as "512MB".
+
+    Returns:
+        int: Chunk size along MAXT.
+    """
+    from dask.utils import parse_bytes
+
+    names = [
+        "TIME", "USHIP", "VSHIP", "BATHY", "BOTTOM_DEPTH", "UCUR", "VCUR",
+        "UCUR_SEADATANET_QC", "VCUR_SEADATANET_QC",
+        "USHIP_SEADATANET_QC", "VSHIP_SEADATANET_QC",
+    ]
+    row_bytes = sum(
+        ds[name].dtype.itemsize * ds[name].size // ds.sizes["MAXT"]
+        for name in names if name in ds.variables
     )
+    return max(1, parse_bytes(max_memory) // (2 * max(1, row_bytes)))
 
-    time = ds["TIME"]
-    time = time.dropna(dim="MAXT", how="any")
-    jourjul = [greg_0h(jourjul) for jourjul in time.values]
-    # a=pd.DataFrame(a)
-    # c=pd.to_datetime(a)
-    date = [datetime(jourjul[0], jourjul[1], jourjul[2]) for jourjul in jourjul]
-    # d=[c.strftime('%Y-%m-%d') for c in c]
-    date_start = date[0]
-    date_end = date[-1]
+
+def transform_netCDF_chunked(file_name, base_path="/Users/todaka/data/goship/octopus_output_newprofz/",
+                             max_memory="512MB", qc_policy=None):
+    """
+    Transform a file like `transform_netCDF`, chunk by chunk along MAXT.
+
+    The file is opened lazily and split into dask chunks sized by `maxt_chunk_size`.
+    QC masking, PROFZ inversion and variable subsetting stay lazy, only TIME is
+    loaded to be fixed, and the chunks are computed one after the other while they
+    are written to transformed_netCDF/, so a cruise larger than memory can be processed.
+    The output is written with the netcdf4 engine, since the scipy writer keeps the
+    whole file in memory until it is closed.
+
+    Parameters:
+        file_name (str): Name of the file to transform.
+        base_path (str): Directory containing the file.
+        max_memory (int or str): Memory ceiling in bytes, or a string such as "512MB".
+        qc_policy (list, str or None): QC policy, see `xsadcp.qc.load_policy`.
+
+    Returns:
+        xarray.Dataset: The transformed dataset, backed by dask arrays.
+    """
+    import dask
+
+    ds = open_ds(file_name, base_path=base_path)
+    ds = ds.chunk({"MAXT": maxt_chunk_size(ds, max_memory)})
+    # One chunk in memory at a time
+    with dask.config.set(scheduler="synchronous"):
+        return transform_netCDF(ds, file_name, engine="netcdf4", qc_policy=qc_policy)
+
+
+def xlink_href(reference):
+    """
+    Return the link of an SDN_XLINK reference, such as
+    `<sdn_reference xlink:href="https://..." xlink:role="isDescribedBy"/>`.
+
+    Parameters:
+        reference (str): XML element of the reference, whose xlink prefix needs not be declared.
+
+    Returns:
+        str: The xlink:href attribute, None if the reference has none or is not XML.
+    """
+    import xml.etree.ElementTree as ET
+
+    xlink = "http://www.w3.org/1999/xlink"
+    # The char arrays of the files are padded with NUL or spaces
+    reference = reference.strip("\x00 ")
+    try:
+        root = ET.fromstring(f'<references xmlns:xlink="{xlink}">{reference}</references>')
+    except ET.ParseError:
+        return None
+    for element in root.iter():
+        href = element.get(f"{{{xlink}}}href")
+        if href is not None:
+            return href
+    return None
+
+def read_info(ds,file_name):
+    """
+    Collect the catalog information of a SeaDataNet file.
+
+    Only the global attributes, the SDN variables, TIME, LONGITUDE and LATITUDE are
+    read: the data variables of a lazily opened file are not loaded.
+
+    Parameters:
+        ds (xarray.Dataset): Dataset as returned by `open_ds`.
+        file_name (str): Name of the file.
+
+    Returns:
+        dict: Catalog information of the file.
+    """
+    from datetime import date, datetime, timedelta
+    import numpy as np
+
+    xml_path = xlink_href(ds.SDN_XLINK.data[0][0].decode('utf-8'))
+#    print(xml_path)
+    user_interface_url = "/".join(xml_path.split("/")[:-1]) if xml_path else None
+    logger.info('You can consult detailed information on this data at %s', user_interface_url)
+    LOCAL_CDI_ID = ds.SDN_LOCAL_CDI_ID.data[0].decode('utf-8')
+    logger.info('To download full dataset, please go to https://cdi.seadatanet.org/search '
+                'and search with LOCAL_CDI_ID as %s', LOCAL_CDI_ID)
+
+    time = ds["TIME"].values.ravel()
+    time = time[~np.isnan(time)]
+    # Only the first and last valid pings are needed for the catalog
+    date = julian_to_datetime64(time[[0, -1]]).astype("datetime64[D]")
+    date_start = date[0].astype(datetime)
+    date_end = date[-1].astype(datetime)
     date_start_str = date_start.strftime("%Y-%m-%d")
     date_end_str = date_end.strftime("%Y-%m-%d")
     # year=(date_start.year)
@@ -461,6 +1424,11 @@ def get_info(file_name):
          
         'user_interface_url' :  user_interface_url,
         'LOCAL_CDI_ID' : LOCAL_CDI_ID,
+        # Bounding box of the track, for the region filters of the catalog
+        'lon_min': float(np.nanmin(ds.LONGITUDE.values)),
+        'lon_max': float(np.nanmax(ds.LONGITUDE.values)),
+        'lat_min': float(np.nanmin(ds.LATITUDE.values)),
+        'lat_max': float(np.nanmax(ds.LATITUDE.values)),
     }
 
     #    - link to the downloading file,
@@ -471,7 +1439,66 @@ def get_info(file_name):
 
     return dict
 
-def get_file_names(path="/Users/todaka/data/goship/octopus_output_newprofz/",local_pc=True):
+
+@timed("get_info")
+def get_info(file_name,base_path="/Users/todaka/data/goship/octopus_output_newprofz/",transform=True):
+    """
+    Collect the catalog information of a SeaDataNet file, and optionally transform it.
+
+    Parameters:
+        file_name (str): Name of the file.
+        base_path (str): Directory containing the file.
+        transform (bool): Whether to also write the transformed file to transformed_netCDF/
+            (see `transform_netCDF`). Without it only the metadata is read, see `read_info`.
+
+    Returns:
+        dict: Catalog information of the file.
+    """
+    ds=open_ds(file_name,base_path=base_path)
+    if transform:
+        transform_netCDF(ds,file_name)
+    info = read_info(ds,file_name)
+    ds.close()
+    return info
+
+def as_finished(futures, skip_errors=True):
+    """
+    Yield the results of the futures of a pool as they complete, logging the progress of each file.
+
+    Parameters:
+        futures (dict): Mapping of each future to the name of the file it processes.
+        skip_errors (bool, optional): Whether a failed future is logged and skipped instead of
+            raising its error. Defaults to True.
+
+    Yields:
+        tuple: Name of the file and result of its future.
+    """
+    from concurrent.futures import as_completed
+
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            result = future.result()
+        except Exception as error:
+            if not skip_errors:
+                raise
+            logger.warning("%s failed: %s", name, error)
+            continue
+        logger.info("%s finished", name)
+        yield name, result
+
+def get_file_names(path="/Users/todaka/data/goship/octopus_output_newprofz/",local_pc=True,**storage_options):
+    """
+    List the SeaDataNet files of a directory.
+
+    Parameters:
+        path (str): Local directory, or URL of a remote directory when `local_pc` is False, ending with "/".
+        local_pc (bool): Whether `path` is a local directory.
+        **storage_options: Options of the fsspec filesystem of a remote directory.
+
+    Returns:
+        list: Names of the .nc files.
+    """
     import os
     import glob
 
@@ -480,7 +1507,9 @@ def get_file_names(path="/Users/todaka/data/goship/octopus_output_newprofz/",loc
         files_paths = glob.glob(files_path)
 
     else:
-        fs = fsspec.filesystem("https")
+        from .remote import remote_filesystem
+
+        fs = remote_filesystem(path, **storage_options)
         files_path =path+"*.nc"
         files_paths = fs.glob(files_path)
 
@@ -489,9 +1518,34 @@ def get_file_names(path="/Users/todaka/data/goship/octopus_output_newprofz/",loc
     return file_names
 
 
-def open_ds(file_name,base_path="/Users/todaka/data/goship/octopus_output_newprofz/",local_pc=True):
-    print("open ", file_name)
+def open_ds(file_name,base_path="/Users/todaka/data/goship/octopus_output_newprofz/",local_pc=True,
+            cache_dir="./data/remote_cache/",**storage_options):
+    """
+    Open a SeaDataNet file, local or remote.
+
+    Parameters:
+        file_name (str): Name of the file.
+        base_path (str): Local directory, or URL of a remote directory when `local_pc` is False.
+        local_pc (bool): Whether `base_path` is a local directory.
+        cache_dir (str, optional): Local cache of the remote files, see `fetch_files`. When None,
+            the remote file is read in memory instead of being downloaded (see `open_remote_dataset`).
+        **storage_options: Options of the fsspec filesystem of a remote directory.
+
+    Returns:
+        xarray.Dataset: The dataset, with TIME in julian days.
+    """
+    logger.info("open %s", file_name)
+    if local_pc:
+        file_path = base_path+file_name
+    elif cache_dir is not None:
+        from .remote import fetch_files
+
+        file_path = fetch_files(base_path, [file_name], cache_dir=cache_dir, workers=1, **storage_options)[0]
+    else:
+        from .remote import open_remote_dataset
+
+        return open_remote_dataset(base_path+file_name, **storage_options)
     ds = xr.open_dataset(
-            base_path+file_name, decode_cf=True, decode_times=False, engine="scipy"
+            file_path, decode_cf=True, decode_times=False, engine="scipy"
         )
     return ds